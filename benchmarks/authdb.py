@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Measures the latency of opening the DB, loading the registrations and the dispatch index, and closing it, as the hook does, in read-write and in read-only mode. Fails if the plan of any query of the hook has a full scan."""
+
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from plumbum import cli
+
+from startup import repoRoot
+
+sys.path.insert(0, str(repoRoot))
+
+from pkgman_triggers.AuthDB import AuthDB  # pylint:disable=wrong-import-position
+
+defaultCounts = (10, 1000)
+
+
+def populate(dbPath: Path, count: int) -> None:
+	with AuthDB(dbPath) as db:
+		for i in range(count):
+			packageId = db.registerPackage("fake_dist_" + str(i), "/site-packages/fake_dist_" + str(i))
+			db.setPackageEnabled(packageId, True)
+			db.setTriggerEnabled(db.registerTrigger(packageId, "trigger"), True)
+		db.saveDispatchArtifact(b"\0" * 32, b"\0" * (64 * count))
+
+
+def measureOnce(dbPath: Path, readOnly: bool) -> float:
+	start = time.perf_counter()
+	with AuthDB(dbPath, readOnly=readOnly) as db:
+		db.loadRegistrations(True)
+		db.loadDispatchArtifact(b"\0" * 32)
+	return time.perf_counter() - start
+
+
+def findFullScans(dbPath: Path) -> list:
+	with AuthDB(dbPath, readOnly=True) as db:
+		return db.findFullScans()
+
+
+def measure(count: int, runs: int) -> dict:
+	with tempfile.TemporaryDirectory() as tmpDir:
+		dbPath = Path(tmpDir) / "authDb.sqlite"
+		populate(dbPath, count)
+		return {
+			"triggers": count,
+			"fullScans": findFullScans(dbPath),
+			"rw": statistics.median(measureOnce(dbPath, False) for _ in range(runs)),
+			"ro": statistics.median(measureOnce(dbPath, True) for _ in range(runs)),
+		}
+
+
+class AuthDBBenchmarkCLI(cli.Application):
+	"""Measures open + query + close latency of the DB"""
+
+	runs = cli.SwitchAttr(["-r", "--runs"], int, default=200, help="Count of runs to take median of")
+
+	def main(self, *counts):  # pylint:disable=arguments-differ
+		counts = [int(c) for c in counts] or defaultCounts
+		print("triggers\trw, ms\tro, ms")
+		fullScans = []
+		for count in counts:
+			res = measure(count, self.runs)
+			fullScans.extend(res["fullScans"])
+			print(str(res["triggers"]) + "\t" + format(res["rw"] * 1000, ".3f") + "\t" + format(res["ro"] * 1000, ".3f"))
+
+		for query, step in fullScans:
+			print("Full scan in the hook query", query + ":", step)
+		return 1 if fullScans else 0
+
+
+if __name__ == "__main__":
+	AuthDBBenchmarkCLI.run()
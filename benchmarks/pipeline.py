@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Feeds a synthetic dpkg transaction through `backends.dpkg.process` and reports the time taken and the peak RSS.
+
+A transaction this large doesn't fit into the environment of `exec`, so the child process sets `DPKG_TRIGGERER_PACKAGES_INFO` itself."""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from plumbum import cli
+
+from startup import makeFakeDists, repoRoot, setupCode
+
+defaultCounts = (0, 20000)
+
+measureCode = """
+import json, os, resource, sys, time
+with open(sys.argv[2], "rb") as f:
+	os.environb[b"DPKG_TRIGGERER_PACKAGES_INFO"] = f.read()
+start = time.perf_counter()
+from pkgman_triggers.backends.dpkg import process
+process([])
+res = {"time": time.perf_counter() - start, "maxRSS": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+with open(sys.argv[1], "wt") as f:
+	json.dump(res, f)
+"""
+
+
+def bencodeStr(s: str) -> bytes:
+	b = s.encode("utf-8")
+	return str(len(b)).encode("ascii") + b":" + b
+
+
+def makeTransaction(adminDir: Path, count: int, dists: int, pathsPerPackage: int) -> bytes:
+	"""Returns the bencoded `DPKG_TRIGGERER_PACKAGES_INFO` for `count` packages and creates their `.list` files. Each package is matched by the trigger of one of the fake dists."""
+
+	infoDir = adminDir / "info"
+	infoDir.mkdir(parents=True)
+	(adminDir / "status").write_bytes(b"")
+
+	res = [b"d"]
+	for i in range(count):
+		name = "fake_dist_" + str(i % dists if dists else i) + "-pkg-" + str(i)
+		(infoDir / (name + ":amd64.list")).write_text("".join("/usr/lib/" + name + "/file" + str(j) + "\n" for j in range(pathsPerPackage)))
+		res.append(bencodeStr(name) + b"d" + bencodeStr("A") + bencodeStr("amd64") + bencodeStr("V") + bencodeStr("1.0") + b"e")
+	res.append(b"e")
+	return b"".join(res)
+
+
+def runPython(code: str, workDir: Path, env: dict, *args) -> None:
+	subprocess.run((sys.executable, "-W", "ignore", "-c", code) + args, cwd=str(workDir), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+
+def measure(count: int, dists: int, pathsPerPackage: int) -> dict:
+	with tempfile.TemporaryDirectory() as tmpDir:
+		tmpDir = Path(tmpDir)
+		siteDir = tmpDir / "site-packages"
+		workDir = tmpDir / "work"
+		adminDir = tmpDir / "dpkg"
+		siteDir.mkdir()
+		workDir.mkdir()
+		makeFakeDists(siteDir, dists, 1)
+
+		env = dict(os.environ)
+		env["PYTHONPATH"] = os.pathsep.join((str(repoRoot), str(siteDir)))
+		runPython(setupCode, workDir, env)
+
+		env["DPKG_ADMINDIR"] = str(adminDir)
+		env["DPKG_HOOK_ACTION"] = "post-invoke"
+		payloadPath = tmpDir / "payload.benc"
+		payloadPath.write_bytes(makeTransaction(adminDir, count, dists, pathsPerPackage))
+
+		resultPath = tmpDir / "result.json"
+		runPython(measureCode, workDir, env, str(resultPath), str(payloadPath))
+		res = json.loads(resultPath.read_text())
+		res["packages"] = count
+		return res
+
+
+class PipelineBenchmarkCLI(cli.Application):
+	"""Measures the time and the peak RSS of a hook run processing a synthetic transaction of the given count of packages"""
+
+	dists = cli.SwitchAttr(["-d", "--dists"], int, default=50, help="Count of fake distributions, each declaring a trigger")
+	pathsPerPackage = cli.SwitchAttr(["-p", "--paths"], int, default=10, help="Count of files in each package")
+
+	def main(self, *counts):  # pylint:disable=arguments-differ
+		counts = [int(c) for c in counts] or defaultCounts
+		print("packages\ttime, s\tpeak RSS, KiB")
+		for count in counts:
+			res = measure(count, self.dists, self.pathsPerPackage)
+			print(str(res["packages"]) + "\t" + format(res["time"], ".3f") + "\t" + str(res["maxRSS"]))
+
+
+if __name__ == "__main__":
+	PipelineBenchmarkCLI.run()
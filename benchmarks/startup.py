@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Measures the cold-start time of `python -m pkgman_triggers.backends.dpkg` with a varying count of installed distributions"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from plumbum import cli
+
+repoRoot = Path(__file__).absolute().parent.parent
+sys.path.insert(0, str(repoRoot))
+
+from pkgman_triggers.defaults import configPath, discoveryCachePath  # pylint:disable=wrong-import-position
+
+defaultCounts = (0, 100, 2000)
+
+# registers and enables all the fake dists and their triggers, so the hook has the DB to open and the triggers to load
+setupCode = """
+from pkgman_triggers import TriggerManager
+from pkgman_triggers.util import universalKeys
+with TriggerManager() as tm:
+	ms = tm.registerPackages(tuple(universalKeys(tm.unknownModules)))
+	tm.setPackagesEnabled(ms, True)
+	tm.registerTriggers((m, tIdx) for m in ms for tIdx in tuple(universalKeys(m.unknownTriggers)))
+	tm.setTriggersEnabled((t for m in ms for t in m.registeredTriggers.values()), True)
+"""
+
+
+def makeFakeDists(siteDir: Path, count: int, triggersEach: int = 10) -> None:
+	"""Creates `count` fake `*.dist-info` distributions. Each `triggersEach`th of them declares a trigger."""
+
+	for i in range(count):
+		name = "fake_dist_" + str(i)
+		distInfo = siteDir / (name + "-1.0.dist-info")
+		distInfo.mkdir(parents=True)
+		(distInfo / "METADATA").write_text("Metadata-Version: 2.1\nName: " + name + "\nVersion: 1.0\n")
+		if triggersEach and not i % triggersEach:
+			(distInfo / "entry_points.txt").write_text("[pkgman_triggers]\n" + name + '@{"packages": ["' + name + '"]} = ' + name + ":trigger\n")
+			(siteDir / (name + ".py")).write_text("def trigger(matchResults):\n\tpass\n")
+
+
+def makeEnv(siteDir: Path) -> dict:
+	env = dict(os.environ)
+	env["PYTHONPATH"] = os.pathsep.join((str(repoRoot), str(siteDir)))
+	env["DPKG_HOOK_ACTION"] = "post-invoke"
+	env.pop("DPKG_TRIGGERER_PACKAGES_INFO", None)
+	return env
+
+
+def runHook(siteDir: Path, workDir: Path) -> float:
+	env = makeEnv(siteDir)
+	start = time.perf_counter()
+	subprocess.run((sys.executable, "-m", "pkgman_triggers.backends.dpkg"), cwd=str(workDir), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+	return time.perf_counter() - start
+
+
+def measure(count: int, runs: int) -> dict:
+	with tempfile.TemporaryDirectory() as tmpDir:
+		tmpDir = Path(tmpDir)
+		siteDir = tmpDir / "site-packages"
+		workDir = tmpDir / "work"
+		siteDir.mkdir()
+		workDir.mkdir()
+		makeFakeDists(siteDir, count)
+		subprocess.run((sys.executable, "-W", "ignore", "-c", setupCode), cwd=str(workDir), env=makeEnv(siteDir), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+		dbPath = workDir / configPath
+		cachePath = workDir / discoveryCachePath
+		assert dbPath.is_file(), "The setup has not created the DB"
+
+		cold = []
+		warm = []
+		for _ in range(runs):
+			cachePath.unlink()
+			cold.append(runHook(siteDir, workDir))
+			assert cachePath.is_file(), "The hook has not run the discovery"
+			warm.append(runHook(siteDir, workDir))
+
+	return {"dists": count, "cold": statistics.median(cold), "warm": statistics.median(warm)}
+
+
+class StartupBenchmarkCLI(cli.Application):
+	"""Measures the hook startup time with all the fake dists registered and enabled. The cold run has no discovery cache, the warm one has it."""
+
+	runs = cli.SwitchAttr(["-r", "--runs"], int, default=5, help="Count of runs to take median of")
+
+	def main(self, *counts):  # pylint:disable=arguments-differ
+		counts = [int(c) for c in counts] or defaultCounts
+		print("dists\tcold, s\twarm, s")
+		for count in counts:
+			res = measure(count, self.runs)
+			print(str(res["dists"]) + "\t" + format(res["cold"], ".3f") + "\t" + format(res["warm"], ".3f"))
+
+
+if __name__ == "__main__":
+	StartupBenchmarkCLI.run()
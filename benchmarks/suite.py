@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Runs the whole hook pipeline on synthetic distributions and a synthetic dpkg transaction and reports the throughput of discovery, matching and dispatch, taken from the metrics the hook writes.
+
+The fake distributions declare triggers of all the kinds of conditions: exact package names, prefixes, regexes and path globs. The hook is run twice: with the discovery cache absent and with it populated. The results are appended to a JSON lines file and compared to the last previous result with the same parameters."""
+
+import json
+import os
+import subprocess
+import tempfile
+from pathlib import Path
+
+from plumbum import cli
+
+from pipeline import makeTransaction, measureCode, runPython, setupCode
+from startup import repoRoot
+
+defaultResultsPath = Path(__file__).absolute().parent / "results.jsonl"
+discoveryCacheName = "pkgman_triggers_discoveryCache.json"
+
+
+def makeConditions(distIdx: int, epIdx: int) -> dict:
+	"""Conditions matching the packages of `makeTransaction`, of a kind depending on `epIdx`"""
+
+	prefix = "fake_dist_" + str(distIdx) + "-pkg-"
+	kind = epIdx % 4
+	if kind == 0:
+		return {"packages": [prefix + str(epIdx) + "$"]}
+	if kind == 1:
+		return {"packages": [prefix + ".*"]}
+	if kind == 2:
+		return {"packages": [prefix + "[0-9]*" + str(epIdx) + "$"]}
+	return {"paths": ["/usr/lib/" + prefix + "*/file" + str(epIdx)]}
+
+
+def makeDists(siteDir: Path, count: int, entryPointsEach: int) -> None:
+	for i in range(count):
+		name = "fake_dist_" + str(i)
+		distInfo = siteDir / (name + "-1.0.dist-info")
+		distInfo.mkdir(parents=True)
+		(distInfo / "METADATA").write_text("Metadata-Version: 2.1\nName: " + name + "\nVersion: 1.0\n")
+		eps = "".join(name + "_" + str(j) + "@" + json.dumps(makeConditions(i, j)) + " = " + name + ":trigger\n" for j in range(entryPointsEach))
+		(distInfo / "entry_points.txt").write_text("[pkgman_triggers]\n" + eps)
+		(siteDir / (name + ".py")).write_text("def trigger(matchResults):\n\tpass\n")
+
+
+def getVersion() -> str:
+	try:
+		return subprocess.run(("git", "describe", "--always", "--dirty"), cwd=str(repoRoot), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout.decode("utf-8").strip()
+	except (OSError, subprocess.CalledProcessError):
+		return "unknown"
+
+
+def getThroughputs(metrics: dict) -> dict:
+	timers = metrics["timers"]
+	counters = metrics["counters"]
+
+	def rate(count, *phases):
+		duration = sum(timers.get(p, 0.) for p in phases)
+		return count / duration if duration else None
+
+	return {
+		"discovery": rate(counters.get("triggersDiscovered", 0), "discovery"),
+		"matching": rate(counters.get("events", 0), "eventDecode", "matching"),
+		"dispatch": rate(counters.get("invocations", 0), "resolve", "execution"),
+	}
+
+
+def measure(dists: int, entryPointsEach: int, packages: int, pathsPerPackage: int) -> dict:
+	with tempfile.TemporaryDirectory() as tmpDir:
+		tmpDir = Path(tmpDir)
+		siteDir = tmpDir / "site-packages"
+		workDir = tmpDir / "work"
+		adminDir = tmpDir / "dpkg"
+		siteDir.mkdir()
+		workDir.mkdir()
+		makeDists(siteDir, dists, entryPointsEach)
+
+		env = dict(os.environ)
+		env["PYTHONPATH"] = os.pathsep.join((str(repoRoot), str(siteDir)))
+		runPython(setupCode, workDir, env)
+
+		env["DPKG_ADMINDIR"] = str(adminDir)
+		env["DPKG_HOOK_ACTION"] = "post-invoke"
+		payloadPath = tmpDir / "payload.benc"
+		payloadPath.write_bytes(makeTransaction(adminDir, packages, dists, pathsPerPackage))
+
+		res = {}
+		for label in ("cold", "warm"):
+			if label == "cold":
+				(workDir / discoveryCacheName).unlink()
+			metricsPath = tmpDir / (label + ".metrics.jsonl")
+			env["PKGMAN_TRIGGERS_METRICS"] = str(metricsPath)
+			runPython(measureCode, workDir, env, str(tmpDir / "result.json"), str(payloadPath))
+			run = json.loads((tmpDir / "result.json").read_text())
+			run["metrics"] = json.loads(metricsPath.read_text().splitlines()[-1])
+			run["throughput"] = getThroughputs(run["metrics"])
+			res[label] = run
+		return res
+
+
+def findPrevious(resultsPath: Path, params: dict) -> dict:
+	prev = None
+	try:
+		with resultsPath.open("rt", encoding="utf-8") as f:
+			for l in f:
+				rec = json.loads(l)
+				if rec["params"] == params:
+					prev = rec
+	except OSError:
+		pass
+	return prev
+
+
+def formatRate(value, prevValue) -> str:
+	if value is None:
+		return "-"
+	res = format(value, ".0f") + "/s"
+	if prevValue:
+		res += " (" + format((value / prevValue - 1) * 100, "+.1f") + "%)"
+	return res
+
+
+class SuiteBenchmarkCLI(cli.Application):
+	"""Measures discovery, matching and dispatch throughput of the hook and stores the results"""
+
+	dists = cli.SwitchAttr(["-d", "--dists"], int, default=200, help="Count of fake distributions")
+	entryPointsEach = cli.SwitchAttr(["-e", "--entry-points"], int, default=8, help="Count of triggers in each distribution")
+	packages = cli.SwitchAttr(["-n", "--packages"], int, default=2000, help="Count of packages in the transaction")
+	pathsPerPackage = cli.SwitchAttr(["-p", "--paths"], int, default=10, help="Count of files in each package")
+	resultsPath = cli.SwitchAttr(["-o", "--results"], str, default=str(defaultResultsPath), help="The JSON lines file to store the results into")
+
+	def main(self):  # pylint:disable=arguments-differ
+		params = {"dists": self.dists, "entryPointsEach": self.entryPointsEach, "packages": self.packages, "pathsPerPackage": self.pathsPerPackage}
+		resultsPath = Path(self.resultsPath)
+		prev = findPrevious(resultsPath, params)
+
+		res = measure(**params)
+		rec = {"version": getVersion(), "params": params, "runs": res}
+		with resultsPath.open("at", encoding="utf-8") as f:
+			f.write(json.dumps(rec) + "\n")
+
+		if prev is not None:
+			print("Compared to", prev["version"])
+		print("run\ttime, s\tpeak RSS, KiB\tdiscovery\tmatching\tdispatch")
+		for label, run in res.items():
+			prevThroughput = prev["runs"][label]["throughput"] if prev is not None else {}
+			print("\t".join([label, format(run["time"], ".3f"), str(run["maxRSS"])] + [formatRate(run["throughput"][k], prevThroughput.get(k, None)) for k in ("discovery", "matching", "dispatch")]))
+
+
+if __name__ == "__main__":
+	SuiteBenchmarkCLI.run()
@@ -1,10 +1,18 @@
+import fnmatch
+import logging
+import time
 import typing
 import sqlite3
 from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
 
 from .defaults import configPath
 
+logger = logging.getLogger(__name__)
+
+MAX_QUERY_PARAMS = 999  # the default limit of the SQLite versions before 3.32
+
 DB_SCHEMA = OrderedDict(
 	(
 		(
@@ -39,19 +47,127 @@ DB_SCHEMA = OrderedDict(
 				FOREIGN KEY(`trigger`) REFERENCES `triggers`(`id`)
 			""",
 		),
+		(
+			"queue",
+			"""
+				`id` INTEGER NOT NULL PRIMARY KEY,
+				`trigger` INTEGER NOT NULL,
+				`matchResults` TEXT NOT NULL,
+				`enqueued` REAL NOT NULL,
+				`attempts` INTEGER DEFAULT 0 NOT NULL,
+				`lastError` TEXT,
+				FOREIGN KEY(`trigger`) REFERENCES `triggers`(`id`)
+			""",
+		),
+		(
+			"dispatchArtifacts",
+			"""
+				`hash` BLOB NOT NULL PRIMARY KEY,
+				`data` BLOB NOT NULL
+			""",
+		),
 	)
 )
 
 
+DB_INDEXES = OrderedDict(
+	(
+		("packages_status", "`packages` (`status`, `path`, `name`)"),
+		("triggers_package_status", "`triggers` (`package`, `status`, `name`)"),
+		("queue_trigger", "`queue` (`trigger`)"),
+	)
+)
+
+
+def createTables(*names: str) -> typing.Tuple[str, ...]:
+	return tuple("CREATE TABLE IF NOT EXISTS `" + name + "` (" + DB_SCHEMA[name] + ");" for name in names)
+
+
+def createIndexes(*names: str) -> typing.Tuple[str, ...]:
+	return tuple("CREATE INDEX IF NOT EXISTS `" + name + "` ON " + DB_INDEXES[name] + ";" for name in names)
+
+
+def iterChunks(items: typing.Sequence, size: int = MAX_QUERY_PARAMS) -> typing.Iterator[typing.Sequence]:
+	for i in range(0, len(items), size):
+		yield items[i : i + size]
+
+
+def makePlaceholders(count: int) -> str:
+	return ", ".join("?" * count)
+
+
+# The statements upgrading the schema from the version equal to the index to the next one. Only append new ones: an existing DB is upgraded in place by applying the ones after its `user_version`.
+MIGRATIONS = (
+	createTables("packages", "triggers", "conditions", "dispatchArtifacts"),  # the DBs created before the versioning have some of them
+	createTables("queue"),
+	createIndexes("packages_status", "triggers_package_status", "queue_trigger") + ("ANALYZE;",),
+	("DROP INDEX IF EXISTS `packages_status`;",) + createIndexes("packages_status") + ("ANALYZE;",),  # the names are loaded too
+)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+LOAD_REGISTRATIONS_QUERY = "SELECT p.`id` AS `packageId`, p.`name` AS `packageName`, p.`path`, p.`status` AS `packageStatus`, t.`id` AS `triggerId`, t.`name`, t.`status` AS `triggerStatus` FROM `packages` p LEFT JOIN `triggers` t ON t.`package` = p.`id`;"
+LOAD_ACTIVE_REGISTRATIONS_QUERY = "SELECT p.`id` AS `packageId`, p.`name` AS `packageName`, p.`path`, p.`status` AS `packageStatus`, t.`id` AS `triggerId`, t.`name`, t.`status` AS `triggerStatus` FROM `packages` p JOIN `triggers` t ON t.`package` = p.`id` AND t.`status` = 1 WHERE p.`status` = 1;"
+LOAD_DISPATCH_ARTIFACT_QUERY = "SELECT `data` FROM `dispatchArtifacts` WHERE `hash` = ?;"
+
+# The queries run by the hook, with sample parameters
+HOOK_QUERIES = (
+	(LOAD_ACTIVE_REGISTRATIONS_QUERY, ()),
+	(LOAD_DISPATCH_ARTIFACT_QUERY, (b"",)),
+)
+
+
+class NothingRegisteredError(FileNotFoundError):
+	"""The DB opened read-only doesn't exist, since nothing has been registered yet"""
+
+
+class GarbageCollectionReport:
+	"""The counts of the rows deleted by table, the sizes of the DB files in bytes and the times of the hot queries in seconds, before and after `AuthDB.collectGarbage`"""
+
+	__slots__ = ("deleted", "sizeBefore", "sizeAfter", "queryTimeBefore", "queryTimeAfter")
+
+	def __init__(self) -> None:
+		self.deleted = {}
+		self.sizeBefore = None
+		self.sizeAfter = None
+		self.queryTimeBefore = None
+		self.queryTimeAfter = None
+
+	@property
+	def reclaimed(self) -> int:
+		return self.sizeBefore - self.sizeAfter
+
+	@property
+	def speedup(self) -> typing.Optional[float]:
+		return self.queryTimeBefore / self.queryTimeAfter if self.queryTimeAfter else None
+
+	def describe(self) -> str:
+		res = "Deleted " + ", ".join(str(count) + " " + table for table, count in self.deleted.items()) + "; "
+		res += "the DB is " + format(self.sizeAfter / 1024, ".1f") + " KiB, " + format(self.reclaimed / 1024, ".1f") + " KiB reclaimed; "
+		res += "the hot queries take " + format(self.queryTimeBefore * 1000, ".3f") + " ms -> " + format(self.queryTimeAfter * 1000, ".3f") + " ms"
+		if self.speedup is not None:
+			res += " (x" + format(self.speedup, ".2f") + ")"
+		return res
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "<" + self.describe() + ">"
+
+
 class AuthDB:
-	__slots__ = ("db", "dbPath")
+	"""The DB of registered and enabled triggers.
+
+	The DB is in WAL mode, so the hook reading it is not blocked by the CLI or the GUI writing it. A read-only instance (the one used in the hook) opens the file with `mode=ro`, never creates or upgrades the schema and never commits."""
 
-	def __init__(self, dbPath: typing.Optional[Path] = None) -> None:
+	__slots__ = ("db", "dbPath", "readOnly", "busyTimeout", "transactionDepth")
+
+	def __init__(self, dbPath: typing.Optional[Path] = None, readOnly: bool = False, busyTimeout: float = 5.0) -> None:
 		if dbPath is None:
 			dbPath = configPath
 
 		self.dbPath = dbPath
+		self.readOnly = readOnly
+		self.busyTimeout = busyTimeout
 		self.db = None
+		self.transactionDepth = 0
 
 	def findPackageByPath(self, path: Path) -> sqlite3.Row:
 		try:
@@ -64,27 +180,100 @@ class AuthDB:
 		return res.lastrowid
 
 	def registerTrigger(self, packageId, name):
-		print("packageId", repr(packageId))
+		logger.debug("Registering trigger %r of package %r", name, packageId)
 		res = self.db.execute("INSERT INTO `triggers` (`package`, `name`) VALUES (:packageId, :name) ON CONFLICT (`package`, `name`) DO UPDATE SET `package` = `package`, `name` = `name`;", {"packageId": packageId, "name": name})
 		return res.lastrowid
 
+	def setPackagePath(self, iD: int, path: Path) -> sqlite3.Cursor:
+		return self.db.execute("UPDATE `packages` SET `path` = :path WHERE `id` = :id;", {"id": iD, "path": str(path)})
+
 	def setPackageEnabled(self, iD: int, status: bool) -> sqlite3.Cursor:
 		return self.db.execute("UPDATE `packages` SET `status` = :status WHERE `id` = :id;", {"id": iD, "status": status})
 
 	def setTriggerEnabled(self, iD: int, status: bool) -> sqlite3.Cursor:
-		print('UPDATE `triggers` SET `status` = ' + repr(status) + ' WHERE `id` = ' + repr(iD) + ';')
+		logger.debug("Setting status of trigger %r to %r", iD, status)
 		return self.db.execute("UPDATE `triggers` SET `status` = :status WHERE `id` = :id;", {"id": iD, "status": status})
 
+	@contextmanager
+	def transaction(self) -> typing.Iterator["AuthDB"]:
+		"""Runs the statements within a single explicit transaction, rolled back if an exception is raised. Nested transactions are merged into the outermost one."""
+
+		if self.transactionDepth:
+			self.transactionDepth += 1
+			try:
+				yield self
+			finally:
+				self.transactionDepth -= 1
+			return
+
+		if self.db.in_transaction:
+			self.commit()
+		self.db.execute("BEGIN;")
+		self.transactionDepth = 1
+		try:
+			yield self
+		except BaseException:
+			self.db.rollback()
+			raise
+		finally:
+			self.transactionDepth = 0
+		self.commit()
+
+	def registerPackages(self, packages: typing.Iterable[typing.Tuple[str, Path]]) -> typing.Dict[str, int]:
+		"""Registers many `(name, path)` packages at once. Returns their ids by path."""
+
+		packages = [{"name": name, "path": str(path)} for name, path in packages]
+		self.db.executemany("INSERT INTO `packages` (`name`, `path`) VALUES (:name, :path) ON CONFLICT (`path`) DO UPDATE SET `name` = `name`, `path` = `path`;", packages)
+		paths = list({p["path"] for p in packages})
+		res = {}
+		for chunk in iterChunks(paths):
+			res.update((r["path"], r["id"]) for r in self.db.execute("SELECT `id`, `path` FROM `packages` WHERE `path` IN (" + makePlaceholders(len(chunk)) + ");", chunk))
+		return res
+
+	def registerTriggers(self, triggers: typing.Iterable[typing.Tuple[int, str]]) -> typing.Dict[typing.Tuple[int, str], int]:
+		"""Registers many `(packageId, name)` triggers at once. Returns their ids by `(packageId, name)`."""
+
+		triggers = [{"packageId": packageId, "name": name} for packageId, name in triggers]
+		self.db.executemany("INSERT INTO `triggers` (`package`, `name`) VALUES (:packageId, :name) ON CONFLICT (`package`, `name`) DO UPDATE SET `package` = `package`, `name` = `name`;", triggers)
+		keys = {(t["packageId"], t["name"]) for t in triggers}
+		res = {}
+		for chunk in iterChunks(list({packageId for packageId, _ in keys})):
+			res.update(((r["package"], r["name"]), r["id"]) for r in self.db.execute("SELECT `id`, `package`, `name` FROM `triggers` WHERE `package` IN (" + makePlaceholders(len(chunk)) + ");", chunk) if (r["package"], r["name"]) in keys)
+		return res
+
+	def setPackagesEnabled(self, ids: typing.Iterable[int], status: bool) -> sqlite3.Cursor:
+		return self.db.executemany("UPDATE `packages` SET `status` = :status WHERE `id` = :id;", ({"id": iD, "status": status} for iD in ids))
+
+	def setTriggersEnabled(self, ids: typing.Iterable[int], status: bool) -> sqlite3.Cursor:
+		return self.db.executemany("UPDATE `triggers` SET `status` = :status WHERE `id` = :id;", ({"id": iD, "status": status} for iD in ids))
+
 	def unregisterTriggerById(self, iD):
-		print('delete from `triggers` where `id` = "' + str(iD) + '";')
+		logger.debug("Deleting trigger %r", iD)
+		self.db.execute("delete from `conditions` where `trigger` = :triggerId;", {"triggerId": iD})
+		self.db.execute("delete from `queue` where `trigger` = :triggerId;", {"triggerId": iD})
 		return self.db.execute("delete from `triggers` where `id` = :triggerId;", {"triggerId": iD})
 
 	def unregisterPackageTriggersByParentId(self, iD):
-		return self.db.execute("delete from `triggers` where `package` = :packageId;", {"packageId": iD})
+		return self.unregisterPackagesTriggersByParentIds((iD,))
+
+	def unregisterPackagesTriggersByParentIds(self, ids: typing.Iterable[int]) -> sqlite3.Cursor:
+		ids = [{"packageId": iD} for iD in ids]
+		self.db.executemany("delete from `conditions` where `trigger` in (select `id` from `triggers` where `package` = :packageId);", ids)
+		self.db.executemany("delete from `queue` where `trigger` in (select `id` from `triggers` where `package` = :packageId);", ids)
+		return self.db.executemany("delete from `triggers` where `package` = :packageId;", ids)
 
 	def unregisterPackageById(self, iD):
-		print('delete from `packages` where `id` = ' + str(iD) + '";')
-		return self.db.execute("delete from `packages` where `id` = :packageId;", {"packageId": iD})
+		"""Deletes the package with its triggers and everything referencing them"""
+
+		return self.unregisterPackagesByIds((iD,))
+
+	def unregisterPackagesByIds(self, ids: typing.Iterable[int]) -> sqlite3.Cursor:
+		"""Deletes many packages at once with their triggers and everything referencing them"""
+
+		ids = list(ids)
+		logger.debug("Deleting packages %r", ids)
+		self.unregisterPackagesTriggersByParentIds(ids)
+		return self.db.executemany("delete from `packages` where `id` = :packageId;", ({"packageId": iD} for iD in ids))
 
 	def findTriggerByModuleAndName(self, packageId: int, name: str) -> sqlite3.Row:
 		try:
@@ -92,8 +281,161 @@ class AuthDB:
 		except StopIteration:
 			return None
 
+	def loadRegistrations(self, activeOnly: bool = False) -> typing.Tuple[typing.Dict[str, dict], typing.Dict[typing.Tuple[int, str], dict]]:
+		"""Loads the registered packages and their triggers in a single query, only the enabled triggers of the enabled packages if `activeOnly`. Returns the dicts of packages keyed by path and of triggers keyed by `(packageId, name)`"""
+
+		packages = {}
+		triggers = {}
+		for r in self.db.execute(LOAD_ACTIVE_REGISTRATIONS_QUERY if activeOnly else LOAD_REGISTRATIONS_QUERY):
+			packageId = r["packageId"]
+			if r["path"] not in packages:
+				packages[r["path"]] = {"id": packageId, "name": r["packageName"], "status": r["packageStatus"]}
+			if r["triggerId"] is not None:
+				triggers[(packageId, r["name"])] = {"id": r["triggerId"], "status": r["triggerStatus"]}
+		return packages, triggers
+
+	def iterRegistrations(self, enabledOnly: bool = False, packageName: typing.Optional[str] = None, triggerNameGlob: typing.Optional[str] = None) -> typing.Iterator[sqlite3.Row]:
+		"""Yields the registered triggers joined with their packages as they are fetched, filtered within the query: only the enabled triggers of the enabled packages, only the package named `packageName`, only the triggers which names match the shell-style glob, by the rules of `fnmatch.fnmatchcase` (SQLite `GLOB` negates classes with `^` instead of `!`). The packages without triggers are yielded with `NULL` trigger columns, unless the triggers are filtered. The rows of a package are consecutive."""
+
+		on = ["t.`package` = p.`id`"]
+		where = []
+		if enabledOnly:
+			on.append("t.`status` = 1")
+			where.append("p.`status` = 1")
+		if triggerNameGlob is not None:
+			self.db.create_function("fnmatchcase", 2, fnmatch.fnmatchcase)
+			on.append("fnmatchcase(t.`name`, :triggerNameGlob)")
+		if packageName is not None:
+			where.append("p.`name` = :packageName")
+
+		query = "SELECT p.`id` AS `packageId`, p.`name` AS `packageName`, p.`path`, p.`status` AS `packageStatus`, t.`id` AS `triggerId`, t.`name`, t.`status` AS `triggerStatus` FROM `packages` p "
+		query += ("JOIN" if enabledOnly or triggerNameGlob is not None else "LEFT JOIN") + " `triggers` t ON " + " AND ".join(on)
+		if where:
+			query += " WHERE " + " AND ".join(where)
+		query += " ORDER BY p.`id`, t.`id`;"
+		yield from self.db.execute(query, {"packageName": packageName, "triggerNameGlob": triggerNameGlob})
+
+	def setTriggerConditions(self, triggerId: int, conditions: typing.Iterable[typing.Tuple[bytes, int]]) -> None:
+		"""Replaces the conditions of a trigger with the given `(hash, type)` pairs"""
+
+		self.db.execute("DELETE FROM `conditions` WHERE `trigger` = ?;", (triggerId,))
+		self.db.executemany("INSERT OR IGNORE INTO `conditions` (`trigger`, `hash`, `type`) VALUES (?, ?, ?);", ((triggerId, h, tp) for h, tp in conditions))
+
+	def loadDispatchArtifact(self, key: bytes) -> typing.Optional[bytes]:
+		for r in self.db.execute(LOAD_DISPATCH_ARTIFACT_QUERY, (key,)):
+			return r[0]
+		return None
+
+	def saveDispatchArtifact(self, key: bytes, data: bytes) -> None:
+		"""Stores the prebuilt dispatch index. Only the latest one is kept, since any other is for a set of triggers that is no longer active."""
+
+		self.db.execute("DELETE FROM `dispatchArtifacts`;")
+		self.db.execute("INSERT INTO `dispatchArtifacts` (`hash`, `data`) VALUES (?, ?);", (key, data))
+
+	def enqueue(self, records: typing.Iterable[typing.Tuple[int, str]]) -> int:
+		"""Puts `(triggerId, serialized match results)` records into the queue. Returns their count."""
+
+		return self.db.executemany("INSERT INTO `queue` (`trigger`, `matchResults`, `enqueued`) VALUES (?, ?, ?);", ((triggerId, matchResults, time.time()) for triggerId, matchResults in records)).rowcount
+
+	def fetchQueued(self, limit: int, maxAttempts: typing.Optional[int] = None, afterId: int = 0) -> typing.List[sqlite3.Row]:
+		"""Returns the oldest queued records with ids greater than `afterId` which have been attempted less than `maxAttempts` times"""
+
+		if maxAttempts is None:
+			return list(self.db.execute("SELECT * FROM `queue` WHERE `id` > ? ORDER BY `id` LIMIT ?;", (afterId, limit)))
+		return list(self.db.execute("SELECT * FROM `queue` WHERE `id` > ? AND `attempts` < ? ORDER BY `id` LIMIT ?;", (afterId, maxAttempts, limit)))
+
+	def deleteQueued(self, ids: typing.Iterable[int]) -> sqlite3.Cursor:
+		return self.db.executemany("DELETE FROM `queue` WHERE `id` = ?;", ((iD,) for iD in ids))
+
+	def markQueuedFailed(self, failures: typing.Iterable[typing.Tuple[int, str]]) -> sqlite3.Cursor:
+		"""Counts a failed attempt for each of `(id, error)` records"""
+
+		return self.db.executemany("UPDATE `queue` SET `attempts` = `attempts` + 1, `lastError` = ? WHERE `id` = ?;", ((error, iD) for iD, error in failures))
+
 	def findConditionsByTrigger(self, triggerId: int):
-		res = list(self.db.execute("SELECT * FROM `conditions` t where t.`package` = ?;", (triggerId,)))
+		res = list(self.db.execute("SELECT * FROM `conditions` c where c.`trigger` = ?;", (triggerId,)))
+		return res
+
+	def explainQueryPlan(self, query: str, params: typing.Sequence = ()) -> typing.List[str]:
+		return [r["detail"] for r in self.db.execute("EXPLAIN QUERY PLAN " + query, params)]
+
+	def findFullScans(self, queries: typing.Iterable[typing.Tuple[str, typing.Sequence]] = HOOK_QUERIES) -> typing.List[typing.Tuple[str, str]]:
+		"""Returns `(query, step)` pairs for the steps of the plans of `(query, params)` pairs scanning a whole table or index instead of searching it"""
+
+		res = []
+		for query, params in queries:
+			for step in self.explainQueryPlan(query, params):
+				if step.startswith("SCAN") and step != "SCAN CONSTANT ROW":
+					res.append((query, step))
+		return res
+
+	def deleteGarbage(self, installedPaths: typing.Iterable[str], installedTriggers: typing.Iterable[typing.Tuple[int, str]]) -> typing.Dict[str, int]:
+		"""Deletes the packages not in `installedPaths`, the triggers not in `installedTriggers` (`(packageId, name)` pairs) and the conditions and the queued invocations of the deleted triggers. Returns the counts of the deleted rows by table."""
+
+		self.db.execute("CREATE TEMP TABLE IF NOT EXISTS `installedPaths` (`path` TEXT NOT NULL PRIMARY KEY);")
+		self.db.execute("CREATE TEMP TABLE IF NOT EXISTS `installedTriggers` (`package` INTEGER NOT NULL, `name` TEXT NOT NULL, PRIMARY KEY(package, name));")
+		try:
+			self.db.executemany("INSERT OR IGNORE INTO temp.`installedPaths` (`path`) VALUES (?);", ((str(path),) for path in installedPaths))
+			self.db.executemany("INSERT OR IGNORE INTO temp.`installedTriggers` (`package`, `name`) VALUES (?, ?);", installedTriggers)
+
+			garbageTriggers = "SELECT t.`id` FROM `triggers` t WHERE NOT EXISTS (SELECT 1 FROM temp.`installedTriggers` i WHERE i.`package` = t.`package` AND i.`name` = t.`name`)"
+			res = OrderedDict()
+			res["conditions"] = self.db.execute("DELETE FROM `conditions` WHERE `trigger` IN (" + garbageTriggers + ");").rowcount
+			res["queue"] = self.db.execute("DELETE FROM `queue` WHERE `trigger` IN (" + garbageTriggers + ");").rowcount
+			res["triggers"] = self.db.execute("DELETE FROM `triggers` WHERE `id` IN (" + garbageTriggers + ");").rowcount
+			res["packages"] = self.db.execute("DELETE FROM `packages` WHERE `path` NOT IN (SELECT `path` FROM temp.`installedPaths`);").rowcount
+		finally:
+			self.db.execute("DELETE FROM temp.`installedPaths`;")
+			self.db.execute("DELETE FROM temp.`installedTriggers`;")
+		return res
+
+	def getFilesSize(self) -> int:
+		"""The size of the DB file and its WAL on disk, in bytes"""
+
+		res = 0
+		for path in (self.dbPath, self.dbPath.parent / (self.dbPath.name + "-wal")):
+			try:
+				res += path.stat().st_size
+			except OSError:
+				pass
+		return res
+
+	def timeHotQueries(self, repeats: int = 5, queries: typing.Iterable[typing.Tuple[str, typing.Sequence]] = HOOK_QUERIES) -> float:
+		"""The best time of running all the `(query, params)` pairs, by default the ones run by the hook, in seconds"""
+
+		queries = tuple(queries)
+		res = None
+		for _i in range(repeats):
+			started = time.perf_counter()
+			for query, params in queries:
+				self.db.execute(query, params).fetchall()
+			duration = time.perf_counter() - started
+			if res is None or duration < res:
+				res = duration
+		return res
+
+	def compact(self) -> None:
+		"""Rebuilds the indexes, updates the statistics for the query planner, rebuilds the file dropping the free pages and truncates the WAL"""
+
+		self.commit()
+		self.db.execute("REINDEX;")
+		self.db.execute("ANALYZE;")
+		self.commit()
+		self.db.execute("VACUUM;")
+		self.db.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+
+	def collectGarbage(self, installedPaths: typing.Iterable[str], installedTriggers: typing.Iterable[typing.Tuple[int, str]]) -> "GarbageCollectionReport":
+		"""Deletes the rows of the packages and the triggers no longer installed (see `deleteGarbage`) and compacts the DB"""
+
+		res = GarbageCollectionReport()
+		self.commit()
+		res.sizeBefore = self.getFilesSize()
+		res.queryTimeBefore = self.timeHotQueries()
+		with self.transaction():
+			res.deleted = self.deleteGarbage(installedPaths, installedTriggers)
+		self.compact()
+		res.sizeAfter = self.getFilesSize()
+		res.queryTimeAfter = self.timeHotQueries()
 		return res
 
 	def getTables(self) -> typing.Iterator[str]:
@@ -106,44 +448,55 @@ class AuthDB:
 				self.db.executescript("DROP TABLE " + tableName + ";")
 			except sqlite3.OperationalError:
 				pass
+		self.db.execute("PRAGMA user_version = 0;")
+
+	def getSchemaVersion(self) -> int:
+		return self.db.execute("PRAGMA user_version;").fetchone()[0]
 
 	def isInitialized(self) -> bool:
-		curTables = set(self.getTables())
-		for tableName in DB_SCHEMA:
-			if tableName not in curTables:
-				return False
-		return True
+		return self.getSchemaVersion() == SCHEMA_VERSION
+
+	def connect(self) -> sqlite3.Connection:
+		if self.readOnly:
+			if not self.dbPath.is_file():
+				raise NothingRegisteredError("The DB " + str(self.dbPath) + " doesn't exist")
+			return sqlite3.connect(self.dbPath.absolute().as_uri() + "?mode=ro", uri=True, timeout=self.busyTimeout)
+
+		self.dbPath.parent.mkdir(parents=True, exist_ok=True)
+		db = sqlite3.connect(str(self.dbPath), timeout=self.busyTimeout)
+		db.execute("PRAGMA journal_mode = WAL;")
+		db.execute("PRAGMA synchronous = NORMAL;")
+		return db
 
 	def __enter__(self) -> "AuthDB":
-		needCreate = False
 		if not self.db:
-			needCreate = needCreate and not self.dbPath.exists()
-			dbDir = self.dbPath.parent
-			dbDir.mkdir(parents=True, exist_ok=True)
-			self.db = sqlite3.connect(str(self.dbPath))
+			self.db = self.connect()
 			self.db.row_factory = sqlite3.Row
 			self.db.execute("PRAGMA foreign_keys = ON;")
-			if not self.isInitialized():
-				self.initDB()
-
-		if needCreate:
-			self.initDB()
+			version = self.getSchemaVersion()
+			if version != SCHEMA_VERSION:
+				if self.readOnly or version > SCHEMA_VERSION:
+					self.__exit__(None, None, None)
+					raise ValueError("The DB " + str(self.dbPath) + " has schema version " + str(version) + ", " + str(SCHEMA_VERSION) + " is expected." + (" Run the CLI to upgrade it." if version < SCHEMA_VERSION else ""))
+				self.migrate(version)
 
 		return self
 
-	def initDB(self):
-		self.drop()
-		self.initSchema()
-
 	def commit(self) -> None:
 		self.db.commit()
 
-	def initSchema(self):
-		for name, ddl in DB_SCHEMA.items():
-			self.db.executescript("CREATE TABLE `" + name + "` (" + ddl + ");")
-		self.commit()
+	def migrate(self, version: int) -> None:
+		"""Upgrades the schema in place from `version` to `SCHEMA_VERSION`, each step in its own transaction"""
+
+		for i in range(version, SCHEMA_VERSION):
+			logger.info("Upgrading the schema of %s from version %d to %d", self.dbPath, i, i + 1)
+			with self.transaction():
+				for statement in MIGRATIONS[i]:
+					self.db.execute(statement)
+				self.db.execute("PRAGMA user_version = " + str(i + 1) + ";")
 
 	def __exit__(self, *args, **kwargs) -> None:
-		self.commit()
+		if not self.readOnly:
+			self.commit()
 		self.db.close()
 		self.db = None
@@ -1,18 +1,29 @@
+import json
+import logging
 import typing
 import warnings
 from collections import OrderedDict
-import pkg_resources
-from pkg_resources import EntryPoint
-import json
 import re
+import time
+import zlib
 
+from .logs import configureLogging
+from .events import uniqueEvents
+from .coalescing import CoalescingSpool, getCoalesceWindow
 from .PackageInfo import PackageInfo
 from .triggers import Trigger, Module, TemporaryID
 from .matchers import *
-from .AuthDB import AuthDB
+from .AuthDB import AuthDB, GarbageCollectionReport, NothingRegisteredError
+from .discovery import DiscoveredEntryPoint, discoverEntryPoints, splitEncodedName
+from .dispatch import DispatchIndex, getConditionHash, getTriggersSetHash
+from .execution import Dispatcher, ExecutionReport, ExecutorKind, makePortable
+from .metrics import Metrics, getMetricsTarget
 
 
+configureLogging()
+logger = logging.getLogger(__name__)
 validNameRx = re.compile("^[a-zA-Z][\\w-]+$")
+gcInterpreterNote = "Since only the packages visible to the current interpreter are discovered, run it with the interpreter the hook is run with."
 
 def findFirstFreeUnusedCellInUnknown(coll) -> int:
 	i = 0
@@ -21,20 +32,13 @@ def findFirstFreeUnusedCellInUnknown(coll) -> int:
 	return i
 
 
-def recognizeBackends(ep: EntryPoint) -> Trigger:
+def recognizeBackends(ep: DiscoveredEntryPoint) -> Trigger:
 	if hasattr(ep.__class__, "__slots__") and "metadata" in ep.__class__.__slots__:
 		metadata = ep.metadata
 	else:
-		encoded = ep.name.split("@", 1)
-		if len(encoded) > 1:
-			try:
-				metadata = json.loads(encoded[1])
-				ep.name = encoded[0].strip()
-			except json.JSONDecodeError:
-				warnings.warn("Entry point " + repr(ep) + " is invalid. The value after @ must be must be a valid JSON!.")
-				return None
+		ep.name, metadata = splitEncodedName(ep.name)
 
-	print("metadata", metadata)
+	logger.debug("Metadata of %r: %r", ep, metadata)
 	if metadata:
 		if not validNameRx.match(ep.name):
 			warnings.warn("Trigger name is invalid. Must match " + repr(validNameRx))
@@ -46,50 +50,91 @@ def recognizeBackends(ep: EntryPoint) -> Trigger:
 			warnings.warn("Entry point " + repr(ep) + " is invalid. Either paths or named or packages must be specified.")
 			return None
 
+		batch = metadata.get("batch", True)
+		ordered = metadata.get("ordered", False)
+		if not isinstance(batch, bool) or not isinstance(ordered, bool):
+			warnings.warn("Entry point " + repr(ep) + " is invalid. `batch` and `ordered` must be booleans.")
+			return None
+
+		executor = metadata.get("executor", ExecutorKind.thread)
+		if executor not in ExecutorKind.all:
+			warnings.warn("Entry point " + repr(ep) + " is invalid. `executor` must be one of " + repr(sorted(ExecutorKind.all)) + ".")
+			return None
+
+		timeout = metadata.get("timeout", None)
+		if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0):
+			warnings.warn("Entry point " + repr(ep) + " is invalid. `timeout` must be a positive number of seconds.")
+			return None
+
 		matchers = []
 
-		if packages:
-			for pkg in packages:
-				if isinstance(pkg, str):
-					matchers.append(PackageNameMatcher(re.compile(pkg)))
-		else:
-			warnings.warn("Other matchers are not yet implemented.")
+		for pkg in packages:
+			if isinstance(pkg, str):
+				matchers.append(PackageNameMatcher(pkg))
+
+		for path in paths:
+			if isinstance(path, str):
+				matchers.append(PathMatcher(path))
 
-		return Trigger(ep, matchers)
+		if named:
+			warnings.warn("`named` matchers are not yet implemented.")
+
+		return Trigger(ep, matchers, batch, executor, timeout, ordered)
 
 	warnings.warn("Entry point " + repr(ep) + " is invalid. JSON metadata must be present!.")
 	return None
 
 
 class TriggerManager:
-	__slots__ = ("registeredModules", "unknownModules", "db")
+	__slots__ = ("registeredModules", "unknownModules", "db", "dispatchIndex", "batch", "maxWorkers", "defaultTimeout", "maxPending", "maxCoroutines", "readOnly", "activeOnly", "coalesceWindow", "metrics", "metricsTarget")
+
+	def __init__(self, batch: bool = True, maxWorkers: typing.Optional[int] = None, defaultTimeout: typing.Optional[float] = None, maxPending: int = 256, maxCoroutines: typing.Optional[int] = 64, readOnly: bool = False, activeOnly: bool = False, coalesceWindow: typing.Optional[float] = None, metricsTarget: typing.Optional[str] = None) -> None:
+		"""`activeOnly` loads only the enabled triggers of the enabled modules, which is enough for dispatching. `metricsTarget` defaults to the one set in the env."""
 
-	def __init__(self) -> None:
-		self.db = AuthDB()
+		self.readOnly = readOnly
+		self.activeOnly = activeOnly
+		self.metrics = Metrics()
+		self.metricsTarget = metricsTarget if metricsTarget is not None else getMetricsTarget()
+		self.coalesceWindow = coalesceWindow
+		self.db = AuthDB(readOnly=readOnly)
 		self.registeredModules = None
 		self.unknownModules = None
+		self.dispatchIndex = None
+		self.batch = batch
+		self.maxWorkers = maxWorkers
+		self.defaultTimeout = defaultTimeout
+		self.maxPending = maxPending
+		self.maxCoroutines = maxCoroutines
 
 	def __enter__(self) -> "TriggerManager":
-		self.db = self.db.__enter__()
-		pts = pkg_resources.iter_entry_points(group="pkgman_triggers")
-		triggers = sorted(filter(None, map(recognizeBackends, pts)), key=lambda t: (t.moduleName, t.path))
-		print(triggers)
+		with self.metrics.timer("dbOpen"):
+			self.db = self.db.__enter__()
+		with self.metrics.timer("discovery"):
+			triggers = sorted(filter(None, map(recognizeBackends, discoverEntryPoints())), key=lambda t: (t.moduleName, t.path))
+		logger.debug("Triggers discovered: %r", triggers)
 		modules = {}
+		with self.metrics.timer("dbLoad"):
+			registeredPackages, registeredTriggers = self.db.loadRegistrations(self.activeOnly)
+		self.metrics.count("triggersDiscovered", len(triggers))
+		discoveredPaths = {str(t.path) for t in triggers}
+		movedPackages = {info["name"]: (path, info) for path, info in registeredPackages.items() if path not in discoveredPaths}
 
 		self.registeredModules = OrderedDict()
 		self.unknownModules = {}
+		self.dispatchIndex = None
 
 		for t in triggers:
 			dId = id(t.entryPoint.dist)
 			module = modules.get(dId, None)
 			if module is None:
 				module = modules[dId] = Module(t.entryPoint.dist)
-				print("module.dist", module.dist)
-				print("module.name", module.name)
-				pkgInfo = self.db.findPackageByPath(t.path)
+				logger.debug("Module %r of %r", module.name, module.dist)
+				pkgInfo = registeredPackages.get(str(t.path), None)
+				if pkgInfo is None:
+					pkgInfo = self.findMovedPackage(module, movedPackages)
 
 				if pkgInfo:
-					print(dict(pkgInfo))
+					logger.debug("Module %r is registered: %r", module.name, pkgInfo)
 					module.id = pkgInfo["id"]
 					module.status = pkgInfo["status"]
 					self.registeredModules[module.id] = module
@@ -99,7 +144,7 @@ class TriggerManager:
 					self.unknownModules[module.id] = module
 
 			t.module = module
-			trigInfo = self.db.findTriggerByModuleAndName(module.id, t.internalName)
+			trigInfo = registeredTriggers.get((module.id, t.internalName), None) if module.registered else None
 			if trigInfo:
 				t.id = trigInfo["id"]
 				t.status = trigInfo["status"]
@@ -111,38 +156,90 @@ class TriggerManager:
 
 		return self
 
+	def findMovedPackage(self, module: Module, movedPackages: typing.Dict[str, typing.Tuple[str, dict]]) -> typing.Optional[dict]:
+		"""Finds by name (it is unique) a registration with an outdated path and rewrites the path. `movedPackages` are the registrations not matching any discovered path, as `(path, info)` by name."""
+
+		moved = movedPackages.pop(module.name, None)
+		if moved is None:
+			return None
+
+		oldPath, pkgInfo = moved
+		logger.info("Module %r is registered with an outdated path %s, updating it to %s", module.name, oldPath, module.path)
+		if not self.readOnly:
+			self.db.setPackagePath(pkgInfo["id"], module.path)
+		return pkgInfo
+
 	def setPackageEnabled(self, m: Module, status: typing.Optional[int]):
 		self.db.setPackageEnabled(m.id, status)
 		m.status = status
+		self.dispatchIndex = None
 
 	def setTriggerEnabled(self, t: Trigger, status: typing.Optional[int]):
 		self.db.setTriggerEnabled(t.id, status)
 		t.status = status
+		self.dispatchIndex = None
+
+	def setPackagesEnabled(self, modules: typing.Iterable[Module], status: typing.Optional[int]) -> None:
+		"""Like `setPackageEnabled`, but for many modules within a single transaction"""
+
+		modules = tuple(modules)
+		with self.db.transaction():
+			self.db.setPackagesEnabled((m.id for m in modules), status)
+		for m in modules:
+			m.status = status
+		self.dispatchIndex = None
+
+	def setTriggersEnabled(self, triggers: typing.Iterable[Trigger], status: typing.Optional[int]) -> None:
+		"""Like `setTriggerEnabled`, but for many triggers within a single transaction"""
+
+		triggers = tuple(triggers)
+		with self.db.transaction():
+			self.db.setTriggersEnabled((t.id for t in triggers), status)
+		for t in triggers:
+			t.status = status
+		self.dispatchIndex = None
 
 	def registerPackage(self, idx):
-		pkg = self.unknownModules[idx]
-		registeredIdx = self.db.registerPackage(pkg.name, pkg.path)
-		if isinstance(pkg.id, TemporaryID):
-			pkg.id = registeredIdx
-			assert registeredIdx not in self.registeredModules
-			self.registeredModules[registeredIdx] = pkg
-			del self.unknownModules[idx]
-		else:
-			assert pkg.id == registeredIdx
-		return pkg
+		return self.registerPackages((idx,))[0]
+
+	def registerPackages(self, idxs: typing.Iterable[int]) -> typing.List[Module]:
+		"""Registers many unregistered modules within a single transaction. Returns them."""
+
+		pkgs = [(idx, self.unknownModules[idx]) for idx in idxs]
+		with self.db.transaction():
+			registeredIdxs = self.db.registerPackages((pkg.name, pkg.path) for idx, pkg in pkgs)
+
+		for idx, pkg in pkgs:
+			registeredIdx = registeredIdxs[str(pkg.path)]
+			if isinstance(pkg.id, TemporaryID):
+				pkg.id = registeredIdx
+				assert registeredIdx not in self.registeredModules
+				self.registeredModules[registeredIdx] = pkg
+				del self.unknownModules[idx]
+			else:
+				assert pkg.id == registeredIdx
+		return [pkg for idx, pkg in pkgs]
 
 	def registerTrigger(self, package, idx):
-		t = package.unknownTriggers[idx]
-		registeredIdx = self.db.registerTrigger(package.id, t.internalName)
-		print("registeredIdx", repr(registeredIdx))
-		if isinstance(t.id, TemporaryID):
-			t.id = registeredIdx
-			print("t.id", repr(t.id))
-			assert registeredIdx not in package.registeredTriggers
-			package.registeredTriggers[registeredIdx] = t
-			del package.unknownTriggers[idx]
-		else:
-			assert t.id == registeredIdx
+		self.registerTriggers(((package, idx),))
+
+	def registerTriggers(self, pairs: typing.Iterable[typing.Tuple[Module, int]]) -> None:
+		"""Registers many unregistered triggers, given as `(module, idx)` pairs, within a single transaction"""
+
+		triggers = [(package, idx, package.unknownTriggers[idx]) for package, idx in pairs]
+		with self.db.transaction():
+			registeredIdxs = self.db.registerTriggers((package.id, t.internalName) for package, idx, t in triggers)
+
+			for package, idx, t in triggers:
+				registeredIdx = registeredIdxs[(package.id, t.internalName)]
+				if isinstance(t.id, TemporaryID):
+					t.id = registeredIdx
+					assert registeredIdx not in package.registeredTriggers
+					package.registeredTriggers[registeredIdx] = t
+					del package.unknownTriggers[idx]
+				else:
+					assert t.id == registeredIdx
+				self.saveTriggerConditions(t)
 
 	def unregisterTrigger(self, trigger):
 		dbId = trigger.id
@@ -150,28 +247,195 @@ class TriggerManager:
 		trigger.id = TemporaryID(findFirstFreeUnusedCellInUnknown(trigger.module.unknownTriggers))
 		trigger.module.unknownTriggers[trigger.id] = trigger
 		self.db.unregisterTriggerById(dbId)
+		self.dispatchIndex = None
 
 	def unregisterPackage(self, package):
-		dbId = package.id
+		"""Unregisters the package with all its triggers"""
 
-		del self.registeredModules[package.id]
-		package.id = TemporaryID(findFirstFreeUnusedCellInUnknown(self.unknownModules))
-		self.unknownModules[package.id] = package
+		self.unregisterPackages((package,))
 
-		#self.db.unregisterPackageTriggersByParentId(package.id)
-		self.db.unregisterPackageById(dbId)
+	def unregisterPackages(self, packages: typing.Iterable[Module]) -> None:
+		"""Unregisters many packages with all their triggers within a single transaction"""
 
-	def __exit__(self, *args, **kwargs) -> None:
-		self.db.__exit__(*args, **kwargs)
+		packages = list(OrderedDict((package.id, package) for package in packages).values())  # a package may be selected several times
+		with self.db.transaction():
+			self.db.unregisterPackagesByIds(package.id for package in packages)
+
+		for package in packages:
+			for t in list(package.registeredTriggers.values()):
+				del package.registeredTriggers[t.id]
+				t.id = TemporaryID(findFirstFreeUnusedCellInUnknown(package.unknownTriggers))
+				t.status = False
+				package.unknownTriggers[t.id] = t
+
+			del self.registeredModules[package.id]
+			package.id = TemporaryID(findFirstFreeUnusedCellInUnknown(self.unknownModules))
+			package.status = False
+			self.unknownModules[package.id] = package
+		self.dispatchIndex = None
+
+	def collectGarbage(self) -> GarbageCollectionReport:
+		"""Deletes from the DB the packages and the triggers no longer discovered and compacts it. See `gcInterpreterNote`."""
+
+		res = self.db.collectGarbage((str(m.path) for m in self.registeredModules.values()), ((m.id, t.internalName) for m in self.registeredModules.values() for t in m.registeredTriggers.values()))
+		logger.info("Garbage collected: %s", res.describe())
+		return res
+
+	def __exit__(self, exc_type, *args, **kwargs) -> None:
+		if not self.readOnly and exc_type is None:
+			self.getDispatchIndex()
+		self.db.__exit__(exc_type, *args, **kwargs)
+		if self.metricsTarget:
+			self.metrics.write(self.metricsTarget)
+
+	def iterActiveTriggers(self) -> typing.Iterator[Trigger]:
+		for m in self.registeredModules.values():
+			if m.status:
+				for t in m.registeredTriggers.values():
+					if t.status:
+						yield t
+
+	def saveTriggerConditions(self, t: Trigger) -> None:
+		self.db.setTriggerConditions(t.id, [(getConditionHash(m), int(m.conditionType)) for m in t.matchers if m.conditionType is not None])
+
+	def getDispatchIndex(self) -> DispatchIndex:
+		"""The index is stored in the DB keyed on the hash of the active triggers and their conditions, so it is rebuilt only after the set of them has changed. A read-only manager builds the index in memory if the stored one is stale."""
+
+		if self.dispatchIndex is None:
+			with self.metrics.timer("dispatchIndex"):
+				self.dispatchIndex = self.loadDispatchIndex()
+		return self.dispatchIndex
+
+	def loadDispatchIndex(self) -> DispatchIndex:
+		triggers = sorted(self.iterActiveTriggers(), key=lambda t: t.id)  # the order of registration differs from the order of loading
+		key = getTriggersSetHash(triggers)
+		artifact = self.db.loadDispatchArtifact(key)
+		if artifact is not None:
+			try:
+				return DispatchIndex.fromArtifact(artifact, triggers)
+			except (ValueError, LookupError, zlib.error) as ex:
+				warnings.warn("The stored dispatch index is broken, rebuilding it: " + repr(ex))
+
+		self.metrics.count("dispatchIndexRebuilds")
+		index = DispatchIndex(triggers)
+		if not self.readOnly:
+			for t in triggers:
+				self.saveTriggerConditions(t)
+			self.db.saveDispatchArtifact(key, index.toArtifact())
+		return index
+
+	def openCoalescingSpool(self) -> typing.Optional[CoalescingSpool]:
+		"""Returns the spool to coalesce the events with, or `None` if coalescing is disabled or the spool cannot be opened"""
+
+		if not self.coalesceWindow:
+			return None
+		try:
+			return CoalescingSpool(self.coalesceWindow).__enter__()
+		except OSError as ex:
+			warnings.warn("Cannot open the coalescing spool, the events are not coalesced: " + str(ex))
+			return None
+
+	def iterInvocations(self, events, spool: typing.Optional[CoalescingSpool] = None) -> typing.Iterator[typing.Tuple[Trigger, typing.Any]]:
+		"""Yields the triggers matching the events with their match results: the batched ones once, after the events end, the rest per event. The events seen by `spool` within its window are dropped."""
+
+		index = self.getDispatchIndex()
+		batches = OrderedDict()
+		events = uniqueEvents(self.metrics.timedIter("eventDecode", events))
+		if spool is not None:
+			events = spool.filter(events)
 
-	def processEvents(self, events):
 		for evt in events:
-			self.processEvent(evt)
-
-	def processEvent(self, evt):
-		for m in self.registeredModules:
-			for t in m.registeredTriggers:
-				if t.status:
-					matchResults = t.match(evt)
-					if matchResults:
-						t(matchResults)
+			self.metrics.count("events")
+			started = time.perf_counter()
+			matched = index.match(evt)
+			self.metrics.addTime("matching", time.perf_counter() - started)
+			self.metrics.count("matches", len(matched))
+			for t, matchResults in matched.items():
+				if self.batch and t.batch:
+					if t.executor == ExecutorKind.process:
+						matchResults = makePortable(matchResults)  # would be converted on submission anyway, and the matched strings are lighter than `re.Match` objects
+					batches.setdefault(t, []).append(matchResults)
+				else:
+					yield t, matchResults
+
+		yield from batches.items()
+
+	def processEvents(self, events) -> ExecutionReport:
+		"""Runs the triggers matching the events and returns the report. The events are coalesced only if all the triggers have succeeded."""
+
+		spool = self.openCoalescingSpool()
+		try:
+			with Dispatcher(self.maxWorkers, self.defaultTimeout, self.maxPending, self.maxCoroutines, self.metrics) as dispatcher:
+				for t, matchResults in self.iterInvocations(events, spool):
+					dispatcher.submit(t, matchResults)
+				report = dispatcher.finish()
+			if spool is not None and not report.errors:
+				spool.commit()
+			return report
+		finally:
+			if spool is not None:
+				spool.__exit__(None, None, None)
+
+	def enqueueEvents(self, events, db: typing.Optional[AuthDB] = None) -> int:
+		"""Queues the triggers matching the events in the DB in a single transaction, to be run by `drain`. Returns the count queued. `db` is a writable connection for a read-only manager."""
+
+		if db is None:
+			db = self.db
+		spool = self.openCoalescingSpool()
+		try:
+			with db.transaction():
+				res = db.enqueue((t.id, json.dumps(makePortable(matchResults), default=str)) for t, matchResults in self.iterInvocations(events, spool))
+			if spool is not None:
+				spool.commit()
+			return res
+		finally:
+			if spool is not None:
+				spool.__exit__(None, None, None)
+
+	def drain(self, batchSize: int = 100, maxAttempts: typing.Optional[int] = 5) -> ExecutionReport:
+		"""Runs the queued triggers in a single pass over the queue. A failed one is left queued until it has been attempted `maxAttempts` times."""
+
+		activeTriggers = {t.id: t for t in self.iterActiveTriggers()}
+		report = ExecutionReport()
+		lastId = 0
+		while True:
+			records = self.db.fetchQueued(batchSize, maxAttempts, lastId)
+			if not records:
+				break
+			lastId = records[-1]["id"]
+
+			dropped = []
+			with Dispatcher(self.maxWorkers, self.defaultTimeout, self.maxPending, self.maxCoroutines, self.metrics) as dispatcher:
+				for r in records:
+					t = activeTriggers.get(r["trigger"], None)
+					if t is None:
+						warnings.warn("Trigger " + repr(r["trigger"]) + " is no longer active, dropping its queued invocation")
+						dropped.append(r["id"])
+						continue
+					dispatcher.submit(t, json.loads(r["matchResults"]), r["id"])
+				batchReport = dispatcher.finish()
+
+			with self.db.transaction():
+				self.db.deleteQueued(dropped + [res.tag for res in batchReport if res.ok])
+				self.db.markQueuedFailed((res.tag, repr(res.error)) for res in batchReport if not res.ok)
+			report.extend(batchReport)
+
+			if len(records) < batchSize:
+				break
+		return report
+
+	def processEvent(self, evt) -> ExecutionReport:
+		return self.processEvents((evt,))
+
+
+def openHookTriggerManager(readOnly: bool = True) -> typing.Optional[TriggerManager]:
+	"""Opens the manager of the active triggers for dispatching the hook calls. Returns `None` if there is nothing to dispatch."""
+
+	tm = TriggerManager(readOnly=readOnly, activeOnly=True, coalesceWindow=getCoalesceWindow())
+	try:
+		return tm.__enter__()
+	except NothingRegisteredError:
+		return None
+	except ValueError as ex:
+		warnings.warn(str(ex))
+		return None
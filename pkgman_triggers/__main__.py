@@ -1,15 +1,27 @@
+import csv
+import fnmatch
+import json
+import logging
+import os
+import sys
+from collections import OrderedDict
+from itertools import chain
 from pathlib import Path
 
 from plumbum import cli
 
 from RichConsole import groups
 
-from . import TriggerManager
+from . import TriggerManager, gcInterpreterNote
+from .AuthDB import AuthDB, NothingRegisteredError
 from .backends import dpkg
+from .defaults import daemonSocketPath
+from .metrics import metricsEnvVar, startProfiling
 from .triggers import moduleNameEpNameSeparator
 from .util import universalItems, universalKeys, universalValues
 
 backends = [dpkg]
+logger = logging.getLogger(__name__)
 
 
 class style:
@@ -25,7 +37,13 @@ class style:
 
 
 class CLI(cli.Application):
-	pass
+	@cli.switch(["--profile"], str, help="Dump the cProfile stats of the run into the file")
+	def profile(self, path):  # pylint:disable=no-self-use
+		startProfiling(path)
+
+	@cli.switch(["--metrics"], str, help="Append the timers and counters of the run to the JSON lines file, `-` for stderr")
+	def metrics(self, target):  # pylint:disable=no-self-use
+		os.environ[metricsEnvVar] = target
 
 
 statusMapping = {
@@ -39,18 +57,26 @@ def genCLIOnOff(status: int):
 	return statusMapping[bool(status)]
 
 
+def makeModuleStrRepr(iD, name: str, path, status: int):
+	modFancyName = style.moduleName(name)
+	if not status:
+		modFancyName = style.disabledName(modFancyName)
+	return style.ordinal(iD) + "\t" + modFancyName + "\t" + style.path(path) + "\t" + genCLIOnOff(status)
+
+
 def makeModuleRecordStrRepr(iD, m):
-	modFancyName = style.moduleName(m.name)
-	if not m.status:
+	return makeModuleStrRepr(iD, m.name, m.path, m.status)
+
+
+def makeTriggerStrRepr(iD, internalName: str, status: int):
+	modFancyName = moduleNameEpNameSeparator + style.internalName(internalName)
+	if not status:
 		modFancyName = style.disabledName(modFancyName)
-	return style.ordinal(iD) + "\t" + modFancyName + "\t" + style.path(m.path) + "\t" + genCLIOnOff(m.status)
+	return style.ordinal(iD) + "\t" + modFancyName + "\t" + genCLIOnOff(status)
 
 
 def makeTriggerRecordStrRepr(iD, t):
-	modFancyName = moduleNameEpNameSeparator + style.internalName(t.internalName)
-	if not t.status:
-		modFancyName = style.disabledName(modFancyName)
-	return style.ordinal(iD) + "\t" + modFancyName + "\t" + genCLIOnOff(t.status)
+	return makeTriggerStrRepr(iD, t.internalName, t.status)
 
 
 unregisteredMarker = "@"
@@ -87,7 +113,7 @@ class ParsedId:
 			pathCand = None
 
 		for idx, pkg in universalItems(self.collection):
-			print("pathCand", pathCand, pkg.path)
+			logger.debug("pathCand %r %r", pathCand, pkg.path)
 			if pkg.name == idStr or pkg.path == pathCand:
 				self.idx = idx
 				return
@@ -101,69 +127,198 @@ def printTriggersSection(label, marker, section):
 			print("\t" + makeTriggerRecordStrRepr(marker + str(i), m))
 
 
-def printModuleTriggers(module):
-	printTriggersSection("Registered", "", module.registeredTriggers)
-	printTriggersSection("Unregistered", unregisteredMarker, module.unknownTriggers)
+class ModuleCommandCLI(cli.Application):
+	processAllTriggers = cli.Flag(["-A", "--all-triggers"], help="Also enable all triggers")
+	processAll = cli.Flag(["-a", "--all"], help="Process all the packages")
+	globs = cli.SwitchAttr(["-g", "--glob"], str, list=True, help="Process the packages which names match the glob")
+
+	def iterSelected(self, collection):
+		"""Yields the idxs of the packages in the collection selected with `--all` and `--glob`"""
 
+		for idx, m in tuple(universalItems(collection)):
+			if self.processAll or any(fnmatch.fnmatchcase(m.name, g) for g in self.globs):
+				yield idx
 
-def printModulesSection(label, marker, section):
-	if section:
-		print(label + ":")
-		for i, m in universalItems(section):
-			print(makeModuleRecordStrRepr(marker + str(i), m))
-			printModuleTriggers(m)
 
+listFields = ("module", "moduleId", "moduleEnabled", "path", "trigger", "triggerId", "triggerEnabled")
+
+
+def makeRecordFromRow(r) -> dict:
+	hasTrigger = r["triggerId"] is not None
+	return {
+		"module": r["packageName"],
+		"moduleId": r["packageId"],
+		"moduleEnabled": bool(r["packageStatus"]),
+		"path": r["path"],
+		"trigger": r["name"],
+		"triggerId": r["triggerId"],
+		"triggerEnabled": bool(r["triggerStatus"]) if hasTrigger else None,
+	}
 
-class ModuleCommandCLI(cli.Application):
-	processAllTriggers = cli.Flag(["-A", "--all-triggers"], help="Also enable all triggers")
+
+def makeRecord(m, t) -> dict:
+	return {
+		"module": m.name,
+		"moduleId": m.id if m.registered else None,
+		"moduleEnabled": bool(m.status),
+		"path": str(m.path),
+		"trigger": t.internalName,
+		"triggerId": t.id if t.registered else None,
+		"triggerEnabled": bool(t.status),
+	}
+
+
+def writeJSON(records, f) -> None:
+	sep = "[\n"
+	for rec in records:
+		f.write(sep + json.dumps(rec))
+		sep = ",\n"
+	f.write("[]\n" if sep == "[\n" else "\n]\n")
+
+
+def writeJSONLines(records, f) -> None:
+	for rec in records:
+		f.write(json.dumps(rec) + "\n")
+
+
+def writeTSV(records, f) -> None:
+	w = csv.writer(f, delimiter="\t", lineterminator="\n")
+	w.writerow(listFields)
+	for rec in records:
+		w.writerow(["" if v is None else int(v) if isinstance(v, bool) else v for v in (rec[k] for k in listFields)])
+
+
+listFormats = {
+	"json": writeJSON,
+	"jsonl": writeJSONLines,
+	"tsv": writeTSV,
+}
 
 
 @CLI.subcommand("list")
 class ListCLI(cli.Application):
+	"""Lists the modules and their triggers. The machine-readable formats have a record per trigger with the fields `module`, `moduleId`, `moduleEnabled`, `path`, `trigger`, `triggerId` and `triggerEnabled`; the ids of the unregistered ones are null, the modules without triggers selected have no records. With `--registered` or `--enabled` the registered triggers are read from the DB, filtered in the query and written out as they are fetched, without discovering the installed ones."""
+
+	outputFormat = cli.SwitchAttr(["-f", "--format"], cli.Set("text", *listFormats), default="text", help="The output format")
+	registeredOnly = cli.Flag(["-r", "--registered"], help="Only the registered modules and triggers")
+	enabledOnly = cli.Flag(["-e", "--enabled"], help="Only the enabled triggers of the enabled modules. Implies --registered")
+	moduleName = cli.SwitchAttr(["-m", "--module"], str, default=None, help="Only the module with the name")
+	nameGlob = cli.SwitchAttr(["-n", "--name-glob"], str, default=None, help="Only the triggers which names match the shell-style glob")
+
+	def isModuleSelected(self, m) -> bool:
+		return self.moduleName is None or m.name == self.moduleName
+
+	def isTriggerSelected(self, t) -> bool:
+		return self.nameGlob is None or fnmatch.fnmatchcase(t.internalName, self.nameGlob)
+
+	def filterModules(self, section):
+		"""The selected modules of the section, each with only the selected triggers"""
+
+		res = OrderedDict()
+		for idx, m in universalItems(section):
+			if not self.isModuleSelected(m):
+				continue
+			triggers = [t for t in chain(universalValues(m.registeredTriggers), universalValues(m.unknownTriggers)) if self.isTriggerSelected(t)]
+			if self.nameGlob is not None and not triggers:
+				continue
+			res[idx] = (m, triggers)
+		return res
+
+	def iterDiscoveredRecords(self, tm):
+		for section in (tm.registeredModules, tm.unknownModules):
+			for m, triggers in self.filterModules(section).values():
+				for t in triggers:
+					yield makeRecord(m, t)
+
+	def iterRegisteredRows(self):
+		"""The rows of the packages without triggers selected are there too, with null trigger columns, unless the triggers are filtered"""
+
+		try:
+			with AuthDB(readOnly=True) as db:
+				yield from db.iterRegistrations(self.enabledOnly, self.moduleName, self.nameGlob)
+		except NothingRegisteredError:
+			return
+
+	def iterRegisteredRecords(self):
+		for r in self.iterRegisteredRows():
+			if r["triggerId"] is not None:
+				yield makeRecordFromRow(r)
+
+	def printRegisteredText(self) -> None:
+		lastPackageId = None
+		for r in self.iterRegisteredRows():
+			if r["packageId"] != lastPackageId:
+				if lastPackageId is None:
+					print("Registered:")
+				print(makeModuleStrRepr(str(r["packageId"]), r["packageName"], r["path"], r["packageStatus"]))
+				lastPackageId = r["packageId"]
+				if r["triggerId"] is not None:
+					print("\tRegistered:")
+			if r["triggerId"] is not None:
+				print("\t" + makeTriggerStrRepr(str(r["triggerId"]), r["name"], r["triggerStatus"]))
+
+	def printText(self, tm) -> None:
+		for label, marker, section in (("Registered", "", tm.registeredModules), ("Unregistered", unregisteredMarker, tm.unknownModules)):
+			selected = self.filterModules(section)
+			if not selected:
+				continue
+			print(label + ":")
+			for i, (m, triggers) in selected.items():
+				print(makeModuleRecordStrRepr(marker + str(i), m))
+				printTriggersSection("Registered", "", OrderedDict((t.id, t) for t in triggers if t.registered))
+				printTriggersSection("Unregistered", unregisteredMarker, OrderedDict((t.id, t) for t in triggers if not t.registered))
+
 	def main(self):  # pylint:disable=arguments-differ
-		with TriggerManager() as tm:
-			printModulesSection("Registered", "", tm.registeredModules)
-			printModulesSection("Unregistered", unregisteredMarker, tm.unknownModules)
+		try:
+			if self.registeredOnly or self.enabledOnly:
+				if self.outputFormat == "text":
+					self.printRegisteredText()
+				else:
+					listFormats[self.outputFormat](self.iterRegisteredRecords(), sys.stdout)
+			else:
+				with TriggerManager() as tm:
+					if self.outputFormat == "text":
+						self.printText(tm)
+					else:
+						listFormats[self.outputFormat](self.iterDiscoveredRecords(tm), sys.stdout)
+		except ValueError as ex:
+			print(ex, file=sys.stderr)
+			return 1
+		return 0
 
 
 @CLI.subcommand("register")
 class RegisterCLI(ModuleCommandCLI):
-	@staticmethod
-	def registerChildTriggers(tm, iD):
-		print("iD.pkg.unknownTriggers", iD.pkg.unknownTriggers)
-		for tId in tuple(universalKeys(iD.pkg.unknownTriggers)):
-			tm.registerTrigger(iD.pkg, tId)
-
 	def main(self, *ids):  # pylint:disable=arguments-differ
-		print("ids", ids)
+		logger.debug("ids %r", ids)
 		with TriggerManager() as tm:
+			toRegister = list(self.iterSelected(tm.unknownModules))
+			pkgs = []
 			for iD in ids:
 				iD = ParsedId(iD, tm)
-				pkg = iD.pkg
 				if iD.collection is not tm.registeredModules:
-					print("Registering", pkg)
-					newIdx = tm.registerPackage(iD.idx).id
-					iD.idx, iD.collection = newIdx, tm.registeredModules
-					print("Registering all the triggers in", pkg)
-					if self.processAllTriggers:
-						self.registerChildTriggers(tm, iD)
+					toRegister.append(iD.idx)
+				elif not self.processAllTriggers:
+					print("Unregistered packages ids are volatile and start from `" + unregisteredMarker + "`. `" + str(iD.idx) + "` was given")
 				else:
-					if not self.processAllTriggers:
-						print("Unregistered packages ids are volatile and start from `#`. `" + str(iD) + "` was given")
-					else:
-						self.registerChildTriggers(tm, iD)
+					pkgs.append(iD.pkg)
+
+			print("Registering", [tm.unknownModules[idx] for idx in toRegister])
+			pkgs.extend(tm.registerPackages(dict.fromkeys(toRegister)))
+
+			if self.processAllTriggers:
+				print("Registering all the triggers in", pkgs)
+				tm.registerTriggers((pkg, tId) for pkg in pkgs for tId in tuple(universalKeys(pkg.unknownTriggers)))
 
 
 class PackageToggleCLI(ModuleCommandCLI):
 	def toggle(self, desiredState, ids):
 		with TriggerManager() as tm:
-			for iD in ids:
-				iD = ParsedId(iD, tm)
-				tm.setPackageEnabled(iD.pkg, desiredState)
-				if self.processAllTriggers:
-					for t in tuple(universalValues(iD.pkg.registeredTriggers)):
-						print("t", t)
-						tm.setTriggerEnabled(t, desiredState)
+			pkgs = [ParsedId(iD, tm).pkg for iD in ids]
+			pkgs.extend(tm.registeredModules[idx] for idx in self.iterSelected(tm.registeredModules))
+			tm.setPackagesEnabled(pkgs, desiredState)
+			if self.processAllTriggers:
+				tm.setTriggersEnabled((t for pkg in pkgs for t in universalValues(pkg.registeredTriggers)), desiredState)
 
 
 @CLI.subcommand("enable")
@@ -184,9 +339,53 @@ class CleanCLI(ModuleCommandCLI):
 
 	def main(self, *ids):
 		with TriggerManager() as tm:
-			for iD in ids:
-				iD = ParsedId(iD, tm)
-				tm.unregisterPackage(iD.pkg)
+			pkgs = [ParsedId(iD, tm).pkg for iD in ids]
+			pkgs.extend(tm.registeredModules[idx] for idx in self.iterSelected(tm.registeredModules))
+			tm.unregisterPackages(pkgs)
+
+
+@CLI.subcommand("gc")
+class GarbageCollectCLI(cli.Application):
+	DESCRIPTION = "Deletes from the DB the packages and the triggers no longer installed and compacts it. " + gcInterpreterNote
+
+	def main(self):  # pylint:disable=arguments-differ
+		with TriggerManager() as tm:
+			report = tm.collectGarbage()
+
+		for table, count in report.deleted.items():
+			print("Deleted from", table + ":", count)
+		print("DB size:", report.sizeBefore, "->", report.sizeAfter, "bytes,", report.reclaimed, "reclaimed")
+		print("Hot queries:", format(report.queryTimeBefore * 1000, ".3f"), "->", format(report.queryTimeAfter * 1000, ".3f"), "ms")
+
+
+@CLI.subcommand("drain")
+class DrainCLI(cli.Application):
+	"""Runs the triggers queued by the hook in the spool mode"""
+
+	batchSize = cli.SwitchAttr(["-b", "--batch-size"], int, default=100, help="Count of queued invocations to run at once")
+	maxAttempts = cli.SwitchAttr(["-m", "--max-attempts"], int, default=5, help="Failed invocations are retried until attempted this many times")
+
+	def main(self):  # pylint:disable=arguments-differ
+		with TriggerManager() as tm:
+			report = tm.drain(self.batchSize, self.maxAttempts)
+
+		print("Invocations run:", len(report), "failed:", len(report.errors))
+		for res in report.errors:
+			print(style.red(repr(res.trigger)), repr(res.error))
+
+
+@CLI.subcommand("daemon")
+class DaemonCLI(cli.Application):
+	"""Keeps the triggers loaded and serves the dpkg hook over a Unix socket"""
+
+	socketPath = cli.SwitchAttr(["-s", "--socket"], str, default=None, help="The path of the socket to listen on, `PKGMAN_TRIGGERS_DAEMON_SOCKET` or " + str(daemonSocketPath) + " by default")
+	pollInterval = cli.SwitchAttr(["-i", "--poll-interval"], float, default=2.0, help="How often to check sys.path and the DB for changes, in seconds")
+
+	def main(self):  # pylint:disable=arguments-differ
+		from .daemon import TriggerDaemon  # pylint:disable=import-outside-toplevel
+
+		with TriggerDaemon(Path(self.socketPath) if self.socketPath else None) as daemon:
+			daemon.serve_forever(self.pollInterval)
 
 
 @CLI.subcommand("gui")
@@ -1,14 +1,80 @@
+import logging
 import os
-from pprint import pprint
+import sys
+import typing
+from pathlib import Path
 from warnings import warn
 
-import bencodepy
-
-from .. import TriggerManager
+from .. import openHookTriggerManager
 from ..events import Event
 from ..PackageInfo import PackageInfo
+from ..metrics import profileEnvVar, profiled
+from ..util.bencode import BencodeError, iterDictItems
+from .dpkgDB import ListFile, StatusDB, defaultAdminDir
+
+spoolEnvVar = "PKGMAN_TRIGGERS_SPOOL"
+logger = logging.getLogger(__name__)
+
+
+class BencodedTriggerers:
+	"""The triggerers from `DPKG_TRIGGERER_PACKAGES_INFO`. The bencoded dict is tokenized incrementally on each iteration, so only a single `PackageInfo` exists at a time."""
+
+	__slots__ = ("raw",)
+
+	def __init__(self, raw: bytes) -> None:
+		self.raw = raw
+
+	def __iter__(self) -> typing.Iterator[PackageInfo]:
+		try:
+			for name, info in iterDictItems(self.raw):
+				if isinstance(info, dict):
+					yield PackageInfo(name, info.get("V", None), info.get("A", None))
+				else:
+					warn("Invalid info of triggerer " + repr(name) + ": " + repr(info))
+		except BencodeError as ex:
+			warn("The info about triggerers is malformed, the rest of the triggerers are ignored: " + str(ex))
+
+	def __bool__(self) -> bool:
+		return self.raw[:1] == b"d" and self.raw[1:2] != b"e"
+
+	def __repr__(self):
+		return self.__class__.__name__ + "<" + str(len(self.raw)) + " bytes>"
+
+
+def getEnvBytes(name: str, environ: typing.Optional[typing.Mapping[bytes, bytes]] = None) -> typing.Optional[bytes]:
+	"""Gets an env var from `environ`, if given, or from the env of the process"""
+
+	if environ is not None:
+		return environ.get(name.encode("ascii"), None)
+	if os.supports_bytes_environ:
+		return os.environb.get(name.encode("ascii"), None)
+	res = os.environ.get(name, None)
+	if res is not None:
+		res = res.encode("utf-8", "surrogateescape")
+	return res
+
+
+def getEnvStr(name: str, environ: typing.Optional[typing.Mapping[bytes, bytes]] = None) -> typing.Optional[str]:
+	if environ is None:
+		return os.environ.get(name, None)
+	res = environ.get(name.encode("ascii"), None)
+	if res is not None:
+		res = res.decode("utf-8", "surrogateescape")
+	return res
 
-benc = bencodepy.Bencode(encoding="utf-8", dict_ordered=True)
+
+def completePackageInfo(statusDB: typing.Union[StatusDB, bool], pkg: PackageInfo) -> None:
+	"""Fills the missing version and arch of a package from the dpkg status DB"""
+
+	if not statusDB:
+		return
+
+	known = statusDB.getPackageInfo(pkg.name, pkg.arch)
+	if known is not None:
+		if pkg.version is None:
+			pkg.version = known.version
+		if pkg.arch is None:
+			pkg.arch = known.arch
 
 
 class DpkgInfo:
@@ -22,7 +88,7 @@ class DpkgInfo:
 	}
 	__slots__ = ("callType", "triggerers", "triggeree") + tuple(ENV_VARS_REMAPPING)
 
-	def __init__(self, argv=()):
+	def __init__(self, argv=(), environ: typing.Optional[typing.Mapping[bytes, bytes]] = None):
 		if len(argv) > 1 and argv[0].endswith(".postinst"):
 			self.callType = "maintainer_script"
 		else:
@@ -32,43 +98,80 @@ class DpkgInfo:
 			action = argv[1]
 			something = argv[2]
 
-		self.triggeree = PackageInfo(os.environ.get("DPKG_MAINTSCRIPT_PACKAGE", None), os.environ.get("DPKG_MAINTSCRIPT_ARCH", None), None)
-		triggerersBencoded = os.environ.get("DPKG_TRIGGERER_PACKAGES_INFO", None)
-		if triggerersBencoded:
-			triggerersBencDecode = benc.decode(triggerersBencoded)
-
-			if isinstance(triggerersBencDecode, dict):
-				self.triggerers = []
-				for name, info in triggerersBencDecode.items():
-					self.triggerers.append(PackageInfo(name, info.get("A", None), info.get("V", None)))
-			else:
-				self.triggerers = None
+		for name, envName in self.__class__.ENV_VARS_REMAPPING.items():
+			setattr(self, name, getEnvStr(envName, environ))
+
+		self.triggeree = PackageInfo(getEnvStr("DPKG_MAINTSCRIPT_PACKAGE", environ), None, getEnvStr("DPKG_MAINTSCRIPT_ARCH", environ))
+		triggerersBencoded = getEnvBytes("DPKG_TRIGGERER_PACKAGES_INFO", environ)
+		if triggerersBencoded and triggerersBencoded[:1] == b"d":
+			self.triggerers = BencodedTriggerers(triggerersBencoded)
 		else:
 			self.triggerers = None
 
-		for name, envName in self.__class__.ENV_VARS_REMAPPING.items():
-			setattr(self, name, os.environ.get(envName, None))
+	def openStatusDB(self) -> typing.Union[StatusDB, bool]:
+		"""Returns `False` if there is no status DB, so the caller doesn't retry"""
+
+		try:
+			return StatusDB(self.adminDir / "status").__enter__()
+		except FileNotFoundError:
+			return False
+
+	@property
+	def adminDir(self) -> Path:
+		return Path(self.configDir) if self.configDir else defaultAdminDir  # pylint:disable=no-member
+
+	def toEvents(self, withPaths: bool = True):
+		"""Without `withPaths` the paths affected are not listed, for when no trigger matches paths"""
 
-	def toEvents(self):
 		if self.triggerers:
-			for triggerer in self.triggerers:
-				yield Event(triggerer, self.triggeree, None)
+			adminDir = self.adminDir
+			statusDB = None
+			try:
+				for triggerer in self.triggerers:
+					if triggerer.version is None or triggerer.arch is None:
+						if statusDB is None:
+							statusDB = self.openStatusDB()
+						completePackageInfo(statusDB, triggerer)
+					yield Event(triggerer, self.triggeree, ListFile.find(adminDir, triggerer) if withPaths else None, self.action)  # pylint:disable=no-member
+			finally:
+				if statusDB:
+					statusDB.__exit__(None, None, None)
 		else:
 			warn("The version of dpkg used (" + repr(self.dpkgVersion) + ") doesn't expose the info about triggerers.")  # pylint:disable=no-member
-			yield Event(None, self.triggeree, None)
+			yield Event(None, self.triggeree, None, self.action)  # pylint:disable=no-member
 
 	def __repr__(self):
 		return self.__class__.__name__ + "<" + ", ".join((k + "=" + repr(getattr(self, k))) for k in self.__class__.__slots__) + ">"
 
 
 def process(argv):
+	"""Runs the triggers matching the dpkg call. If the `PKGMAN_TRIGGERS_SPOOL` env var is set, the triggers are only queued in the DB, to be run later by the `drain` subcommand of the CLI, so dpkg doesn't wait for them. If `PKGMAN_TRIGGERS_PROFILE` is set, the call is profiled."""
+
+	with profiled(os.environ.get(profileEnvVar, None)):
+		runHook(argv)
+
+
+def runHook(argv):
 	i = DpkgInfo(argv)
-	pprint(i)
+	logger.debug("%r", i)
+
+	spool = bool(os.environ.get(spoolEnvVar, None))
+	tm = openHookTriggerManager(readOnly=not spool)
+	if tm is None:
+		return
+
+	try:
+		if spool:
+			tm.enqueueEvents(i.toEvents(tm.getDispatchIndex().wantsPaths))
+			return
+		report = tm.processEvents(i.toEvents(tm.getDispatchIndex().wantsPaths))
+	finally:
+		tm.__exit__(None, None, None)
 
-	with TriggerManager() as tm:
-		tm.processEvents(i.toEvents())
+	for res in report.errors:
+		warn("Trigger " + repr(res.trigger) + " has failed: " + repr(res.error))
 
 
 if __name__ == "__main__":
-	print("dpkg trigger called")
-	process()
+	logger.debug("dpkg trigger called")
+	process(sys.argv)
@@ -0,0 +1,237 @@
+"""Lazy readers of the dpkg database (`/var/lib/dpkg/status` and `/var/lib/dpkg/info/*.list`). The files are memory-mapped, records are located by offsets and decoded only when requested."""
+
+import json
+import mmap
+import os
+import typing
+import warnings
+from pathlib import Path
+
+from ..defaults import dpkgStatusCachePath
+from ..PackageInfo import PackageInfo
+
+defaultAdminDir = Path("/var/lib/dpkg")
+OFFSETS_CACHE_FORMAT_VERSION = 1
+packageFieldPrefix = b"Package: "
+
+
+class MappedFile:
+	"""A read-only memory map of a file as a context manager. `buf` is for searching, `view` is a `memoryview` of it for slicing without copying."""
+
+	__slots__ = ("path", "buf", "view")
+
+	def __init__(self, path: Path) -> None:
+		self.path = path
+		self.buf = None
+		self.view = None
+
+	def __enter__(self) -> "MappedFile":
+		with self.path.open("rb") as f:
+			if os.fstat(f.fileno()).st_size:
+				self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			else:
+				self.buf = b""
+		self.view = memoryview(self.buf)
+		return self
+
+	def __exit__(self, *args, **kwargs) -> None:
+		self.view.release()
+		self.view = None
+		if isinstance(self.buf, mmap.mmap):
+			self.buf.close()
+		self.buf = None
+
+
+def iterLinesSpans(buf: typing.Union[mmap.mmap, bytes], start: int = 0, end: typing.Optional[int] = None) -> typing.Iterator[typing.Tuple[int, int]]:
+	"""Yields `(start, end)` of each non-empty line without `\\n`"""
+
+	if end is None:
+		end = len(buf)
+
+	pos = start
+	while pos < end:
+		eol = buf.find(b"\n", pos, end)
+		if eol < 0:
+			eol = end
+		if eol > pos:
+			yield pos, eol
+		pos = eol + 1
+
+
+def decode(view: memoryview) -> str:
+	return str(view, "utf-8", "surrogateescape")
+
+
+class ListFile:
+	"""The list of files of an installed package, from its `<package>[:<arch>].list`. The file is mapped anew on each iteration and the paths are decoded one by one as they are consumed."""
+
+	__slots__ = ("path",)
+
+	def __init__(self, path: Path) -> None:
+		self.path = path
+
+	@classmethod
+	def find(cls, adminDir: Path, pkg: PackageInfo) -> typing.Optional["ListFile"]:
+		infoDir = adminDir / "info"
+		candidates = [pkg.name + ".list"]
+		if pkg.arch:
+			candidates.insert(0, pkg.name + ":" + pkg.arch + ".list")
+
+		for fileName in candidates:
+			path = infoDir / fileName
+			if path.is_file():
+				return cls(path)
+		return None
+
+	def __iter__(self) -> typing.Iterator[str]:
+		try:
+			mf = MappedFile(self.path).__enter__()
+		except FileNotFoundError:
+			return
+
+		try:
+			for start, end in iterLinesSpans(mf.buf):
+				yield decode(mf.view[start:end])
+		finally:
+			mf.__exit__(None, None, None)
+
+	def __bool__(self) -> bool:
+		return True
+
+	def __repr__(self):
+		return self.__class__.__name__ + "(" + repr(self.path) + ")"
+
+
+def parseStanza(text: str) -> typing.Dict[str, str]:
+	"""Parses a deb822 stanza. Continuation lines are joined with `\\n`."""
+
+	res = {}
+	lastKey = None
+	for l in text.split("\n"):
+		if not l:
+			continue
+		if l[0] in " \t":
+			if lastKey is not None:
+				res[lastKey] += "\n" + l[1:]
+			continue
+		k, _, v = l.partition(":")
+		lastKey = k.strip()
+		res[lastKey] = v.strip()
+	return res
+
+
+def indexStatus(buf: typing.Union[mmap.mmap, bytes]) -> typing.Dict[str, typing.List[typing.Tuple[int, int]]]:
+	"""Returns the spans of the stanzas of the status file by package names. Only the `Package` field is looked at."""
+
+	offsets = {}
+	size = len(buf)
+	pos = 0
+	while pos < size:
+		end = buf.find(b"\n\n", pos)
+		if end < 0:
+			end = size
+
+		fieldPos = pos
+		while fieldPos >= 0:
+			fieldPos = buf.find(packageFieldPrefix, fieldPos, end)
+			if fieldPos == pos or fieldPos > 0 and buf[fieldPos - 1] == 0x0A:
+				break
+			if fieldPos >= 0:
+				fieldPos += 1
+
+		if fieldPos >= 0:
+			nameStart = fieldPos + len(packageFieldPrefix)
+			nameEnd = buf.find(b"\n", nameStart, end)
+			if nameEnd < 0:
+				nameEnd = end
+			name = bytes(buf[nameStart:nameEnd]).strip().decode("utf-8", "surrogateescape")
+			offsets.setdefault(name, []).append((pos, end))
+
+		pos = end + 2
+	return offsets
+
+
+def fileKey(path: Path) -> typing.List[int]:
+	st = path.stat()
+	return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+
+class StatusDB:
+	"""The dpkg `status` file. The offsets of the stanzas are cached on disk keyed on the file mtime, size and inode, so a repeated run doesn't rescan the file. Only the stanzas requested are decoded and parsed."""
+
+	__slots__ = ("path", "cachePath", "offsets", "mappedFile")
+
+	def __init__(self, path: typing.Optional[Path] = None, cachePath: typing.Optional[Path] = dpkgStatusCachePath) -> None:
+		if path is None:
+			path = defaultAdminDir / "status"
+		self.path = path
+		self.cachePath = cachePath
+		self.offsets = None
+		self.mappedFile = None
+
+	def loadOffsets(self, key: typing.List[int]) -> typing.Optional[dict]:
+		if self.cachePath is None:
+			return None
+
+		try:
+			with self.cachePath.open("rt", encoding="utf-8") as f:
+				cache = json.load(f)
+		except (OSError, ValueError):
+			return None
+
+		if cache.get("version", None) != OFFSETS_CACHE_FORMAT_VERSION or cache.get("path", None) != str(self.path) or cache.get("key", None) != key:
+			return None
+
+		return cache["offsets"]
+
+	def saveOffsets(self, key: typing.List[int]) -> None:
+		if self.cachePath is None:
+			return
+
+		tmpPath = self.cachePath.parent / (self.cachePath.name + "." + str(os.getpid()) + ".tmp")
+		try:
+			self.cachePath.parent.mkdir(parents=True, exist_ok=True)
+			with tmpPath.open("wt", encoding="utf-8") as f:
+				json.dump({"version": OFFSETS_CACHE_FORMAT_VERSION, "path": str(self.path), "key": key, "offsets": self.offsets}, f)
+			os.replace(str(tmpPath), str(self.cachePath))
+		except OSError as ex:
+			warnings.warn("Cannot save the dpkg status offsets cache to " + str(self.cachePath) + ": " + str(ex))
+			try:
+				tmpPath.unlink()
+			except OSError:
+				pass
+
+	def __enter__(self) -> "StatusDB":
+		key = fileKey(self.path)
+		self.mappedFile = MappedFile(self.path).__enter__()
+
+		self.offsets = self.loadOffsets(key)
+		if self.offsets is None:
+			self.offsets = indexStatus(self.mappedFile.buf)
+			self.saveOffsets(key)
+		return self
+
+	def __exit__(self, *args, **kwargs) -> None:
+		self.mappedFile.__exit__(*args, **kwargs)
+		self.mappedFile = None
+
+	def __contains__(self, name: str) -> bool:
+		return name in self.offsets
+
+	def iterStanzas(self, name: str) -> typing.Iterator[typing.Dict[str, str]]:
+		for start, end in self.offsets.get(name, ()):
+			yield parseStanza(decode(self.mappedFile.view[start:end]))
+
+	def getStanza(self, name: str, arch: typing.Optional[str] = None) -> typing.Optional[typing.Dict[str, str]]:
+		"""Returns the stanza of the package of the given arch (or of `all` arch), or the first one if `arch` is not given"""
+
+		for stanza in self.iterStanzas(name):
+			if arch is None or stanza.get("Architecture", None) in (arch, "all"):
+				return stanza
+		return None
+
+	def getPackageInfo(self, name: str, arch: typing.Optional[str] = None) -> typing.Optional[PackageInfo]:
+		stanza = self.getStanza(name, arch)
+		if stanza is None:
+			return None
+		return PackageInfo(name, stanza.get("Version", None), stanza.get("Architecture", None))
@@ -0,0 +1,96 @@
+"""Collapses the events repeated by separate hook invocations within a time window into a single dispatch"""
+
+import fcntl
+import json
+import os
+import time
+import typing
+import warnings
+from pathlib import Path
+
+from .defaults import coalescingSpoolPath
+from .events import Event, getEventKey
+
+COALESCING_SPOOL_FORMAT_VERSION = 1
+coalesceWindowEnvVar = "PKGMAN_TRIGGERS_COALESCE_WINDOW"
+
+
+def serializeEventKey(key: typing.Tuple[typing.Optional[str], ...]) -> str:
+	return "\0".join("" if el is None else el for el in key)
+
+
+class CoalescingSpool:
+	"""A file of the keys of the events dispatched recently with the times of dispatch. The file is locked while it is open, so concurrent hook invocations are serialized. The keys older than `window` seconds are dropped on load."""
+
+	__slots__ = ("path", "window", "file", "entries", "pending")
+
+	def __init__(self, window: float, path: Path = coalescingSpoolPath) -> None:
+		self.path = path
+		self.window = window
+		self.file = None
+		self.entries = None
+		self.pending = {}
+
+	def __enter__(self) -> "CoalescingSpool":
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		self.file = open(os.open(str(self.path), os.O_RDWR | os.O_CREAT, 0o600), "r+t", encoding="utf-8")
+		fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+
+		try:
+			data = json.load(self.file)
+		except ValueError:
+			data = None
+		if not isinstance(data, dict) or data.get("version", None) != COALESCING_SPOOL_FORMAT_VERSION:
+			data = {"entries": {}}
+
+		now = time.time()
+		self.entries = {k: v for k, v in data["entries"].items() if now - v < self.window}
+		return self
+
+	def filter(self, events: typing.Iterable[Event]) -> typing.Iterator[Event]:
+		"""Drops the events dispatched within the window. The rest are remembered as dispatched only on `commit`. The events without a triggerer are always passed."""
+
+		for evt in events:
+			k = getEventKey(evt)
+			if k is None:
+				yield evt
+				continue
+
+			k = serializeEventKey(k)
+			if k in self.entries or k in self.pending:
+				continue
+			self.pending[k] = time.time()
+			yield evt
+
+	def commit(self) -> None:
+		"""Remembers the events passed by `filter` as dispatched. Call it only if their triggers have succeeded, so the failed ones are retried by the next calls."""
+
+		self.entries.update(self.pending)
+		self.pending = {}
+
+	def __exit__(self, *args, **kwargs) -> None:
+		try:
+			self.file.seek(0)
+			self.file.truncate()
+			json.dump({"version": COALESCING_SPOOL_FORMAT_VERSION, "entries": self.entries}, self.file)
+			self.file.flush()
+		except OSError as ex:
+			warnings.warn("Cannot save the coalescing spool to " + str(self.path) + ": " + str(ex))
+		finally:
+			fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+			self.file.close()
+			self.file = None
+
+
+def getCoalesceWindow() -> typing.Optional[float]:
+	"""Returns the window set in the env, in seconds, or `None` if coalescing is disabled"""
+
+	window = os.environ.get(coalesceWindowEnvVar, None)
+	if not window:
+		return None
+	try:
+		window = float(window)
+	except ValueError:
+		warnings.warn(coalesceWindowEnvVar + " must be a number of seconds, got " + repr(window))
+		return None
+	return window if window > 0 else None
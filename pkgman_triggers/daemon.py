@@ -0,0 +1,137 @@
+"""A daemon keeping the triggers loaded between dpkg runs. The dpkg hook calls are forwarded to it over a Unix socket by the `postinst` of `pkgman-deb-trigger`, which doesn't import this package.
+
+A request is `argc\\0argv[0]\\0...\\0KEY=VALUE\\0...` with only the `DPKG_*` and `PKGMAN_TRIGGERS_*` env vars, terminated by shutting the socket down for writing. The reply is the errors of the triggers, one per line, empty if all of them have succeeded.
+
+Of the settings of the client only `PKGMAN_TRIGGERS_SPOOL` is honoured, the rest are taken from the env of the daemon. The socket path is `PKGMAN_TRIGGERS_DAEMON_SOCKET` if set, both for the daemon and for the client."""
+
+import importlib
+import os
+import socketserver
+import typing
+from pathlib import Path
+
+from . import openHookTriggerManager
+from .AuthDB import AuthDB
+from .backends.dpkg import DpkgInfo, spoolEnvVar
+from .defaults import configPath, daemonSocketPath
+from .discovery import getSysPathEntries, statKey
+
+maxRequestSize = 64 << 20
+daemonSocketEnvVar = "PKGMAN_TRIGGERS_DAEMON_SOCKET"
+
+
+def decodeRequest(data: bytes) -> typing.Tuple[typing.List[str], typing.Dict[bytes, bytes]]:
+	items = data.split(b"\0")
+	argc = int(items[0])
+	argv = [os.fsdecode(a) for a in items[1:1 + argc]]
+	environ = {}
+	for item in items[1 + argc:]:
+		k, sep, v = item.partition(b"=")
+		if sep:
+			environ[k] = v
+	return argv, environ
+
+
+def getDaemonSocketPath() -> Path:
+	return Path(os.environ.get(daemonSocketEnvVar, None) or daemonSocketPath)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+	def handle(self) -> None:
+		data = self.rfile.read(maxRequestSize + 1)
+		if len(data) > maxRequestSize:
+			errors = ["The request is larger than " + str(maxRequestSize) + " bytes"]
+		else:
+			errors = self.server.processRequest(*decodeRequest(data))
+		self.wfile.write("\n".join(errors).encode("utf-8"))
+
+
+class TriggerDaemon(socketserver.UnixStreamServer):
+	"""Keeps a `TriggerManager` with the dispatch index built. The modules of the triggers are imported when the triggers first match and stay imported across reloads, unless their dists change.
+
+	`sys.path` dirs and the DB are polled for changes every `poll_interval` of `serve_forever` and before each request, the same way the discovery cache is validated. On a change everything is reloaded. Requests are served one by one, since dpkg runs its hooks sequentially anyway."""
+
+	def __init__(self, socketPath: typing.Optional[Path] = None) -> None:
+		if socketPath is None:
+			socketPath = getDaemonSocketPath()
+		self.tm = None
+		self.watchKey = None
+		super().__init__(str(socketPath), RequestHandler)
+
+	def server_bind(self) -> None:
+		socketPath = Path(self.server_address)
+		socketPath.parent.mkdir(parents=True, exist_ok=True)
+		if socketPath.is_socket():
+			socketPath.unlink()
+		oldUmask = os.umask(0o177)  # the socket is created accessible only to the owner, since any request is run as the owner
+		try:
+			super().server_bind()
+		finally:
+			os.umask(oldUmask)
+
+	def server_close(self) -> None:
+		super().server_close()
+		self.unload()
+		try:
+			os.unlink(self.server_address)
+		except OSError:
+			pass
+
+	@staticmethod
+	def getWatchKey() -> list:
+		key = []
+		for entry in getSysPathEntries():
+			try:
+				key.append((entry, statKey(entry)))
+			except OSError:
+				pass
+
+		for path in (configPath, configPath.parent / (configPath.name + "-wal")):
+			try:
+				st = path.stat()
+				key.append((str(path), st.st_mtime_ns, st.st_size))
+			except OSError:
+				key.append((str(path), None))
+		return key
+
+	def unload(self) -> None:
+		if self.tm is not None:
+			self.tm.__exit__(None, None, None)
+			self.tm = None
+
+	def reload(self) -> None:
+		self.unload()
+		importlib.invalidate_caches()
+
+		self.tm = openHookTriggerManager()
+		if self.tm is not None:
+			self.tm.getDispatchIndex()
+
+	def reloadIfChanged(self) -> None:
+		key = self.getWatchKey()
+		if key != self.watchKey:
+			self.reload()
+			self.watchKey = key
+
+	def serve_forever(self, poll_interval: float = 0.5) -> None:
+		self.reloadIfChanged()
+		super().serve_forever(poll_interval)
+
+	def service_actions(self) -> None:
+		self.reloadIfChanged()
+
+	def processRequest(self, argv: typing.List[str], environ: typing.Dict[bytes, bytes]) -> typing.List[str]:
+		try:
+			self.reloadIfChanged()
+			if self.tm is None:
+				return []
+			events = DpkgInfo(argv, environ).toEvents(self.tm.getDispatchIndex().wantsPaths)
+			if environ.get(os.fsencode(spoolEnvVar), None):
+				with AuthDB() as db:  # the manager is read-only
+					self.tm.enqueueEvents(events, db)
+				self.watchKey = self.getWatchKey()  # our own change of the DB doesn't need a reload
+				return []
+			report = self.tm.processEvents(events)
+		except Exception as ex:  # pylint:disable=broad-except
+			return ["The daemon has failed to process the request: " + repr(ex)]
+		return ["Trigger " + repr(res.trigger) + " has failed: " + repr(res.error) for res in report.errors]
@@ -3,3 +3,14 @@ from pathlib import Path
 configDir = Path("/etc/pkgman_triggers.py")
 configPath = configDir / "config.toml"
 configPath = Path("./pkgman_triggers_authDb.sqlite")
+
+cacheDir = Path("/var/cache/pkgman_triggers.py")
+discoveryCachePath = cacheDir / "discovery.json"
+discoveryCachePath = Path("./pkgman_triggers_discoveryCache.json")
+dpkgStatusCachePath = cacheDir / "dpkgStatusOffsets.json"
+dpkgStatusCachePath = Path("./pkgman_triggers_dpkgStatusOffsets.json")
+coalescingSpoolPath = cacheDir / "recentEvents.json"
+coalescingSpoolPath = Path("./pkgman_triggers_recentEvents.json")
+
+runDir = Path("/run/pkgman_triggers.py")
+daemonSocketPath = runDir / "daemon.sock"  # the postinst of pkgman-deb-trigger has the same default
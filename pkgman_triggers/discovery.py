@@ -0,0 +1,253 @@
+import functools
+import importlib
+import json
+import os
+import re
+import sys
+import typing
+import warnings
+from pathlib import Path
+
+if sys.version_info >= (3, 10):
+	import importlib.metadata as importlib_metadata
+else:
+	import importlib_metadata
+
+from .defaults import discoveryCachePath
+
+ENTRY_POINTS_GROUP = "pkgman_triggers"
+CACHE_FORMAT_VERSION = 2
+metadataDirsSuffixes = (".dist-info", ".egg-info")
+projectNameNormalizationRx = re.compile("[-_.]+")
+resolvedCache = {}
+
+
+class DiscoveredDist:
+	"""A lightweight description of a distribution, restored from the discovery cache"""
+
+	__slots__ = ("project_name", "version", "module_path")
+
+	def __init__(self, project_name: str, version: str, module_path: str) -> None:
+		self.project_name = project_name
+		self.version = version
+		self.module_path = module_path
+
+	def __repr__(self):
+		return self.__class__.__name__ + "(" + ", ".join(repr(getattr(self, k)) for k in self.__class__.__slots__) + ")"
+
+
+class DiscoveredEntryPoint:
+	"""An entry point with already parsed metadata. Nothing is imported until `resolve` is called."""
+
+	__slots__ = ("name", "module_name", "attrs", "dist", "metadata")
+
+	def __init__(self, name: str, module_name: str, attrs: typing.Tuple[str, ...], dist: DiscoveredDist, metadata: typing.Optional[dict]) -> None:
+		self.name = name
+		self.module_name = module_name
+		self.attrs = attrs
+		self.dist = dist
+		self.metadata = metadata
+
+	def resolve(self):
+		"""The callables are cached process-wide, so rediscovery doesn't cause reimporting. If the dist has changed its version or location since the module was imported, the module is reloaded."""
+
+		key = (self.module_name, self.attrs)
+		distKey = (self.dist.version, self.dist.module_path)
+		cached = resolvedCache.get(key, None)
+		if cached is not None and cached[0] == distKey:
+			return cached[1]
+
+		module = importlib.import_module(self.module_name)
+		if cached is not None:
+			module = importlib.reload(module)
+		try:
+			res = functools.reduce(getattr, self.attrs, module)
+		except AttributeError as exc:
+			raise ImportError(str(exc)) from exc
+		resolvedCache[key] = (distKey, res)
+		return res
+
+	def __repr__(self):
+		return self.__class__.__name__ + "<" + self.name + " = " + ":".join((self.module_name, ".".join(self.attrs))) + ">"
+
+
+def splitEncodedName(name: str) -> typing.Tuple[str, typing.Optional[dict]]:
+	"""Splits `name@{json}` into the name and the decoded metadata"""
+
+	encoded = name.split("@", 1)
+	if len(encoded) > 1:
+		try:
+			return encoded[0].strip(), json.loads(encoded[1])
+		except json.JSONDecodeError:
+			warnings.warn("Entry point " + repr(name) + " is invalid. The value after @ must be must be a valid JSON!.")
+	return name, None
+
+
+def normalizeProjectName(name: str) -> str:
+	return projectNameNormalizationRx.sub("-", name).lower()
+
+
+def parseEntryPoint(ep: importlib_metadata.EntryPoint) -> list:
+	"""Converts an `importlib.metadata` entry point into a serializable record"""
+
+	name, metadata = splitEncodedName(ep.name)
+	moduleName, _, attrs = ep.value.partition(":")
+	attrs = attrs.split("[", 1)[0].strip()
+	return [name, moduleName.strip(), attrs.split(".") if attrs else [], metadata]
+
+
+def getDistModulePath(dist: importlib_metadata.Distribution, moduleName: typing.Optional[str]) -> str:
+	"""Returns the path of the top-level module the triggers of the dist live in. Unlike the dir the dist is installed into, it is unique for each dist and survives upgrades."""
+
+	location = Path(dist.locate_file(""))
+	if moduleName:
+		top = moduleName.split(".", 1)[0]
+		for candidate in (location / top, location / (top + ".py")):
+			if candidate.exists():
+				return str(candidate)
+	return str(location)
+
+
+def statKey(path: str) -> typing.List[int]:
+	st = os.stat(path)
+	return [st.st_mtime_ns, st.st_ino]
+
+
+def parseMetadataDir(path: str) -> typing.Optional[dict]:
+	"""Parses a single `*.dist-info`/`*.egg-info` into a serializable record"""
+
+	if not os.path.isdir(path):
+		return None
+
+	dist = importlib_metadata.PathDistribution(Path(path))
+	projectName = dist.metadata["Name"]
+	if projectName is None:
+		return None
+
+	eps = [parseEntryPoint(ep) for ep in dist.entry_points if ep.group == ENTRY_POINTS_GROUP]
+	return {
+		"dist": [projectName, dist.version, getDistModulePath(dist, eps[0][1] if eps else None)],
+		"entryPoints": eps,
+	}
+
+
+def scanSysPathEntry(entryPath: str, cachedDists: dict) -> dict:
+	"""Returns the records of all the distributions within a dir in `sys.path`. Only the distributions whose metadata dirs have changed are reparsed."""
+
+	dists = {}
+	with os.scandir(entryPath) as it:
+		for de in it:
+			if not de.name.endswith(metadataDirsSuffixes):
+				continue
+
+			try:
+				key = statKey(de.path)
+			except OSError:
+				continue
+
+			rec = cachedDists.get(de.name, None)
+			if rec is None or rec["key"] != key:
+				parsed = parseMetadataDir(de.path)
+				if parsed is None:
+					continue
+				rec = parsed
+				rec["key"] = key
+
+			dists[de.name] = rec
+
+	return dists
+
+
+def loadCache(cachePath: Path) -> dict:
+	try:
+		with cachePath.open("rt", encoding="utf-8") as f:
+			cache = json.load(f)
+	except (OSError, ValueError):
+		return {}
+
+	if not isinstance(cache, dict) or cache.get("version", None) != CACHE_FORMAT_VERSION:
+		return {}
+
+	return cache.get("entries", {})
+
+
+def saveCache(cachePath: Path, entries: dict) -> None:
+	tmpPath = cachePath.parent / (cachePath.name + "." + str(os.getpid()) + ".tmp")
+	try:
+		cachePath.parent.mkdir(parents=True, exist_ok=True)
+		with tmpPath.open("wt", encoding="utf-8") as f:
+			json.dump({"version": CACHE_FORMAT_VERSION, "entries": entries}, f)
+		os.replace(str(tmpPath), str(cachePath))
+	except OSError as ex:
+		warnings.warn("Cannot save the discovery cache to " + str(cachePath) + ": " + str(ex))
+		try:
+			tmpPath.unlink()
+		except OSError:
+			pass
+
+
+def getSysPathEntries() -> typing.Iterator[str]:
+	seen = set()
+	for entry in sys.path:
+		entry = os.path.abspath(entry or ".")
+		if entry not in seen and os.path.isdir(entry):
+			seen.add(entry)
+			yield entry
+
+
+def discoverEntryPointsUncached() -> typing.Iterator[DiscoveredEntryPoint]:
+	dists = {}
+	for ep in importlib_metadata.entry_points(group=ENTRY_POINTS_GROUP):
+		dId = id(ep.dist)
+		dist = dists.get(dId, None)
+		name, moduleName, attrs, metadata = parseEntryPoint(ep)
+		if dist is None:
+			dist = dists[dId] = DiscoveredDist(ep.dist.metadata["Name"], ep.dist.version, getDistModulePath(ep.dist, moduleName))
+		yield DiscoveredEntryPoint(name, moduleName, tuple(attrs), dist, metadata)
+
+
+def discoverEntryPoints(cachePath: typing.Optional[Path] = discoveryCachePath) -> typing.Iterator[DiscoveredEntryPoint]:
+	"""Discovers the `pkgman_triggers` entry points of the installed distributions.
+
+	The records are cached on disk, keyed on mtimes and inodes of `sys.path` entries and of the metadata dirs within them. A `sys.path` dir whose mtime is unchanged cannot have gained or lost a distribution, so it is not even listed. Pass `None` as `cachePath` to disable the cache and to query `importlib.metadata` directly."""
+
+	if cachePath is None:
+		yield from discoverEntryPointsUncached()
+		return
+
+	cached = loadCache(cachePath)
+	entries = {}
+	changed = False
+
+	for entryPath in getSysPathEntries():
+		try:
+			key = statKey(entryPath)
+		except OSError:
+			continue
+
+		cachedEntry = cached.get(entryPath, None)
+		if cachedEntry is not None and cachedEntry["key"] == key:
+			entries[entryPath] = cachedEntry
+			continue
+
+		entries[entryPath] = {"key": key, "dists": scanSysPathEntry(entryPath, cachedEntry["dists"] if cachedEntry else {})}
+		changed = True
+
+	if changed or set(entries) != set(cached):
+		saveCache(cachePath, entries)
+
+	seenProjects = set()
+	for entry in entries.values():
+		for rec in entry["dists"].values():
+			projectName, version, location = rec["dist"]
+			projectKey = normalizeProjectName(projectName)
+			if projectKey in seenProjects:
+				continue
+			seenProjects.add(projectKey)
+
+			if not rec["entryPoints"]:
+				continue
+
+			dist = DiscoveredDist(projectName, version, location)
+			for name, moduleName, attrs, metadata in rec["entryPoints"]:
+				yield DiscoveredEntryPoint(name, moduleName, tuple(attrs), dist, metadata)
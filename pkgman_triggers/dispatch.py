@@ -0,0 +1,314 @@
+import hashlib
+import json
+import re
+import typing
+import warnings
+import zlib
+from collections import OrderedDict
+
+from .events import Event
+from .matchers import IPathMatcher, Matcher, PackageNameMatcher, PathMatcher
+from .triggers import Trigger
+
+regexMetaChars = frozenset(".^$*+?{}[]|()")
+numericBackrefRx = re.compile("\\\\[1-9]")
+# named groups and references to them, conditionals and inline flags applying to the whole regex, which break or change the other alternatives when joined with them
+nonCombinableRx = re.compile("\\(\\?(?:P[<=]|<(?![=!])|\\(|[aiLmsux]+\\))")
+groupNamePrefix = "_pkgmanM"
+
+
+class PatternKind:
+	__slots__ = ()
+
+	literal = 0
+	prefix = 1
+	regex = 2
+
+
+def unescapeLiteral(pattern: str) -> typing.Optional[str]:
+	"""Returns the string matched by `pattern` if it contains no regex syntax except escaped punctuation, otherwise `None`"""
+
+	res = []
+	it = iter(pattern)
+	for c in it:
+		if c == "\\":
+			c = next(it, None)
+			if c is None or c.isalnum() or c == "_":
+				return None
+		elif c in regexMetaChars:
+			return None
+		res.append(c)
+	return "".join(res)
+
+
+def classifyPattern(pattern: str) -> typing.Tuple[int, str]:
+	"""Classifies a package name pattern, keeping the semantics of `re.match`, which is anchored only at the start.
+
+	A literal terminated with `$` is an exact name, a bare literal or a literal followed by `.*` is a prefix, everything else is a regex."""
+
+	body = pattern[1:] if pattern.startswith("^") else pattern
+
+	kind = PatternKind.prefix
+	if body.endswith("$") and not body.endswith("\\$"):
+		body = body[:-1]
+		kind = PatternKind.literal
+	if body.endswith(".*") and not body.endswith("\\.*"):
+		body = body[:-2]
+		kind = PatternKind.prefix
+
+	literal = unescapeLiteral(body)
+	if literal is None:
+		return PatternKind.regex, pattern
+	return kind, literal
+
+
+class PrefixTrie:
+	"""A char trie. Finds the values of all the keys being prefixes of a string in O(len(string))."""
+
+	__slots__ = ("root",)
+
+	def __init__(self) -> None:
+		self.root = {}
+
+	def add(self, key: str, value) -> None:
+		node = self.root
+		for c in key:
+			node = node.setdefault(c, {})
+		node.setdefault(None, []).append(value)
+
+	def iterItems(self) -> typing.Iterator[typing.Tuple[str, typing.Any]]:
+		stack = [("", self.root)]
+		while stack:
+			prefix, node = stack.pop()
+			for k, v in node.items():
+				if k is None:
+					for value in v:
+						yield prefix, value
+				else:
+					stack.append((prefix + k, v))
+
+	def iterPrefixesValues(self, s: str) -> typing.Iterator:
+		node = self.root
+		yield from node.get(None, ())
+		for c in s:
+			node = node.get(c, None)
+			if node is None:
+				return
+			yield from node.get(None, ())
+
+
+class IndexEntry:
+	__slots__ = ("ordinal", "trigger", "matcherIdx", "matcher")
+
+	def __init__(self, ordinal: int, trigger: Trigger, matcherIdx: int, matcher: Matcher) -> None:
+		self.ordinal = ordinal
+		self.trigger = trigger
+		self.matcherIdx = matcherIdx
+		self.matcher = matcher
+
+
+class RegexAlternation:
+	"""Tests many regexes with a single `re.match` call in the common case of none of them matching.
+
+	The patterns are joined into an alternation of named groups. Since an alternation reports only the first alternative matched, on a hit the search resumes from the next alternative, using a lazily compiled alternation of the remaining patterns."""
+
+	__slots__ = ("entries", "suffixes")
+
+	def __init__(self, entries: typing.List[IndexEntry]) -> None:
+		self.entries = entries
+		self.suffixes = {}
+
+	def add(self, entry: IndexEntry) -> None:
+		self.entries.append(entry)
+		self.suffixes = {}
+
+	def getSuffix(self, start: int) -> typing.Pattern:
+		rx = self.suffixes.get(start, None)
+		if rx is None:
+			rx = self.suffixes[start] = re.compile("|".join("(?P<" + groupNamePrefix + str(i) + ">" + self.entries[i].matcher.spec + ")" for i in range(start, len(self.entries))))
+		return rx
+
+	def iterMatched(self, s: str) -> typing.Iterator[IndexEntry]:
+		start = 0
+		while start < len(self.entries):
+			m = self.getSuffix(start).match(s)
+			if m is None:
+				return
+			i = int(m.lastgroup[len(groupNamePrefix):])
+			yield self.entries[i]
+			start = i + 1
+
+	@classmethod
+	def isCombinable(cls, pattern: str) -> bool:
+		if numericBackrefRx.search(pattern) or nonCombinableRx.search(pattern):
+			return False
+		try:
+			re.compile("(?P<" + groupNamePrefix + "0>" + pattern + ")")
+		except re.error:
+			return False
+		return True
+
+
+def getConditionHash(matcher: Matcher) -> bytes:
+	return hashlib.sha256((str(int(matcher.conditionType)) + ":" + matcher.spec).encode("utf-8")).digest()
+
+
+# the artifacts of other versions are not found, so they are rebuilt. Version 1 had patterns with named groups and inline flags in the alternation.
+artifactFormatVersion = 2
+
+
+def getTriggersSetHash(triggers: typing.Iterable[Trigger]) -> bytes:
+	"""Identifies a set of registered triggers together with their conditions, regardless of their order, and the format of the artifact. A prebuilt index is valid only for the same hash."""
+
+	h = hashlib.sha256(str(artifactFormatVersion).encode("ascii") + b"\0")
+	for t in sorted(triggers, key=lambda t: t.id):
+		h.update(str(t.id).encode("ascii") + b"\0")
+		for matcher in t.matchers:
+			h.update(getConditionHash(matcher) if matcher.conditionType is not None else repr(matcher).encode("utf-8"))
+		h.update(b"\1")
+	return h.digest()
+
+
+class DispatchIndex:
+	"""Routes an event only to the triggers that can match it, looking patterns up by their literal parts. Its layout can be stored with `toArtifact`."""
+
+	__slots__ = ("entries", "literals", "prefixes", "alternation", "paths", "standalone")
+
+	def __init__(self, triggers: typing.Iterable[Trigger]) -> None:
+		self.entries = []
+		self.literals = {}
+		self.prefixes = PrefixTrie()
+		self.paths = PrefixTrie()
+		self.alternation = RegexAlternation([])
+		self.standalone = []
+
+		for ordinal, t in enumerate(triggers):
+			for matcherIdx, matcher in enumerate(t.matchers):
+				entry = IndexEntry(ordinal, t, matcherIdx, matcher)
+				kind = self.classify(matcher)
+				if kind is not None:
+					self.entries.append(entry)
+					self.addEntry(kind, entry)
+
+	@staticmethod
+	def classify(matcher: Matcher) -> typing.Optional[typing.Tuple[str, str]]:
+		"""Returns the table for the matcher and the key in it, or `None` if the matcher can never match"""
+
+		if isinstance(matcher, PackageNameMatcher):
+			kind, key = classifyPattern(matcher.pattern)
+			if matcher.flags:
+				kind = PatternKind.regex
+			if kind == PatternKind.literal:
+				return "literals", key
+			if kind == PatternKind.prefix:
+				return "prefixes", key
+			if RegexAlternation.isCombinable(matcher.spec):
+				return "alternation", None
+			try:
+				matcher.rx  # pylint:disable=pointless-statement
+			except re.error as ex:
+				warnings.warn("Package name pattern " + repr(matcher.pattern) + " is invalid: " + str(ex))
+				return None
+		elif isinstance(matcher, PathMatcher):
+			return "paths", matcher.literalPrefix
+		return "standalone", None
+
+	def addEntry(self, kind: typing.Tuple[str, typing.Optional[str]], entry: IndexEntry) -> None:
+		table, key = kind
+		if table == "literals":
+			self.literals.setdefault(key, []).append(entry)
+		elif table == "prefixes":
+			self.prefixes.add(key, entry)
+		elif table == "paths":
+			self.paths.add(key, entry)
+		elif table == "alternation":
+			self.alternation.add(entry)
+		else:
+			self.standalone.append(entry)
+
+	def toArtifact(self) -> bytes:
+		"""Serializes the layout of the tables. The triggers are referred to by their ids."""
+
+		entriesIdxs = {id(entry): i for i, entry in enumerate(self.entries)}
+		res = {
+			"entries": [(entry.ordinal, entry.trigger.id, entry.matcherIdx) for entry in self.entries],
+			"literals": {k: [entriesIdxs[id(e)] for e in v] for k, v in self.literals.items()},
+			"prefixes": [(k, entriesIdxs[id(e)]) for k, e in self.prefixes.iterItems()],
+			"paths": [(k, entriesIdxs[id(e)]) for k, e in self.paths.iterItems()],
+			"alternation": [entriesIdxs[id(e)] for e in self.alternation.entries],
+			"standalone": [entriesIdxs[id(e)] for e in self.standalone],
+		}
+		return zlib.compress(json.dumps(res, separators=(",", ":")).encode("utf-8"))
+
+	@classmethod
+	def fromArtifact(cls, artifact: bytes, triggers: typing.Iterable[Trigger]) -> "DispatchIndex":
+		"""Restores the index from `toArtifact` output. `triggers` must be the same ones the index was built from, `getTriggersSetHash` is to check that."""
+
+		data = json.loads(zlib.decompress(artifact).decode("utf-8"))
+		triggersById = {t.id: t for t in triggers}
+
+		self = cls(())
+		for ordinal, triggerId, matcherIdx in data["entries"]:
+			t = triggersById[triggerId]
+			self.entries.append(IndexEntry(ordinal, t, matcherIdx, t.matchers[matcherIdx]))
+
+		for k, idxs in data["literals"].items():
+			self.literals[k] = [self.entries[i] for i in idxs]
+		for k, i in data["prefixes"]:
+			self.prefixes.add(k, self.entries[i])
+		for k, i in data["paths"]:
+			self.paths.add(k, self.entries[i])
+		for i in data["alternation"]:
+			self.alternation.add(self.entries[i])
+		for i in data["standalone"]:
+			self.standalone.append(self.entries[i])
+		return self
+
+	@property
+	def wantsPaths(self) -> bool:
+		"""Whether any trigger matches the paths affected, so they need to be listed for the events"""
+
+		return bool(self.paths.root) or any(isinstance(entry.matcher, IPathMatcher) for entry in self.standalone)
+
+	def iterMatched(self, evt: Event) -> typing.Iterator[typing.Tuple[IndexEntry, typing.Any]]:
+		"""Yields the entries matching the event. The match results of the entries found by package name are not computed and are `None`."""
+
+		if evt.triggerer and evt.triggerer.name is not None:
+			name = evt.triggerer.name
+			for entry in self.literals.get(name, ()):
+				yield entry, None
+			for entry in self.prefixes.iterPrefixesValues(name):
+				yield entry, None
+			for entry in self.alternation.iterMatched(name):
+				yield entry, None
+
+		if evt.pathsAffected and self.paths.root:
+			pathsMatched = OrderedDict()
+			for path in evt.pathsAffected:
+				for entry in self.paths.iterPrefixesValues(path):
+					if entry.matcher.matchPath(path):
+						pathsMatched.setdefault(entry, []).append(path)
+			yield from pathsMatched.items()
+
+		for entry in self.standalone:
+			matchRes = entry.matcher(evt)
+			if matchRes:
+				yield entry, matchRes
+
+	def match(self, evt: Event) -> typing.Mapping[Trigger, typing.Any]:
+		"""Returns the triggers matching the event, mapped to their match results, in the order the triggers were given. Like `Trigger.match`, the result of the first matching matcher of a trigger is used."""
+
+		best = {}
+		for entry, matchRes in self.iterMatched(evt):
+			prev = best.get(entry.ordinal, None)
+			if prev is None or entry.matcherIdx < prev[0].matcherIdx:
+				best[entry.ordinal] = (entry, matchRes)
+
+		res = OrderedDict()
+		for ordinal in sorted(best):
+			entry, matchRes = best[ordinal]
+			if matchRes is None:
+				matchRes = entry.matcher(evt)
+			if matchRes:
+				res[entry.trigger] = matchRes
+		return res
@@ -1,7 +1,29 @@
+import typing
+
+
 class Event:
-	__slots__ = ("triggerer", "triggeree", "pathsAffected")
+	__slots__ = ("triggerer", "triggeree", "pathsAffected", "action")
 
-	def __init__(self, triggerer, triggeree, pathsAffected):
+	def __init__(self, triggerer, triggeree, pathsAffected, action: typing.Optional[str] = None):
 		self.triggerer = triggerer
 		self.triggeree = triggeree
 		self.pathsAffected = pathsAffected
+		self.action = action
+
+
+def getEventKey(evt: Event) -> typing.Hashable:
+	t = evt.triggerer
+	if t is None:
+		return None
+	return (t.name, t.arch, t.version, evt.action)
+
+
+def uniqueEvents(events: typing.Iterable[Event]) -> typing.Iterator[Event]:
+	"""Drops the events about the triggerers already seen. Memory is proportional to the count of distinct triggerers, not to the count of events."""
+
+	seen = set()
+	for evt in events:
+		k = getEventKey(evt)
+		if k not in seen:
+			seen.add(k)
+			yield evt
@@ -0,0 +1,343 @@
+import asyncio
+import concurrent.futures
+import functools
+import importlib
+import inspect
+import multiprocessing.pool
+import os
+import queue
+import re
+import threading
+import time
+import typing
+from collections import deque
+
+from .metrics import Metrics
+from .triggers import Trigger
+
+
+processStartMethod = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+class ExecutorKind:
+	__slots__ = ()
+
+	inline = "inline"
+	thread = "thread"
+	process = "process"
+
+	all = frozenset((inline, thread, process))
+
+
+def makePortable(matchResults):
+	"""Converts match results into something picklable. `re.Match` objects cannot cross process boundaries, so they are replaced with the matched strings."""
+
+	if isinstance(matchResults, (list, tuple)):
+		return [makePortable(el) for el in matchResults]
+	if isinstance(matchResults, re.Match):
+		return matchResults.group(0)
+	return matchResults
+
+
+def runTimed(func: typing.Callable, *args) -> typing.Tuple[typing.Any, float]:
+	started = time.monotonic()
+	res = func(*args)
+	return res, time.monotonic() - started
+
+
+async def runTimedAsync(func: typing.Callable, *args) -> typing.Tuple[typing.Any, float]:
+	started = time.monotonic()
+	res = await func(*args)
+	return res, time.monotonic() - started
+
+
+def runEntryPoint(moduleName: str, attrs: typing.Tuple[str, ...], matchResults) -> typing.Tuple[typing.Any, float]:
+	"""Runs in a worker process, so gets the entry point not as an object, but by its coordinates. A coroutine function gets its own event loop."""
+
+	func = functools.reduce(getattr, attrs, importlib.import_module(moduleName))
+	if inspect.iscoroutinefunction(func):
+		return asyncio.run(runTimedAsync(func, matchResults))
+	return runTimed(func, matchResults)
+
+
+class DaemonThreadPool:
+	"""A minimal `concurrent.futures.ThreadPoolExecutor` with daemon worker threads. The interpreter joins the threads of `ThreadPoolExecutor` on exit, so a hung trigger would keep the package manager waiting even after its timeout; these threads are just abandoned. An abandoned worker is replaced, so it doesn't hold a slot, and exits if it ever finishes."""
+
+	__slots__ = ("maxWorkers", "namePrefix", "queue", "workers", "spawned", "idle", "running", "lock")
+
+	def __init__(self, maxWorkers: typing.Optional[int] = None, namePrefix: str = "pkgman_triggers") -> None:
+		self.maxWorkers = maxWorkers if maxWorkers is not None else min(32, (os.cpu_count() or 1) + 4)
+		self.namePrefix = namePrefix
+		self.queue = queue.SimpleQueue()
+		self.workers = 0
+		self.spawned = 0
+		self.idle = threading.Semaphore(0)
+		self.running = set()
+		self.lock = threading.Lock()
+
+	def submit(self, func: typing.Callable, *args) -> concurrent.futures.Future:
+		fut = concurrent.futures.Future()
+		self.queue.put((fut, func, args))
+		if not self.idle.acquire(blocking=False):
+			with self.lock:
+				if self.workers < self.maxWorkers:
+					self.startWorker()
+		return fut
+
+	def startWorker(self) -> None:
+		"""Must be called under `lock`"""
+
+		thread = threading.Thread(target=self.work, name=self.namePrefix + "_" + str(self.spawned), daemon=True)
+		self.workers += 1
+		self.spawned += 1
+		thread.start()
+
+	def work(self) -> None:
+		while True:
+			item = self.queue.get()
+			if item is None:
+				return
+			fut, func, args = item
+			del item
+			if fut.set_running_or_notify_cancel():
+				with self.lock:
+					self.running.add(fut)
+				try:
+					res = func(*args)
+				except BaseException as ex:  # pylint:disable=broad-except
+					fut.set_exception(ex)
+				else:
+					fut.set_result(res)
+				with self.lock:
+					if fut not in self.running:
+						return  # abandoned and already replaced
+					self.running.discard(fut)
+			del fut, func, args
+			self.idle.release()
+
+	def abandon(self, fut: concurrent.futures.Future) -> bool:
+		"""Starts a new worker instead of the one running `fut`. Returns whether `fut` is run by this pool."""
+
+		with self.lock:
+			if fut not in self.running:
+				return False
+			self.running.discard(fut)
+			self.workers -= 1
+			self.startWorker()
+		return True
+
+	def shutdown(self) -> None:
+		"""Cancels the queued invocations and lets the idle threads exit. The busy ones are abandoned."""
+
+		while True:
+			try:
+				item = self.queue.get_nowait()
+			except queue.Empty:
+				break
+			if item is not None:
+				item[0].cancel()
+		with self.lock:
+			for _i in range(self.workers):
+				self.queue.put(None)
+			self.workers = 0
+
+
+class InvocationResult:
+	"""`tag` is an arbitrary value given to `Dispatcher.submit` to tell the invocations apart"""
+
+	__slots__ = ("trigger", "result", "error", "duration", "tag")
+
+	def __init__(self, trigger: Trigger, result=None, error: typing.Optional[BaseException] = None, duration: typing.Optional[float] = None, tag=None) -> None:
+		self.trigger = trigger
+		self.result = result
+		self.error = error
+		self.duration = duration
+		self.tag = tag
+
+	@property
+	def ok(self) -> bool:
+		return self.error is None
+
+	def __repr__(self) -> str:
+		return self.__class__.__name__ + "<" + ", ".join((repr(self.trigger), ("ok" if self.ok else repr(self.error)), format(self.duration, ".3f") + "s")) + ">"
+
+
+class ExecutionReport(list):
+	"""The results of all the invocations of triggers of a single dispatch"""
+
+	__slots__ = ()
+
+	@property
+	def errors(self) -> typing.List[InvocationResult]:
+		return [r for r in self if not r.ok]
+
+
+class Dispatcher:
+	"""Runs the triggers in the executors they have chosen in their metadata, abandoning the timed out ones. No more than `maxPending` invocations are in flight."""
+
+	__slots__ = ("maxWorkers", "defaultTimeout", "maxPending", "maxCoroutines", "threadPool", "processPool", "serialPool", "loop", "loopThread", "semaphore", "pending", "report", "metrics")
+
+	def __init__(self, maxWorkers: typing.Optional[int] = None, defaultTimeout: typing.Optional[float] = None, maxPending: typing.Optional[int] = None, maxCoroutines: typing.Optional[int] = None, metrics: typing.Optional[Metrics] = None) -> None:
+		self.maxWorkers = maxWorkers
+		self.metrics = metrics if metrics is not None else Metrics()
+		self.defaultTimeout = defaultTimeout
+		self.maxPending = maxPending
+		self.maxCoroutines = maxCoroutines
+		self.threadPool = None
+		self.processPool = None
+		self.serialPool = None
+		self.loop = None
+		self.loopThread = None
+		self.semaphore = None
+		self.pending = deque()
+		self.report = ExecutionReport()
+
+	def getThreadPool(self) -> DaemonThreadPool:
+		if self.threadPool is None:
+			self.threadPool = DaemonThreadPool(self.maxWorkers, "pkgman_triggers")
+		return self.threadPool
+
+	def getProcessPool(self) -> multiprocessing.pool.Pool:
+		"""Unlike `concurrent.futures.ProcessPoolExecutor`, it can kill the workers running timed out invocations. The workers are not forked from this process, since its other threads may hold locks."""
+
+		if self.processPool is None:
+			self.processPool = multiprocessing.get_context(processStartMethod).Pool(self.maxWorkers)
+		return self.processPool
+
+	def getSerialPool(self) -> DaemonThreadPool:
+		if self.serialPool is None:
+			self.serialPool = DaemonThreadPool(1, "pkgman_triggers_ordered")
+		return self.serialPool
+
+	def getLoop(self) -> asyncio.AbstractEventLoop:
+		if self.loop is None:
+			self.loop = asyncio.new_event_loop()
+			self.loopThread = threading.Thread(target=self.loop.run_forever, name="pkgman_triggers_asyncio", daemon=True)
+			self.loopThread.start()
+		return self.loop
+
+	async def runLimited(self, func: typing.Callable, matchResults) -> typing.Tuple[typing.Any, float]:
+		if self.maxCoroutines is None:
+			return await runTimedAsync(func, matchResults)
+
+		if self.semaphore is None:
+			self.semaphore = asyncio.Semaphore(self.maxCoroutines)  # created within the loop thread
+		async with self.semaphore:
+			return await runTimedAsync(func, matchResults)
+
+	def runCoroutine(self, func: typing.Callable, matchResults) -> concurrent.futures.Future:
+		return asyncio.run_coroutine_threadsafe(self.runLimited(func, matchResults), self.getLoop())
+
+	def runInProcess(self, t: Trigger, matchResults) -> concurrent.futures.Future:
+		ep = t.entryPoint
+		fut = concurrent.futures.Future()
+		fut.set_running_or_notify_cancel()
+		self.getProcessPool().apply_async(runEntryPoint, (ep.module_name, ep.attrs, makePortable(matchResults)), callback=fut.set_result, error_callback=fut.set_exception)
+		return fut
+
+	def submit(self, t: Trigger, matchResults, tag=None) -> None:
+		started = time.monotonic()
+
+		self.metrics.count("invocations")
+		func = None
+		if t.executor != ExecutorKind.process:
+			try:
+				func = t.resolve()
+			except Exception as ex:  # pylint:disable=broad-except
+				self.report.append(InvocationResult(t, error=ex, duration=time.monotonic() - started, tag=tag))
+				return
+			finally:
+				self.metrics.addTime("resolve", time.monotonic() - started)
+
+		isAsync = inspect.iscoroutinefunction(func)
+
+		if t.executor == ExecutorKind.inline:
+			res = InvocationResult(t, tag=tag)
+			try:
+				if isAsync:
+					res.result, _ = self.runCoroutine(func, matchResults).result()
+				else:
+					res.result = func(matchResults)
+			except Exception as ex:  # pylint:disable=broad-except
+				res.error = ex
+			res.duration = time.monotonic() - started
+			self.report.append(res)
+			return
+
+		if t.ordered:
+			if t.executor == ExecutorKind.process:
+				fut = self.getSerialPool().submit(lambda: self.runInProcess(t, matchResults).result())
+			elif isAsync:
+				fut = self.getSerialPool().submit(lambda: self.runCoroutine(func, matchResults).result())
+			else:
+				fut = self.getSerialPool().submit(runTimed, func, matchResults)
+		elif t.executor == ExecutorKind.process:
+			fut = self.runInProcess(t, matchResults)
+		elif isAsync:
+			fut = self.runCoroutine(func, matchResults)
+		else:
+			fut = self.getThreadPool().submit(runTimed, func, matchResults)
+
+		if self.maxPending is not None and len(self.pending) >= self.maxPending:
+			self.collect(*self.pending.popleft())
+		self.pending.append((t, fut, started, tag))
+
+	def collect(self, t: Trigger, fut: concurrent.futures.Future, started: float, tag=None) -> None:
+		"""Waits for an invocation and puts its result into the report"""
+
+		res = InvocationResult(t, tag=tag)
+		timeout = t.timeout if t.timeout is not None else self.defaultTimeout
+		try:
+			res.result, res.duration = fut.result(None if timeout is None else max(0, started + timeout - time.monotonic()))
+		except concurrent.futures.TimeoutError:
+			if not fut.cancel():
+				self.abandon(fut)
+			res.error = TimeoutError("Trigger " + repr(t) + " has not finished within " + repr(timeout) + " s")
+		except Exception as ex:  # pylint:disable=broad-except
+			res.error = ex
+		if res.duration is None:
+			res.duration = time.monotonic() - started
+		self.report.append(res)
+
+	def abandon(self, fut: concurrent.futures.Future) -> None:
+		"""Replaces the thread running a timed out invocation, if it is run in a thread"""
+
+		for pool in (self.threadPool, self.serialPool):
+			if pool is not None and pool.abandon(fut):
+				self.metrics.count("abandonedThreads")
+				return
+
+	def finish(self) -> ExecutionReport:
+		"""Waits for all the submitted invocations and returns the report"""
+
+		with self.metrics.timer("execution"):
+			while self.pending:
+				self.collect(*self.pending.popleft())
+
+		for res in self.report:
+			self.metrics.addTriggerTime(res.trigger.name, res.duration)
+			if not res.ok:
+				self.metrics.count("failures")
+		return self.report
+
+	def __enter__(self) -> "Dispatcher":
+		return self
+
+	def __exit__(self, *args, **kwargs) -> None:
+		for pool in (self.serialPool, self.threadPool):
+			if pool is not None:
+				pool.shutdown()
+		if self.processPool is not None:
+			self.processPool.terminate()  # kills the workers still running timed out invocations
+		self.serialPool = self.threadPool = self.processPool = None
+
+		if self.loop is not None:
+			self.loop.call_soon_threadsafe(self.stopLoop)
+			self.loopThread.join()
+			self.loop.close()
+			self.loop = self.loopThread = self.semaphore = None
+
+	def stopLoop(self) -> None:
+		for task in asyncio.all_tasks(self.loop):
+			task.cancel()
+		self.loop.call_soon(self.loop.stop)  # after the cancelled tasks have handled the cancellation
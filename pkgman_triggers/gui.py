@@ -1,7 +1,10 @@
+import logging
 import typing
+from collections import OrderedDict
+from itertools import chain
 
-from PySide2.QtCore import Qt, Signal  # pylint:disable=no-name-in-module
-from PySide2.QtWidgets import QApplication, QBoxLayout, QHeaderView, QTreeWidget, QTreeWidgetItem, QWidget, QMainWindow, QDockWidget, QToolBar, QStyle, QAction, QCheckBox, QWhatsThis  # pylint:disable=no-name-in-module
+from PySide2.QtCore import QAbstractItemModel, QModelIndex, QObject, QThread, QTimer, Qt, Signal, Slot  # pylint:disable=no-name-in-module
+from PySide2.QtWidgets import QApplication, QBoxLayout, QHeaderView, QLabel, QProgressBar, QTreeView, QWidget, QMainWindow, QDockWidget, QToolBar, QStyle, QAction, QCheckBox, QWhatsThis  # pylint:disable=no-name-in-module
 
 from . import TriggerManager
 from .triggers import Module, Trigger, TemporaryID
@@ -9,6 +12,8 @@ from .util import universalValues
 
 from .defaults import configPath
 
+logger = logging.getLogger(__name__)
+
 class Settings:
 	__slots__ = ("autoRemove", "autoEnable", "filePath")
 
@@ -46,7 +51,33 @@ class GuiEditor(QMainWindow):
 		self.settingsWgt.cleanupBtnTriggered.connect(self.treeWgt.cleanup)
 		self.settingsWgt.refreshBtnTriggered.connect(self.treeWgt.refresh)
 
+		self.statusLbl = QLabel(self)
+		self.progressBar = QProgressBar(self)
+		self.progressBar.setRange(0, 0)
+		self.statusBar().addWidget(self.statusLbl, 1)
+		self.statusBar().addPermanentWidget(self.progressBar)
+		self.treeWgt.busy.connect(self.showBusy)
+		self.treeWgt.idle.connect(self.showIdle)
+		self.treeWgt.reported.connect(self.showReport)
+
 		self.updateGeometry()
+		self.treeWgt.refresh()
+
+	def showBusy(self, message: str) -> None:
+		self.statusLbl.setText(message)
+		self.progressBar.show()
+
+	def showReport(self, message: str) -> None:
+		self.statusLbl.setText(message)
+		self.progressBar.hide()
+
+	def showIdle(self) -> None:
+		self.statusLbl.clear()
+		self.progressBar.hide()
+
+	def closeEvent(self, event) -> None:
+		self.treeWgt.close()
+		super().closeEvent(event)
 
 
 class OurToolbar(QToolBar):
@@ -61,7 +92,7 @@ class OurToolbar(QToolBar):
 
 		self.cleanupBtn = QAction("♻️", self)
 		self.cleanupBtn.setToolTip("Cleanup")
-		self.cleanupBtn.setWhatsThis("Recreate the database from the memory representation, cleaning the garbage")
+		self.cleanupBtn.setWhatsThis("Delete from the database the modules and the triggers no longer installed and compact it")
 
 		self.refreshBtn = QAction(reloadIcon, "&Refresh", self)
 		self.openBtn = QAction(openIcon, "&Open DB", self)
@@ -93,151 +124,470 @@ class OurToolbar(QToolBar):
 		state = Qt.CheckState(state)
 		self.settings.autoRemove = bool(state)
 
+ModulesSnapshot = typing.List[typing.Tuple[Module, typing.Tuple[Trigger, ...]]]
+Edit = typing.Tuple[typing.Union[Module, Trigger], bool, bool]
+
+
+def snapshotModules(tm: TriggerManager) -> ModulesSnapshot:
+	"""The modules with their triggers. Registration only moves them between the dicts of the manager, so the snapshot stays valid while the dicts are changed in the worker thread."""
+
+	return [(m, tuple(chain(universalValues(m.registeredTriggers), universalValues(m.unknownTriggers)))) for m in chain(universalValues(tm.registeredModules), universalValues(tm.unknownModules))]
+
+
+def applyEdits(tm: TriggerManager, edits: typing.Iterable[Edit]) -> None:
+	"""Applies the edits of the checkboxes, `(module or trigger, checked, autoRemove)`, grouping them into batch operations. Removals are applied first."""
+
+	toRemove = []
+	modulesToRegister = OrderedDict()
+	triggersToRegister = OrderedDict()
+	toEnable = ([], [])
+	toDisable = ([], [])
+
+	for obj, checked, autoRemove in edits:
+		isTrigger = isinstance(obj, Trigger)
+		if checked:
+			m = obj.module if isTrigger else obj
+			if not m.registered:
+				modulesToRegister[id(m)] = m
+			if isTrigger and not obj.registered:
+				triggersToRegister[id(obj)] = obj
+			toEnable[isTrigger].append(obj)
+		elif autoRemove:
+			toRemove.append(obj)
+		else:
+			toDisable[isTrigger].append(obj)
+
+	for obj in toRemove:
+		if not obj.registered:
+			continue
+		if isinstance(obj, Trigger):
+			tm.unregisterTrigger(obj)
+			obj.status = False
+		else:
+			tm.unregisterPackage(obj)
+
+	if modulesToRegister:
+		tm.registerPackages([m.id for m in modulesToRegister.values() if not m.registered])
+	if triggersToRegister:
+		tm.registerTriggers([(t.module, t.id) for t in triggersToRegister.values() if not t.registered])
+
+	for status, (modules, triggers) in ((True, toEnable), (False, toDisable)):
+		if modules:
+			tm.setPackagesEnabled(modules, status)
+		if triggers:
+			tm.setTriggersEnabled(triggers, status)
+
+
+class DBWorker(QObject):
+	"""Owns the `TriggerManager` and does discovery and all the DB work in its own thread, since an SQLite connection can only be used in the thread that has opened it. The UI thread only reads the attributes of the modules and triggers."""
+
+	progress = Signal(str)
+	loaded = Signal(object)
+	written = Signal(object)
+	reported = Signal(str)
+	failed = Signal(str)
+
+	def __init__(self) -> None:
+		super().__init__()
+		self.tm = None
+
+	@Slot()
+	def load(self) -> None:
+		self.progress.emit("Discovering triggers and loading the DB")
+		try:
+			tm = TriggerManager().__enter__()
+		except Exception as ex:  # pylint:disable=broad-except
+			logger.exception("Loading has failed")
+			self.failed.emit("Loading has failed: " + repr(ex))
+			return
+		self.unload()
+		self.tm = tm
+		self.progress.emit("Preparing " + str(len(tm.registeredModules) + len(tm.unknownModules)) + " modules")
+		self.loaded.emit(snapshotModules(tm))
+
+	@Slot(object)
+	def write(self, edits: typing.List[Edit]) -> None:
+		self.progress.emit("Saving " + str(len(edits)) + " changes")
+		try:
+			with self.tm.db.transaction():
+				applyEdits(self.tm, edits)
+		except Exception as ex:  # pylint:disable=broad-except
+			logger.exception("Saving has failed")
+			self.failed.emit("Saving has failed: " + repr(ex))
+			self.written.emit(edits)
+			self.load()  # the DB has been rolled back, but the manager has not
+			return
+		self.written.emit(edits)
+
+	@Slot()
+	def cleanup(self) -> None:
+		self.progress.emit("Collecting garbage")
+		try:
+			report = self.tm.collectGarbage()
+		except Exception as ex:  # pylint:disable=broad-except
+			logger.exception("Garbage collection has failed")
+			self.failed.emit("Garbage collection has failed: " + repr(ex))
+			return
+		self.reported.emit(report.describe())
+
+	@Slot()
+	def unload(self) -> None:
+		if self.tm is not None:
+			self.tm.__exit__(None, None, None)
+			self.tm = None
+
+
+class ModuleNode:
+	"""A row of a module in `TriggersModel`. The rows of its triggers are created when it is first expanded."""
+
+	__slots__ = ("module", "children", "row", "triggers")
+
+	def __init__(self, module: Module, children: typing.Tuple[Trigger, ...], row: int) -> None:
+		self.module = module
+		self.children = children
+		self.row = row
+		self.triggers = None
+
+
+class TriggersModel(QAbstractItemModel):
+	"""A tree model over the modules and triggers of a `TriggerManager`. The rows are not rebuilt on changes: the ones affected are reported with `dataChanged`, `rowsInserted` and `rowsRemoved`. Modules are fetched in chunks, triggers of a module are fetched when it is expanded.
+
+	Checkbox edits are collected for `flushDelay` ms after the last one and emitted with `editsReady` as a single batch, to be written by `DBWorker`. Until written, the edited checkboxes show the new states.
+
+	The internal pointer of a module index is the model itself, the one of a trigger index is the node of its module."""
+
+	columns = ("ID", "Name", "Path", "Type")
+	modulesChunkSize = 256
+	flushDelay = 300
+
+	editsReady = Signal(object)
+
+	def __init__(self, settings: Settings, parent=None) -> None:
+		super().__init__(parent)
+		self.settings = settings
+		self.nodes = []
+		self.nodesByKey = {}
+		self.pending = []
+		self.edits = OrderedDict()
+		self.inFlight = {}
+
+		self.flushTimer = QTimer(self)
+		self.flushTimer.setSingleShot(True)
+		self.flushTimer.setInterval(self.flushDelay)
+		self.flushTimer.timeout.connect(self.flush)
+
+	@staticmethod
+	def getModulesKey(m: Module) -> str:
+		return str(m.path)
+
+	def getItem(self, index: QModelIndex) -> typing.Tuple[ModuleNode, typing.Optional[Trigger]]:
+		ptr = index.internalPointer()
+		if ptr is self:
+			return self.nodes[index.row()], None
+		return ptr, ptr.triggers[index.row()]
+
+	def getModuleIndex(self, node: ModuleNode, column: int = 0) -> QModelIndex:
+		return self.createIndex(node.row, column, self)
+
+	def index(self, row: int, column: int, parent: QModelIndex = QModelIndex()) -> QModelIndex:
+		if not self.hasIndex(row, column, parent):
+			return QModelIndex()
+		if not parent.isValid():
+			return self.createIndex(row, column, self)
+		return self.createIndex(row, column, self.nodes[parent.row()])
+
+	def parent(self, index: QModelIndex) -> QModelIndex:  # pylint:disable=arguments-differ
+		if not index.isValid():
+			return QModelIndex()
+		ptr = index.internalPointer()
+		if ptr is self:
+			return QModelIndex()
+		return self.getModuleIndex(ptr)
+
+	def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+		if not parent.isValid():
+			return len(self.nodes)
+		if parent.column() > 0 or parent.internalPointer() is not self:
+			return 0
+		triggers = self.nodes[parent.row()].triggers
+		return len(triggers) if triggers is not None else 0
+
+	def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:  # pylint:disable=unused-argument
+		return len(self.columns)
+
+	def hasChildren(self, parent: QModelIndex = QModelIndex()) -> bool:
+		if not parent.isValid():
+			return bool(self.nodes or self.pending)
+		if parent.column() > 0 or parent.internalPointer() is not self:
+			return False
+		return bool(self.nodes[parent.row()].children)
+
+	def canFetchMore(self, parent: QModelIndex) -> bool:
+		if not parent.isValid():
+			return bool(self.pending)
+		if parent.internalPointer() is not self:
+			return False
+		return self.nodes[parent.row()].triggers is None
+
+	def fetchMore(self, parent: QModelIndex) -> None:
+		if not parent.isValid():
+			chunk = self.pending[:self.modulesChunkSize]
+			del self.pending[:self.modulesChunkSize]
+			self.appendModules(chunk)
+			return
+
+		node = self.nodes[parent.row()]
+		if node.children:
+			self.beginInsertRows(parent, 0, len(node.children) - 1)
+			node.triggers = list(node.children)
+			self.endInsertRows()
+		else:
+			node.triggers = []
+
+	def appendModules(self, modules: ModulesSnapshot) -> None:
+		if not modules:
+			return
+		first = len(self.nodes)
+		self.beginInsertRows(QModelIndex(), first, first + len(modules) - 1)
+		for m, children in modules:
+			node = ModuleNode(m, children, len(self.nodes))
+			self.nodes.append(node)
+			self.nodesByKey[self.getModulesKey(m)] = node
+		self.endInsertRows()
+
+	def getStatus(self, obj: typing.Union[Module, Trigger]) -> bool:
+		edit = self.edits.get(obj, None)
+		if edit is None:
+			edit = self.inFlight.get(obj, None)
+		if edit is not None:
+			return edit[0]
+		return bool(obj.status)
+
+	def data(self, index: QModelIndex, role: int = Qt.DisplayRole) -> typing.Any:
+		if not index.isValid():
+			return None
+
+		node, t = self.getItem(index)
+		obj = t if t is not None else node.module
+		column = index.column()
+
+		if role == Qt.DisplayRole:
+			if column == 0:
+				return str(obj.id) if obj.registered else unregisteredText
+			if column == 1:
+				return t.internalName if t is not None else node.module.name
+			if column == 2:
+				return str(node.module.path) if t is None else None
+			if column == 3:
+				return obj.__class__.__name__
+		elif role == Qt.CheckStateRole and column == 0:
+			return Qt.Checked if self.getStatus(obj) else Qt.Unchecked
+		elif role == Qt.UserRole:
+			return obj
+		return None
+
+	def flags(self, index: QModelIndex) -> Qt.ItemFlags:
+		if not index.isValid():
+			return Qt.NoItemFlags
+		res = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+		if index.column() == 0:
+			res |= Qt.ItemIsUserCheckable
+		return res
+
+	def headerData(self, section: int, orientation: Qt.Orientation, role: int = Qt.DisplayRole) -> typing.Any:
+		if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+			return self.columns[section]
+		return None
+
+	def setData(self, index: QModelIndex, value: typing.Any, role: int = Qt.EditRole) -> bool:
+		if role != Qt.CheckStateRole or index.column() != 0:
+			return False
+
+		cs = Qt.CheckState(value)
+		if cs == Qt.CheckState.PartiallyChecked:
+			return False
+
+		node, t = self.getItem(index)
+		obj = t if t is not None else node.module
+		logger.debug("Edited %r: %r", obj, cs)
+		self.edits.pop(obj, None)
+		self.edits[obj] = (cs == Qt.CheckState.Checked, self.settings.autoRemove)
+		self.dataChanged.emit(index, index)
+		self.flushTimer.start()
+		return True
+
+	def flush(self) -> None:
+		"""Emits the collected edits immediately"""
+
+		self.flushTimer.stop()
+		if not self.edits:
+			return
+		edits = [(obj, checked, autoRemove) for obj, (checked, autoRemove) in self.edits.items()]
+		self.inFlight.update(self.edits)
+		self.edits = OrderedDict()
+		self.editsReady.emit(edits)
+
+	def onWritten(self, edits: typing.List[Edit]) -> None:
+		"""Reports the rows of the modules affected by the written edits as changed, including their triggers, since removing or registering a module changes them too"""
+
+		nodes = OrderedDict()
+		for obj, checked, autoRemove in edits:
+			if self.inFlight.get(obj, None) == (checked, autoRemove):
+				del self.inFlight[obj]
+			m = obj.module if isinstance(obj, Trigger) else obj
+			node = self.nodesByKey.get(self.getModulesKey(m), None)
+			if node is not None and node.module is m:
+				nodes[id(node)] = node
+
+		for node in nodes.values():
+			self.emitModuleChanged(node)
+			if node.triggers:
+				self.emitTriggersChanged(node, 0, len(node.triggers) - 1)
+
+	def emitModuleChanged(self, node: ModuleNode) -> None:
+		self.dataChanged.emit(self.getModuleIndex(node), self.getModuleIndex(node, len(self.columns) - 1))
+
+	def emitTriggersChanged(self, node: ModuleNode, first: int, last: int) -> None:
+		parent = self.getModuleIndex(node)
+		self.dataChanged.emit(self.index(first, 0, parent), self.index(last, len(self.columns) - 1, parent))
+
+	def setModules(self, snapshot: ModulesSnapshot) -> None:
+		"""Switches to the modules of a new snapshot, matching them to the current rows by their paths. Only the rows of the modules and triggers that have appeared or disappeared are inserted or removed, the rest are updated in place."""
+
+		modules = OrderedDict((self.getModulesKey(m), (m, children)) for m, children in snapshot)
+
+		for row in reversed(range(len(self.nodes))):
+			if self.getModulesKey(self.nodes[row].module) not in modules:
+				self.beginRemoveRows(QModelIndex(), row, row)
+				del self.nodes[row]
+				self.endRemoveRows()
+		for row, node in enumerate(self.nodes):
+			node.row = row
+
+		self.nodesByKey = {}
+		for node in self.nodes:
+			k = self.getModulesKey(node.module)
+			self.nodesByKey[k] = node
+			self.updateNode(node, *modules[k])
+		if self.nodes:
+			self.dataChanged.emit(self.index(0, 0), self.index(len(self.nodes) - 1, len(self.columns) - 1))
+
+		pending = [modules[k] for k in (self.getModulesKey(m) for m, children in self.pending) if k in modules]
+		pendingKeys = {self.getModulesKey(m) for m, children in pending}
+		new = [v for k, v in modules.items() if k not in self.nodesByKey and k not in pendingKeys]
+
+		if pending:
+			self.pending = pending + new
+		else:
+			self.pending = []
+			self.appendModules(new[:self.modulesChunkSize])
+			self.pending = new[self.modulesChunkSize:]
+
+	def updateNode(self, node: ModuleNode, m: Module, children: typing.Tuple[Trigger, ...]) -> None:
+		node.module = m
+		node.children = children
+		if node.triggers is None:
+			return
+
+		triggers = OrderedDict((t.internalName, t) for t in children)
+		parent = self.getModuleIndex(node)
+		for row in reversed(range(len(node.triggers))):
+			if node.triggers[row].internalName not in triggers:
+				self.beginRemoveRows(parent, row, row)
+				del node.triggers[row]
+				self.endRemoveRows()
+
+		known = set()
+		for row, t in enumerate(node.triggers):
+			known.add(t.internalName)
+			node.triggers[row] = triggers[t.internalName]
+		if node.triggers:
+			self.emitTriggersChanged(node, 0, len(node.triggers) - 1)
+
+		new = [t for k, t in triggers.items() if k not in known]
+		if new:
+			first = len(node.triggers)
+			self.beginInsertRows(parent, first, first + len(new) - 1)
+			node.triggers.extend(new)
+			self.endInsertRows()
+
+
 class OurTreeWidget(QDockWidget):
-	#__slots__ = ("tm", "tree", "layout", "settings")
+	"""The tree of the modules and triggers. Loading and saving are done by a `DBWorker` in a background thread, the tree is disabled while loading."""
+
+	#__slots__ = ("model", "tree", "settings", "worker", "workerThread")
+
+	loadRequested = Signal()
+	unloadRequested = Signal()
+	cleanupRequested = Signal()
+	busy = Signal(str)
+	idle = Signal()
+	reported = Signal(str)
+
 	def __init__(self, name: str, settings: Settings, parent: QMainWindow) -> None:
 		super().__init__(name, parent)
-		self.tm = None
 		self.settings = settings
 
-		self.tree = QTreeWidget(self)
+		self.model = TriggersModel(settings, self)
+		self.tree = QTreeView(self)
+		self.tree.setModel(self.model)
 		self.tree.setDisabled(True)
-		self.tree.blockSignals(True);
 		self.setWidget(self.tree)
 
-		self.tree.setHeaderLabels(("ID", "Name", "Path", "Type"))
 		self.tree.header().setSectionResizeMode(QHeaderView.ResizeToContents)
 
-		self.refresh()
+		self.workerThread = QThread(self)
+		self.worker = DBWorker()
+		self.worker.moveToThread(self.workerThread)
+
+		self.loadRequested.connect(self.worker.load)
+		self.cleanupRequested.connect(self.worker.cleanup)
+		self.unloadRequested.connect(self.worker.unload, Qt.BlockingQueuedConnection)
+		self.model.editsReady.connect(self.worker.write)
+		self.worker.progress.connect(self.busy)
+		self.worker.loaded.connect(self.loaded)
+		self.worker.written.connect(self.written)
+		self.worker.reported.connect(self.reported)
+		self.worker.failed.connect(self.failed)
+		self.workerThread.start()
 
-		self.tree.itemChanged.connect(self.treeItemChanged)
 		self.updateGeometry()
 
 	def close(self):
-		self.tree.blockSignals(True);
-		self.tree.setDisabled(True)
-		self.tree.clear()
-		if self.tm:
-			self.tm.__exit__(None, None, None)
-			self.tm = None
+		"""Saves the pending edits and stops the worker thread"""
+
+		self.model.flush()
+		self.unloadRequested.emit()
+		self.workerThread.quit()
+		self.workerThread.wait()
 
 	def open(self):
-		self.close()
-		self.tm = TriggerManager().__enter__()
-		self.processModuleCollection(self.tree, self.tm.registeredModules, lambda m: str(m.id))
-		self.processModuleCollection(self.tree, self.tm.unknownModules, lambda m: unregisteredText)
-		self.adjustSize()
-		self.tree.setDisabled(False)
-		self.tree.blockSignals(False);
+		self.model.flush()
+		self.tree.setDisabled(True)
+		self.loadRequested.emit()
 
 	def refresh(self):
 		self.open()
 
-	def cleanup(self):
-		print("cleanup method called")
-
-	def treeItemChanged(self, item: QTreeWidgetItem, column: int) -> None:  # pylint:disable=unused-argument
-		d = item.data(0, Qt.UserRole)
-		cs = item.checkState(0)
-
-		self.tree.blockSignals(True)
-		if isinstance(d, Trigger):
-			m = item.parent().data(0, Qt.UserRole)
-			assert isinstance(m, Module)
-			res = self.triggerChanged(item, d, m, cs)
-		if isinstance(d, Module):
-			res = self.moduleChanged(item, d, cs)
-		self.tree.blockSignals(False)
-		return res
+	def loaded(self, snapshot: ModulesSnapshot) -> None:
+		self.model.setModules(snapshot)
+		self.tree.setDisabled(False)
+		self.idle.emit()
 
-	def _removeTrigger(self, item, t):
-		if t.registered:
-			self.tm.unregisterTrigger(t)
-			item.setCheckState(0, Qt.Unchecked)
-			item.setText(0, unregisteredText)
+	def written(self, edits: typing.List[Edit]) -> None:
+		self.model.onWritten(edits)
+		if not self.model.inFlight:
+			self.idle.emit()
 
-	def triggerChanged(self, item, t, m, cs):
-		print("triggerChanged", t, cs)
-		if cs == Qt.CheckState.PartiallyChecked:
-			pass
-		else:
-			if cs == Qt.CheckState.Checked:
-				self.ensureTriggerRegistered(item, m, t)
-				self.tm.setTriggerEnabled(t, True)
-			elif cs == Qt.CheckState.Unchecked:
-				if self.settings.autoRemove:
-					self._removeTrigger(item, t)
-				else:
-					self.tm.setTriggerEnabled(t, False)
-			else:
-				raise ValueError(cs)
-			self.tm.db.commit()
-
-	def ensureTriggerRegistered(self, item, m, t):
-		if not t.registered:
-			self.registerTrigger(item, m, t)
-
-	def registerTrigger(self, item, m, t):
-		self.ensureModuleRegistered(item.parent(), m)
-		self.tm.registerTrigger(m, t.id)
-		item.setText(0, str(t.id))
-
-	def registerModule(self, item, m):
-		self.tm.registerPackage(m.id)
-		item.setText(0, str(m.id))
-
-	def ensureModuleRegistered(self, item, m):
-		if not m.registered:
-			self.registerModule(item, m)
-
-	def moduleChanged(self, item, m, cs):
-		print("moduleChanged", m, cs)
-		if cs == Qt.CheckState.PartiallyChecked:
-			pass
-		else:
-			if cs == Qt.CheckState.Checked:
-				self.ensureModuleRegistered(item, m)
-				self.tm.setPackageEnabled(m, True)
-			elif cs == Qt.CheckState.Unchecked:
-				if self.settings.autoRemove:
-					for childNo in range(item.childCount()):
-						el = item.child(childNo)
-						trigger = el.data(0, Qt.UserRole)
-						self._removeTrigger(el, trigger)
-					self.tm.unregisterPackage(m)
-					item.setText(0, unregisteredText)
-					item.setCheckState(0, Qt.Unchecked)
-				else:
-					self.tm.setPackageEnabled(m, False)
-			else:
-				raise ValueError(cs)
-			self.tm.db.commit()
-
-	def processTriggersCollection(self, moduleItem, coll: typing.Mapping[int, Trigger], idGenerator):
-		for t in universalValues(coll):
-			triggerItem = QTreeWidgetItem(moduleItem)
-			triggerItem.setFlags(triggerItem.flags() | Qt.ItemIsUserCheckable)
-			triggerItem.setText(0, idGenerator(t))
-			triggerItem.setText(1, t.internalName)
-			triggerItem.setText(3, str(t.__class__.__name__))
-			triggerItem.setCheckState(0, Qt.CheckState.Checked if t.status else Qt.CheckState.Unchecked)
-			triggerItem.setData(0, Qt.UserRole, t)
-
-	def processModuleCollection(self, tree: QTreeWidget, coll: typing.Mapping[int, Module], idGenerator: typing.Callable) -> None:
-		for m in universalValues(coll):
-			moduleItem = QTreeWidgetItem(tree)
-			moduleItem.setText(0, idGenerator(m))
-			moduleItem.setText(1, m.name)
-			moduleItem.setText(2, str(m.path))
-			moduleItem.setText(3, str(m.__class__.__name__))
-			moduleItem.setExpanded(True)
-			moduleItem.setFlags((moduleItem.flags() & ~Qt.ItemIsAutoTristate) | Qt.ItemIsUserCheckable)
-
-			moduleItem.setData(0, Qt.UserRole, m)
-			moduleItem.setCheckState(0, Qt.CheckState.Checked if m.status else Qt.CheckState.Unchecked)
-
-			self.processTriggersCollection(moduleItem, m.registeredTriggers, lambda t: str(t.id))
-			self.processTriggersCollection(moduleItem, m.unknownTriggers, lambda t: unregisteredText)
+	def failed(self, message: str) -> None:
+		logger.error("%s", message)
+		self.busy.emit(message)
+
+	def cleanup(self):
+		"""Deletes from the DB the modules and the triggers no longer installed and compacts it, in the worker thread"""
+
+		self.model.flush()
+		self.cleanupRequested.emit()
 
 
 def makeApp() -> int:
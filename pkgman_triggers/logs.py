@@ -0,0 +1,59 @@
+"""Logging of the package. Each module logs into its own logger, `pkgman_triggers.<module>`. Nothing is written unless enabled with the `PKGMAN_TRIGGERS_LOG` env var.
+
+The env var is a comma-separated list of levels: an optional level of the whole package, then the levels of its modules, like `info,dispatch=debug,AuthDB=warning`. The messages are written to stderr.
+
+The messages on the hot paths are guarded with `isEnabledFor` and are formatted lazily, so a disabled message costs a cached level check."""
+
+import logging
+import os
+import sys
+import typing
+
+logEnvVar = "PKGMAN_TRIGGERS_LOG"
+rootLoggerName = "pkgman_triggers"
+
+rootLogger = logging.getLogger(rootLoggerName)
+rootLogger.addHandler(logging.NullHandler())
+handler = None
+
+
+def parseLogSpec(spec: str) -> typing.Dict[str, int]:
+	"""Returns the levels by logger names"""
+
+	res = {}
+	for item in spec.split(","):
+		item = item.strip()
+		if not item:
+			continue
+		moduleName, sep, levelName = item.rpartition("=")
+		level = logging.getLevelName(levelName.strip().upper())
+		if not isinstance(level, int):
+			raise ValueError("Unknown log level " + repr(levelName))
+		moduleName = moduleName.strip()
+		res[rootLoggerName + "." + moduleName if sep and moduleName else rootLoggerName] = level
+	return res
+
+
+def configureLogging(spec: typing.Optional[str] = None) -> None:
+	"""Sets the levels from `spec` or from the env var and enables writing to stderr"""
+
+	global handler  # pylint:disable=global-statement
+
+	if spec is None:
+		spec = os.environ.get(logEnvVar, None)
+	if not spec:
+		return
+
+	try:
+		levels = parseLogSpec(spec)
+	except ValueError as ex:
+		sys.stderr.write(logEnvVar + " is invalid: " + str(ex) + "\n")
+		return
+
+	for name, level in levels.items():
+		logging.getLogger(name).setLevel(level)
+
+	if handler is None:
+		handler = logging.StreamHandler(sys.stderr)
+		handler.setFormatter(logging.Formatter("%(name)s: %(message)s"))
+		rootLogger.addHandler(handler)
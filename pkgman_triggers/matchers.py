@@ -1,16 +1,39 @@
+import fnmatch
+import logging
+import re
+import typing
 from abc import ABC, abstractmethod
+from enum import IntEnum
 
 from .events import Event
 from .PackageInfo import PackageInfo
 
+logger = logging.getLogger(__name__)
+
+
+class ConditionType(IntEnum):
+	"""The values of `conditions.type` in the DB"""
+
+	package = 0
+	path = 1
+
 
 class Matcher(ABC):
 	__slots__ = ()
 
+	conditionType = None
+
 	@abstractmethod
 	def __call__(self, event: Event):
 		raise NotImplementedError
 
+	@property
+	@abstractmethod
+	def spec(self) -> str:
+		"""The normalized text of the condition, identifying the matcher together with `conditionType`"""
+
+		raise NotImplementedError
+
 
 class IPackageMatcher(Matcher):
 	__slots__ = ()
@@ -21,7 +44,8 @@ class IPackageMatcher(Matcher):
 
 	def __call__(self, event: Event):
 		if event.triggerer:
-			print(event.triggerer)
+			if logger.isEnabledFor(logging.DEBUG):
+				logger.debug("Matching triggerer %r", event.triggerer)
 			mr = self.matchTriggerer(event.triggerer)
 			if mr:
 				return mr
@@ -29,13 +53,78 @@ class IPackageMatcher(Matcher):
 
 
 class PackageNameMatcher(IPackageMatcher):
-	"""Matches changes in some package"""
+	"""Matches changes in some package. A regex given as a string is compiled only when it is needed."""
+
+	__slots__ = ("pattern", "flags", "compiled")
+
+	conditionType = ConditionType.package
+
+	def __init__(self, rx: typing.Union[str, typing.Pattern]):
+		if isinstance(rx, str):
+			self.pattern = rx
+			self.flags = 0
+			self.compiled = None
+		else:
+			self.pattern = rx.pattern
+			self.flags = rx.flags & ~re.UNICODE
+			self.compiled = rx
 
-	__slots__ = ("rx",)
+	@property
+	def rx(self) -> typing.Pattern:
+		if self.compiled is None:
+			self.compiled = re.compile(self.pattern, self.flags)
+		return self.compiled
 
-	def __init__(self, rx):
-		self.rx = rx
+	@property
+	def spec(self) -> str:
+		if self.flags:
+			return "(?" + "".join(f for f, v in (("a", re.ASCII), ("i", re.IGNORECASE), ("L", re.LOCALE), ("m", re.MULTILINE), ("s", re.DOTALL), ("x", re.VERBOSE)) if self.flags & v) + ")" + self.pattern
+		return self.pattern
 
 	def matchTriggerer(self, pkgInfo: PackageInfo):
-		print(pkgInfo, self.rx)
+		if logger.isEnabledFor(logging.DEBUG):
+			logger.debug("Matching %r against %r", pkgInfo, self.spec)
 		return self.rx.match(pkgInfo.name)
+
+
+class IPathMatcher(Matcher):
+	__slots__ = ()
+
+	@abstractmethod
+	def matchPath(self, path: str) -> bool:
+		raise NotImplementedError
+
+	def __call__(self, event: Event):
+		if event.pathsAffected:
+			mr = [p for p in event.pathsAffected if self.matchPath(p)]
+			if mr:
+				return mr
+		return False
+
+
+globChars = "*?["
+
+
+class PathMatcher(IPathMatcher):
+	"""Matches changes of files within some dir or matching some glob. A glob is matched by `fnmatch` rules, so `*` matches `/` too."""
+
+	__slots__ = ("pattern", "literalPrefix", "isGlob")
+
+	conditionType = ConditionType.path
+
+	def __init__(self, pattern: str):
+		self.pattern = pattern
+		globStart = min((i for i in (pattern.find(c) for c in globChars) if i >= 0), default=len(pattern))
+		self.literalPrefix = pattern[:globStart]
+		self.isGlob = globStart < len(pattern)
+
+	@property
+	def spec(self) -> str:
+		return self.pattern
+
+	def matchPath(self, path: str) -> bool:
+		if self.isGlob:
+			return path.startswith(self.literalPrefix) and fnmatch.fnmatchcase(path, self.pattern)
+		if not path.startswith(self.pattern):
+			return False
+		return len(path) == len(self.pattern) or self.pattern[-1] == "/" or path[len(self.pattern)] == "/"
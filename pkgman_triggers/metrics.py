@@ -0,0 +1,106 @@
+"""Timers and counters of the phases of the pipeline, and profiling.
+
+The metrics of a `TriggerManager` are written on exit as a JSON line into the file set in the `PKGMAN_TRIGGERS_METRICS` env var (`-` means stderr). If `PKGMAN_TRIGGERS_PROFILE` is set, the hook is run under `cProfile` and the stats are dumped into that file, to be loaded with `pstats`."""
+
+import atexit
+import cProfile
+import json
+import os
+import sys
+import time
+import typing
+import warnings
+from collections import OrderedDict
+from contextlib import contextmanager
+
+metricsEnvVar = "PKGMAN_TRIGGERS_METRICS"
+profileEnvVar = "PKGMAN_TRIGGERS_PROFILE"
+
+
+class Metrics:
+	"""Total times of phases in seconds, counters and total times of execution of each trigger"""
+
+	__slots__ = ("timers", "counters", "triggers")
+
+	def __init__(self) -> None:
+		self.timers = OrderedDict()
+		self.counters = OrderedDict()
+		self.triggers = OrderedDict()
+
+	def addTime(self, phase: str, duration: float) -> None:
+		self.timers[phase] = self.timers.get(phase, 0.) + duration
+
+	def count(self, name: str, n: int = 1) -> None:
+		self.counters[name] = self.counters.get(name, 0) + n
+
+	def addTriggerTime(self, name: str, duration: float) -> None:
+		self.triggers[name] = self.triggers.get(name, 0.) + duration
+
+	@contextmanager
+	def timer(self, phase: str) -> typing.Iterator[None]:
+		started = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.addTime(phase, time.perf_counter() - started)
+
+	def timedIter(self, phase: str, it: typing.Iterable) -> typing.Iterator:
+		"""Counts the time spent in producing the items of a lazy iterable into `phase`"""
+
+		it = iter(it)
+		while True:
+			started = time.perf_counter()
+			try:
+				item = next(it)
+			except StopIteration:
+				self.addTime(phase, time.perf_counter() - started)
+				return
+			self.addTime(phase, time.perf_counter() - started)
+			yield item
+
+	def toDict(self) -> dict:
+		return {"time": time.time(), "pid": os.getpid(), "timers": self.timers, "counters": self.counters, "triggers": self.triggers}
+
+	def write(self, target: str) -> None:
+		"""Appends a JSON line to the file, or writes it to stderr if `target` is `-`"""
+
+		line = json.dumps(self.toDict()) + "\n"
+		if target == "-":
+			sys.stderr.write(line)
+			return
+
+		try:
+			with open(target, "at", encoding="utf-8") as f:
+				f.write(line)
+		except OSError as ex:
+			warnings.warn("Cannot write the metrics to " + target + ": " + str(ex))
+
+
+def getMetricsTarget() -> typing.Optional[str]:
+	return os.environ.get(metricsEnvVar, None) or None
+
+
+def startProfiling(path: str) -> cProfile.Profile:
+	"""Profiles the rest of the run, the stats are dumped on exit"""
+
+	prof = cProfile.Profile()
+	atexit.register(lambda: (prof.disable(), prof.dump_stats(path)))
+	prof.enable()
+	return prof
+
+
+@contextmanager
+def profiled(path: typing.Optional[str]) -> typing.Iterator[None]:
+	"""Profiles the block if `path` is given"""
+
+	if not path:
+		yield
+		return
+
+	prof = cProfile.Profile()
+	prof.enable()
+	try:
+		yield
+	finally:
+		prof.disable()
+		prof.dump_stats(path)
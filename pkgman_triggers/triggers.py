@@ -1,12 +1,13 @@
+import logging
 import typing
 from collections import OrderedDict
 from pathlib import Path
 
-from pkg_resources import EggInfoDistribution, EntryPoint
-
-from pkgman_triggers.matchers import PackageNameMatcher
+from pkgman_triggers.discovery import DiscoveredDist, DiscoveredEntryPoint
+from pkgman_triggers.matchers import Matcher
 
 moduleNameEpNameSeparator = "%"
+logger = logging.getLogger(__name__)
 
 
 class TemporaryID(int):
@@ -33,7 +34,7 @@ class Enableable(Registrable):
 class Module(Enableable):
 	__slots__ = ("id", "status", "registeredTriggers", "unknownTriggers", "dist", "path")
 
-	def __init__(self, dist: EggInfoDistribution) -> None:
+	def __init__(self, dist: DiscoveredDist) -> None:
 		super().__init__(None, None)
 		self.registeredTriggers = OrderedDict()
 		self.unknownTriggers = {}
@@ -50,7 +51,7 @@ class Module(Enableable):
 
 
 class Trigger(Enableable):
-	__slots__ = ("id", "module", "status", "entryPoint", "matchers")
+	__slots__ = ("id", "module", "status", "entryPoint", "matchers", "batch", "executor", "timeout", "ordered", "func")
 
 	@property
 	def internalName(self) -> str:
@@ -68,23 +69,37 @@ class Trigger(Enableable):
 	def name(self) -> str:
 		return moduleNameEpNameSeparator.join((self.moduleName, self.internalName))
 
-	def __init__(self, entryPoint: EntryPoint, matchers: typing.Iterable[PackageNameMatcher]) -> None:
+	def __init__(self, entryPoint: DiscoveredEntryPoint, matchers: typing.Iterable[Matcher], batch: bool = True, executor: str = "thread", timeout: typing.Optional[float] = None, ordered: bool = False) -> None:
 		super().__init__(None, None)
 		self.module = None
 		self.entryPoint = entryPoint
 		self.matchers = matchers
+		self.batch = batch
+		self.executor = executor
+		self.timeout = timeout
+		self.ordered = ordered
+		self.func = None
 
 	def match(self, evt):
 		for m in self.matchers:
 			matchRes = m(evt)
-			print("matchRes", matchRes)
+			if logger.isEnabledFor(logging.DEBUG):
+				logger.debug("%r: %r matched %r", self, m, matchRes)
 			if matchRes:
 				return matchRes
 		return None
 
+	def resolve(self) -> typing.Callable:
+		"""Imports the entry point on the first call, which happens only when the trigger has matched something"""
+
+		if self.func is None:
+			self.func = self.entryPoint.resolve()
+		return self.func
+
 	def __call__(self, matchResults):
-		print("matched", self, matchResults)
-		return self.entryPoint.resolve()(matchResults)
+		if logger.isEnabledFor(logging.DEBUG):
+			logger.debug("Calling %r with %r", self, matchResults)
+		return self.resolve()(matchResults)
 
 	def __repr__(self) -> str:
 		return self.__class__.__name__ + "<" + ", ".join((repr(self.id), repr(self.name),)) + ">"
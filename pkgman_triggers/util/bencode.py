@@ -0,0 +1,109 @@
+"""A minimal incremental bencode decoder. A top-level dict or list can be iterated item by item without decoding the whole of it first."""
+
+import typing
+
+class BencodeError(ValueError):
+	pass
+
+
+def decodeStr(raw: bytes) -> typing.Union[str, bytes]:
+	try:
+		return raw.decode("utf-8")
+	except UnicodeDecodeError:
+		return raw
+
+
+def decodeInt(buf: bytes, pos: int) -> typing.Tuple[int, int]:
+	end = buf.find(b"e", pos + 1)
+	if end < 0:
+		raise BencodeError("Unterminated integer at " + str(pos))
+	try:
+		return int(buf[pos + 1:end]), end + 1
+	except ValueError as ex:
+		raise BencodeError("Invalid integer at " + str(pos)) from ex
+
+
+def decodeBytes(buf: bytes, pos: int) -> typing.Tuple[typing.Union[str, bytes], int]:
+	colon = buf.find(b":", pos)
+	if colon < 0:
+		raise BencodeError("Unterminated string length at " + str(pos))
+	size = buf[pos:colon]
+	if not size.isdigit():  # `int` would accept a sign, spaces and underscores
+		raise BencodeError("Invalid string length at " + str(pos))
+	size = int(size)
+	start = colon + 1
+	end = start + size
+	if end > len(buf):
+		raise BencodeError("Truncated string at " + str(pos))
+	return decodeStr(buf[start:end]), end
+
+
+def iterList(buf: bytes, pos: int) -> typing.Iterator[typing.Tuple[typing.Any, int]]:
+	"""Yields the items of the list starting at `pos` and the positions after each of them"""
+
+	if buf[pos:pos + 1] != b"l":
+		raise BencodeError("A list was expected at " + str(pos))
+	pos += 1
+	while buf[pos:pos + 1] != b"e":
+		if pos >= len(buf):
+			raise BencodeError("Unterminated list")
+		item, pos = decodeAt(buf, pos)
+		yield item, pos
+
+
+def iterDict(buf: bytes, pos: int) -> typing.Iterator[typing.Tuple[typing.Union[str, bytes], typing.Any, int]]:
+	"""Yields the items of the dict starting at `pos` and the positions after each of them"""
+
+	if buf[pos:pos + 1] != b"d":
+		raise BencodeError("A dict was expected at " + str(pos))
+	pos += 1
+	while buf[pos:pos + 1] != b"e":
+		if pos >= len(buf):
+			raise BencodeError("Unterminated dict")
+		key, pos = decodeBytes(buf, pos)
+		value, pos = decodeAt(buf, pos)
+		yield key, value, pos
+
+
+def iterListItems(buf: bytes, pos: int = 0) -> typing.Iterator[typing.Any]:
+	"""Yields the items of a list one by one, only a single item is decoded at a time"""
+
+	for item, _ in iterList(buf, pos):
+		yield item
+
+
+def iterDictItems(buf: bytes, pos: int = 0) -> typing.Iterator[typing.Tuple[typing.Union[str, bytes], typing.Any]]:
+	"""Yields the items of a dict one by one, only a single value is decoded at a time"""
+
+	for key, value, _ in iterDict(buf, pos):
+		yield key, value
+
+
+def decodeAt(buf: bytes, pos: int) -> typing.Tuple[typing.Any, int]:
+	"""Decodes a single value starting at `pos`. Returns it and the position after it."""
+
+	c = buf[pos:pos + 1]
+	if c == b"i":
+		return decodeInt(buf, pos)
+	if c == b"l":
+		res = []
+		end = pos + 1
+		for item, end in iterList(buf, pos):
+			res.append(item)
+		return res, end + 1
+	if c == b"d":
+		res = {}
+		end = pos + 1
+		for key, value, end in iterDict(buf, pos):
+			res[key] = value
+		return res, end + 1
+	if c.isdigit():
+		return decodeBytes(buf, pos)
+	raise BencodeError("Unexpected " + repr(c) + " at " + str(pos))
+
+
+def decode(buf: bytes) -> typing.Any:
+	res, end = decodeAt(buf, 0)
+	if end != len(buf):
+		raise BencodeError("Trailing data at " + str(end))
+	return res
@@ -0,0 +1,64 @@
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+repoRoot = Path(__file__).absolute().parent.parent
+
+registerCode = """
+import sys
+from pkgman_triggers import TriggerManager
+from pkgman_triggers.util import universalItems, universalKeys
+with TriggerManager() as tm:
+	ms = tm.registerPackages([idx for idx, m in tuple(universalItems(tm.unknownModules)) if m.name in sys.argv[1:]])
+	tm.setPackagesEnabled(ms, True)
+	tm.registerTriggers((m, idx) for m in ms for idx in tuple(universalKeys(m.unknownTriggers)))
+	tm.setTriggersEnabled((t for m in ms for t in m.registeredTriggers.values()), True)
+"""
+
+
+class FakeSite:
+	"""A dir of fake dists and a work dir for the DB and the caches. The code is run in child processes with the dir in `sys.path`."""
+
+	__slots__ = ("siteDir", "workDir")
+
+	def __init__(self, root: Path) -> None:
+		self.siteDir = root / "site-packages"
+		self.workDir = root / "work"
+		self.siteDir.mkdir()
+		self.workDir.mkdir()
+
+	def addDist(self, name: str, version: str = "1.0") -> Path:
+		"""The dist has a single trigger `name` matching the package `name`"""
+
+		distInfo = self.siteDir / (name + "-" + version + ".dist-info")
+		distInfo.mkdir()
+		(distInfo / "METADATA").write_text("Metadata-Version: 2.1\nName: " + name + "\nVersion: " + version + "\n")
+		(distInfo / "entry_points.txt").write_text("[pkgman_triggers]\n" + name + '@{"packages": ["' + name + '$"]} = ' + name + ":trigger\n")
+		(self.siteDir / (name + ".py")).write_text("def trigger(matchResults):\n\tprint(" + repr(name) + ", matchResults)\n")
+		return distInfo
+
+	def removeDist(self, name: str) -> None:
+		for distInfo in self.siteDir.glob(name + "-*.dist-info"):
+			shutil.rmtree(str(distInfo))
+		(self.siteDir / (name + ".py")).unlink()
+
+	def register(self, *names: str) -> None:
+		"""Registers and enables the dists with their triggers"""
+
+		self.run(registerCode, *names)
+
+	def run(self, code: str, *args: str, env: dict = None) -> str:
+		fullEnv = dict(os.environ)
+		fullEnv["PYTHONPATH"] = os.pathsep.join((str(repoRoot), str(self.siteDir)))
+		if env:
+			fullEnv.update(env)
+		return subprocess.run((sys.executable, "-c", code) + args, cwd=str(self.workDir), env=fullEnv, stdout=subprocess.PIPE, check=True, universal_newlines=True, timeout=60).stdout
+
+
+@pytest.fixture
+def fakeSite(tmp_path):
+	return FakeSite(tmp_path)
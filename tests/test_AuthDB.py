@@ -0,0 +1,126 @@
+import sqlite3
+
+from pkgman_triggers.AuthDB import DB_INDEXES, SCHEMA_VERSION, AuthDB
+
+# the schema created by the versions before the schema versioning, frozen here so later changes of `DB_SCHEMA` don't change the test
+baselineSchema = (
+	"CREATE TABLE `packages` (`id` INTEGER NOT NULL PRIMARY KEY, `name` TEXT NOT NULL UNIQUE, `path` TEXT NOT NULL UNIQUE, `status` INTEGER DEFAULT 0 NOT NULL);",
+	"CREATE TABLE `triggers` (`id` INTEGER NOT NULL PRIMARY KEY, `package` INTEGER NOT NULL, `name` TEXT NOT NULL, `status` INTEGER DEFAULT 0 NOT NULL, `managers` INTEGER DEFAULT 0 NOT NULL, UNIQUE(package, name) FOREIGN KEY(`package`) REFERENCES `packages`(`id`));",
+	"CREATE TABLE `conditions` (`trigger` INTEGER NOT NULL, `hash` BLOB NOT NULL, `type` INTEGER NOT NULL , `status` INTEGER DEFAULT 0 NOT NULL, PRIMARY KEY(trigger, hash) FOREIGN KEY(`trigger`) REFERENCES `triggers`(`id`));",
+)
+
+
+def getIndexes(db: AuthDB):
+	return {r["name"] for r in db.db.execute("SELECT `name` FROM `sqlite_master` WHERE `type` = 'index' AND `name` NOT LIKE 'sqlite_%';")}
+
+
+def testHookQueriesUseIndexes(tmp_path):
+	with AuthDB(tmp_path / "db.sqlite") as db:
+		packageId = db.registerPackage("pkg", tmp_path)
+		db.setTriggerEnabled(db.registerTrigger(packageId, "t"), True)
+		db.setPackageEnabled(packageId, True)
+		assert db.findFullScans() == []
+
+
+def testMigrationFromBaseline(tmp_path):
+	dbPath = tmp_path / "db.sqlite"
+	conn = sqlite3.connect(str(dbPath))
+	for statement in baselineSchema:
+		conn.execute(statement)
+	for i in range(1, 31):  # with a few rows a scan is the cheapest plan
+		conn.execute("INSERT INTO `packages` (`id`, `name`, `path`, `status`) VALUES (?, ?, ?, ?);", (i, "pkg" + str(i), "/" + str(i), int(not i % 3)))
+		conn.execute("INSERT INTO `triggers` (`id`, `package`, `name`, `status`) VALUES (?, ?, 't', ?);", (100 + i, i, i % 2))
+	conn.execute("INSERT INTO `conditions` (`trigger`, `hash`, `type`) VALUES (101, x'00', 1);")
+	conn.commit()
+	conn.close()
+
+	with AuthDB(dbPath) as db:
+		assert db.getSchemaVersion() == SCHEMA_VERSION
+		assert set(DB_INDEXES) <= getIndexes(db)
+		packages, triggers = db.loadRegistrations()
+		assert len(packages) == 30
+		assert packages["/1"] == {"id": 1, "name": "pkg1", "status": 0}
+		assert triggers[(1, "t")]["id"] == 101
+		assert len(db.findConditionsByTrigger(101)) == 1
+		db.enqueue([(101, "[]")])
+		assert db.findFullScans() == []
+
+	with AuthDB(dbPath, readOnly=True) as db:
+		assert db.getSchemaVersion() == SCHEMA_VERSION
+		assert len(db.fetchQueued(10)) == 1
+
+
+movedCode = """
+import sqlite3, sys
+from pkgman_triggers import TriggerManager
+from pkgman_triggers.AuthDB import AuthDB
+
+with AuthDB() as db:
+	db.db.execute("UPDATE `packages` SET `path` = ?;", (sys.argv[1],))  # as registered before the paths of the top-level modules were used
+
+statements = []
+connect = sqlite3.connect
+
+def tracedConnect(*args, **kwargs):
+	res = connect(*args, **kwargs)
+	res.set_trace_callback(statements.append)
+	return res
+
+sqlite3.connect = tracedConnect
+with TriggerManager(readOnly=True, activeOnly=True) as tm:
+	print(sorted(m.name for m in tm.registeredModules.values()))
+	print(sum(s.lstrip().startswith("SELECT") for s in statements))
+sqlite3.connect = connect
+with TriggerManager() as tm:
+	pass
+with AuthDB() as db:
+	print(db.db.execute("SELECT `path` FROM `packages`;").fetchone()[0])
+"""
+
+
+def testMovedPackagesAreFoundWithoutExtraQueries(fakeSite):
+	for i in range(5):
+		fakeSite.addDist("fake_dist_" + str(i))
+	fakeSite.register("fake_dist_1")
+	modules, selects, path = fakeSite.run(movedCode, str(fakeSite.siteDir)).splitlines()
+	assert modules == "['fake_dist_1']"
+	assert selects == "1"
+	assert path == str((fakeSite.siteDir / "fake_dist_1.py").resolve())
+
+
+def testBulkRegistrationLooksUpOnlyInsertedKeys(tmp_path):
+	with AuthDB(tmp_path / "db.sqlite") as db:
+		other = db.registerPackages([("other", tmp_path / "other")])[str(tmp_path / "other")]
+		db.registerTriggers([(other, "t")])
+
+		statements = []
+		db.db.set_trace_callback(statements.append)
+		packages = db.registerPackages([("pkg" + str(i), tmp_path / str(i)) for i in range(1500)] + [("other", tmp_path / "other")])
+		triggers = db.registerTriggers([(packages[str(tmp_path / "1")], "t"), (packages[str(tmp_path / "1")], "u"), (other, "t")])
+		db.db.set_trace_callback(None)
+
+		assert len(packages) == 1501 and packages[str(tmp_path / "other")] == other
+		assert set(triggers) == {(packages[str(tmp_path / "1")], "t"), (packages[str(tmp_path / "1")], "u"), (other, "t")}
+		selects = [s for s in statements if s.lstrip().startswith("SELECT")]
+		assert len(selects) == 3 and all("WHERE" in s for s in selects)
+
+
+def testTriggerNameGlobIsMatchedLikeFnmatch(tmp_path):
+	with AuthDB(tmp_path / "db.sqlite") as db:
+		packageId = db.registerPackage("pkg", tmp_path)
+		db.registerTriggers((packageId, name) for name in ("abc", "bcd", "^cd", "!cd"))
+		for pattern, expected in (("[!a]*", ["bcd", "^cd", "!cd"]), ("[^a]*", ["abc", "^cd"]), ("?cd", ["bcd", "^cd", "!cd"]), ("*", ["abc", "bcd", "^cd", "!cd"])):
+			assert [r["name"] for r in db.iterRegistrations(triggerNameGlob=pattern)] == expected
+
+
+def testBulkUnregistration(tmp_path):
+	with AuthDB(tmp_path / "db.sqlite") as db:
+		packages = db.registerPackages(("pkg" + str(i), tmp_path / str(i)) for i in range(3))
+		triggers = db.registerTriggers((packageId, "t") for packageId in packages.values())
+		db.enqueue((triggerId, "[]") for triggerId in triggers.values())
+		db.setTriggerConditions(triggers[(packages[str(tmp_path / "1")], "t")], [(b"\0", 1)])
+
+		db.unregisterPackagesByIds([packages[str(tmp_path / "0")], packages[str(tmp_path / "1")]])
+		assert [r["packageName"] for r in db.iterRegistrations()] == ["pkg2"]
+		assert [r["trigger"] for r in db.fetchQueued(10)] == [triggers[(packages[str(tmp_path / "2")], "t")]]
+		assert db.db.execute("SELECT COUNT(*) FROM `conditions`;").fetchone()[0] == 0
@@ -0,0 +1,38 @@
+import pytest
+
+from pkgman_triggers.util.bencode import BencodeError, decode, iterDictItems, iterListItems
+
+
+def testNested():
+	assert decode(b"d3:pkgd1:A5:amd641:V3:1.0e4:listli1ei-2el0:eee") == {"pkg": {"A": "amd64", "V": "1.0"}, "list": [1, -2, [""]]}
+
+
+def testNonUtf8StringsAreBytes():
+	assert decode(b"2:\xff\xfe") == b"\xff\xfe"
+
+
+def testItemsAreDecodedOneByOne():
+	items = iterDictItems(b"d1:ad1:V1:1e1:bi2e1:c")
+	assert next(items) == ("a", {"V": "1"})
+	assert next(items) == ("b", 2)
+	with pytest.raises(BencodeError):
+		next(items)
+	assert list(iterListItems(b"li1e1:xe")) == [1, "x"]
+
+
+@pytest.mark.parametrize("raw", (b"", b"d", b"d1:a", b"d1:ai1", b"l1:a", b"5:abc", b"i12", b"d1:ad1:V1:1e"))
+def testTruncated(raw):
+	with pytest.raises(BencodeError):
+		decode(raw)
+
+
+@pytest.mark.parametrize("raw", (b"-1:a", b"+1:a", b" 1:a", b"1_0:aaaaaaaaaa", b"x:a", b"1a"))
+def testInvalidLengthPrefix(raw):
+	with pytest.raises(BencodeError):
+		decode(raw)
+
+
+@pytest.mark.parametrize("raw", (b"i1xe", b"di1ei2ee", b"x", b"i1ei2e"))
+def testInvalid(raw):
+	with pytest.raises(BencodeError):
+		decode(raw)
@@ -0,0 +1,32 @@
+coalescedHookCode = """
+from pkgman_triggers import TriggerManager
+from pkgman_triggers.events import Event
+from pkgman_triggers.PackageInfo import PackageInfo
+with TriggerManager(readOnly=True, activeOnly=True, coalesceWindow=600) as tm:
+	print(len(tm.processEvent(Event(PackageInfo("fake_dist", "1.0", "amd64"), None, [], "configure")).errors))
+"""
+
+flakyTriggerCode = """
+from pathlib import Path
+
+def trigger(matchResults):
+	with open("calls", "at") as f:
+		f.write("call\\n")
+	if Path("fail").exists():
+		raise RuntimeError("failing as asked")
+"""
+
+
+def testFailedEventsAreNotCoalesced(fakeSite):
+	fakeSite.addDist("fake_dist")
+	(fakeSite.siteDir / "fake_dist.py").write_text(flakyTriggerCode)
+	fakeSite.register("fake_dist")
+	calls = fakeSite.workDir / "calls"
+	fail = fakeSite.workDir / "fail"
+
+	fail.touch()
+	assert fakeSite.run(coalescedHookCode).strip() == "1"
+	fail.unlink()
+	assert fakeSite.run(coalescedHookCode).strip() == "0"
+	assert fakeSite.run(coalescedHookCode).strip() == "0"
+	assert len(calls.read_text().splitlines()) == 2
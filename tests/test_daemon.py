@@ -0,0 +1,28 @@
+daemonCode = """
+import sys
+from pkgman_triggers.AuthDB import AuthDB
+from pkgman_triggers.daemon import TriggerDaemon
+
+environ = {b"DPKG_HOOK_ACTION": b"post-invoke", b"DPKG_ADMINDIR": sys.argv[1].encode(), b"DPKG_TRIGGERER_PACKAGES_INFO": b"d11:fake_dist_0d1:A5:amd641:V3:1.0ee"}
+d = TriggerDaemon(sys.argv[2])
+try:
+	print(d.processRequest([], {**environ, b"PKGMAN_TRIGGERS_SPOOL": b"1"}))
+	with AuthDB(readOnly=True) as db:
+		print(len(db.fetchQueued(10)))
+	print(d.processRequest([], environ))
+finally:
+	d.server_close()
+"""
+
+
+def testSpoolModeIsHonoured(fakeSite, tmp_path):
+	adminDir = tmp_path / "dpkg"
+	(adminDir / "info").mkdir(parents=True)
+	(adminDir / "status").write_bytes(b"")
+	fakeSite.addDist("fake_dist_0")
+	fakeSite.register("fake_dist_0")
+
+	spooled, queued, output, run = fakeSite.run(daemonCode, str(adminDir), str(tmp_path / "d.sock")).splitlines()
+	assert (spooled, queued) == ("[]", "1")
+	assert output.startswith("fake_dist_0 ")  # printed by the trigger
+	assert run == "[]"
@@ -0,0 +1,79 @@
+import os
+import sys
+
+import pytest
+
+from pkgman_triggers import discovery
+from pkgman_triggers.discovery import discoverEntryPoints
+
+
+def bumpMtime(path):
+	"""The tests run faster than the mtime granularity of some filesystems"""
+
+	st = os.stat(str(path))
+	os.utime(str(path), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+def discover(cachePath):
+	return sorted((ep.name, ep.dist.version) for ep in discoverEntryPoints(cachePath))
+
+
+@pytest.fixture
+def site(fakeSite, monkeypatch):
+	monkeypatch.setattr(sys, "path", [str(fakeSite.siteDir)])
+	fakeSite.addDist("fake_a")
+	fakeSite.addDist("fake_b")
+	return fakeSite
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+	res = []
+	parse = discovery.parseMetadataDir
+
+	def tracedParse(path):
+		res.append(os.path.basename(path))
+		return parse(path)
+
+	monkeypatch.setattr(discovery, "parseMetadataDir", tracedParse)
+	return res
+
+
+def testUnchangedDirIsNotRescanned(site, tmp_path, parsed, monkeypatch):
+	cachePath = tmp_path / "cache.json"
+	assert discover(cachePath) == [("fake_a", "1.0"), ("fake_b", "1.0")]
+	assert cachePath.is_file()
+
+	monkeypatch.setattr(discovery, "scanSysPathEntry", None)
+	assert discover(cachePath) == [("fake_a", "1.0"), ("fake_b", "1.0")]
+	assert discover(None) == [("fake_a", "1.0"), ("fake_b", "1.0")]
+
+
+def testAddedAndRemovedDists(site, tmp_path, parsed):
+	cachePath = tmp_path / "cache.json"
+	discover(cachePath)
+
+	site.addDist("fake_c")
+	bumpMtime(site.siteDir)
+	parsed.clear()
+	assert discover(cachePath) == [("fake_a", "1.0"), ("fake_b", "1.0"), ("fake_c", "1.0")]
+	assert parsed == ["fake_c-1.0.dist-info"]
+
+	site.removeDist("fake_a")
+	bumpMtime(site.siteDir)
+	parsed.clear()
+	assert discover(cachePath) == [("fake_b", "1.0"), ("fake_c", "1.0")]
+	assert parsed == []
+
+
+def testChangedMetadataDirIsReparsed(site, tmp_path, parsed):
+	cachePath = tmp_path / "cache.json"
+	discover(cachePath)
+
+	distInfo = site.siteDir / "fake_b-1.0.dist-info"
+	(distInfo / "METADATA").write_text("Metadata-Version: 2.1\nName: fake_b\nVersion: 1.1\n")
+	bumpMtime(distInfo)
+	bumpMtime(site.siteDir)
+	parsed.clear()
+	assert discover(cachePath) == [("fake_a", "1.0"), ("fake_b", "1.1")]
+	assert parsed == ["fake_b-1.0.dist-info"]
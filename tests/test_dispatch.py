@@ -0,0 +1,149 @@
+import random
+import re
+
+import pytest
+
+from pkgman_triggers.discovery import DiscoveredEntryPoint
+from pkgman_triggers.dispatch import DispatchIndex, RegexAlternation
+from pkgman_triggers.events import Event
+from pkgman_triggers.matchers import PackageNameMatcher, PathMatcher
+from pkgman_triggers.PackageInfo import PackageInfo
+from pkgman_triggers.triggers import Trigger
+
+
+def makeTriggers(specs):
+	res = []
+	for i, matchers in enumerate(specs):
+		t = Trigger(DiscoveredEntryPoint("t" + str(i), "fake", ("trigger",), None, None), matchers)
+		t.id = i
+		res.append(t)
+	return res
+
+
+def makeEvent(name, paths=()):
+	return Event(PackageInfo(name, "1.0", "amd64"), None, list(paths))
+
+
+def matchOneByOne(triggers, evt):
+	res = {}
+	for t in triggers:
+		matchRes = t.match(evt)
+		if matchRes:
+			res[t] = matchRes
+	return res
+
+
+def normalize(matched):
+	return [(t.id, r.group(0) if isinstance(r, re.Match) else r) for t, r in matched.items()]
+
+
+def isValid(pattern):
+	try:
+		re.compile(pattern)
+	except re.error:
+		return False
+	return True
+
+
+def assertSameAsOneByOne(triggers, events):
+	index = DispatchIndex(triggers)
+	restored = DispatchIndex.fromArtifact(index.toArtifact(), triggers)
+	for evt in events:
+		expected = normalize(matchOneByOne(triggers, evt))
+		assert normalize(index.match(evt)) == expected, evt.triggerer
+		assert normalize(restored.match(evt)) == expected, evt.triggerer
+
+
+packagePatterns = (
+	"libfoo$",
+	"libfoo",
+	"lib.*",
+	"^python3-.*",
+	"lib[a-z]+-dev$",
+	"(lib|py)bar",
+	"(?P<x>lib).*z",
+	"(?P<x>lib)foo",
+	"(?i)LIBBAZ",
+	"(?i:LIB)qux",
+	"lib(?=f)",
+	"(a)(?(1)b|c)",
+	"(?<n>x)y",  # a named group only since Python 3.12
+)
+names = ("libfoo", "libfoo-dev", "libbaz", "LIBBAZ", "libqux", "LIBqux", "python3-lib", "pybar", "libbar", "libxyz", "ab", "xy", "zzz")
+
+
+def testNamedGroupsAndInlineFlagsAreNotCombined():
+	for pattern in ("(?P<x>lib).*z", "(?P=x)", "(?i)foo", "a(?(1)b)"):
+		assert not RegexAlternation.isCombinable(pattern)
+	for pattern in ("(lib|py)bar", "(?i:lib)foo", "(?<=a)b", "lib(?!x)"):
+		assert RegexAlternation.isCombinable(pattern)
+
+
+def testPackageNames():
+	triggers = makeTriggers([[PackageNameMatcher(p)] for p in packagePatterns if isValid(p)])
+	assertSameAsOneByOne(triggers, [makeEvent(n) for n in names])
+
+
+def testCompiledPatternsWithFlags():
+	triggers = makeTriggers([[PackageNameMatcher(re.compile("libbaz", re.IGNORECASE))], [PackageNameMatcher("libbaz$")]])
+	assertSameAsOneByOne(triggers, [makeEvent(n) for n in ("libbaz", "LIBBAZ", "libbazz")])
+
+
+def testPaths():
+	triggers = makeTriggers([[PathMatcher("/usr/lib/")], [PathMatcher("/usr/lib/*.so")], [PathMatcher("/etc/foo")], [PackageNameMatcher("nope$"), PathMatcher("/usr/share/*/doc")]])
+	paths = ("/usr/lib/a.so", "/usr/libx/a", "/etc/foo", "/etc/foobar", "/etc/foo/bar", "/usr/share/x/doc", "/usr/share/doc")
+	assertSameAsOneByOne(triggers, [makeEvent("pkg", [p]) for p in paths] + [makeEvent("pkg", paths)])
+
+
+def testPathsAreWantedOnlyByPathMatchers():
+	assert not DispatchIndex(makeTriggers([[PackageNameMatcher("libfoo$"), PackageNameMatcher("(?i)lib")]])).wantsPaths
+	assert DispatchIndex(makeTriggers([[PackageNameMatcher("libfoo$")], [PathMatcher("/usr/lib/")]])).wantsPaths
+
+
+def testFirstMatcherOfTriggerWins():
+	triggers = makeTriggers([[PackageNameMatcher("lib.*x"), PackageNameMatcher("libfoo$"), PathMatcher("/usr/")]])
+	assertSameAsOneByOne(triggers, [makeEvent("libfoo", ["/usr/a"]), makeEvent("libfoox"), makeEvent("zzz", ["/usr/a"])])
+
+
+def testArtifactIsTrusted(monkeypatch):
+	triggers = makeTriggers([[PackageNameMatcher(p)] for p in packagePatterns if isValid(p)])
+	artifact = DispatchIndex(triggers).toArtifact()
+
+	def fail(pattern):
+		raise AssertionError("the pattern " + repr(pattern) + " is classified again")
+
+	monkeypatch.setattr(RegexAlternation, "isCombinable", staticmethod(fail))
+	restored = DispatchIndex.fromArtifact(artifact, triggers)
+	for evt in [makeEvent(n) for n in names]:
+		assert normalize(restored.match(evt)) == normalize(matchOneByOne(triggers, evt)), evt.triggerer
+
+
+@pytest.mark.parametrize("seed", range(5))
+def testRandomized(seed):
+	rnd = random.Random(seed)
+	alphabet = "abl"
+	pieces = ("a", "b", "l", ".", ".*", "[ab]", "(a|b)", "b?", "l+")
+
+	def randomPattern():
+		res = "".join(rnd.choice(pieces) for _i in range(rnd.randint(1, 4)))
+		return res + ("$" if rnd.random() < 0.3 else "")
+
+	triggers = makeTriggers([[PackageNameMatcher(randomPattern()) for _j in range(rnd.randint(1, 3))] for _i in range(40)])
+	events = [makeEvent("".join(rnd.choice(alphabet) for _j in range(rnd.randint(1, 6)))) for _i in range(200)]
+	assertSameAsOneByOne(triggers, events)
+
+
+hookLoadCode = """
+from pkgman_triggers import TriggerManager
+with TriggerManager(readOnly=True, activeOnly=True) as tm:
+	tm.getDispatchIndex()
+	print(tm.metrics.counters.get("dispatchIndexRebuilds", 0))
+"""
+
+
+def testArtifactOfRegisteringSessionIsUsedByHook(fakeSite):
+	for i in range(3):
+		fakeSite.addDist("fake_dist_" + str(i))
+	fakeSite.register("fake_dist_2")
+	fakeSite.register("fake_dist_0")  # registered after fake_dist_2, but loaded before it
+	assert fakeSite.run(hookLoadCode).strip() == "0"
@@ -0,0 +1,25 @@
+import pytest
+
+from pkgman_triggers.backends import dpkg
+from pkgman_triggers.backends.dpkg import DpkgInfo
+
+
+def makeInfo(tmp_path, triggerers):
+	(tmp_path / "info").mkdir()
+	(tmp_path / "info" / "pkg:amd64.list").write_text("/usr\n/usr/lib/pkg\n")
+	return DpkgInfo(environ={b"DPKG_ADMINDIR": str(tmp_path).encode(), b"DPKG_HOOK_ACTION": b"trigger", b"DPKG_TRIGGERER_PACKAGES_INFO": triggerers})
+
+
+def testMalformedTriggerersAreWarnedAbout(tmp_path):
+	i = makeInfo(tmp_path, b"d3:pkgd1:A5:amd641:V3:1.0e5:otherd1:A-1:")
+	with pytest.warns(UserWarning, match="malformed"):
+		events = list(i.toEvents())
+	assert [evt.triggerer.name for evt in events] == ["pkg"]
+	assert list(events[0].pathsAffected) == ["/usr", "/usr/lib/pkg"]
+
+
+def testPathsAreNotListedIfNotWanted(tmp_path, monkeypatch):
+	i = makeInfo(tmp_path, b"d3:pkgd1:A5:amd641:V3:1.0ee")
+	monkeypatch.setattr(dpkg.ListFile, "find", None)
+	(evt,) = i.toEvents(withPaths=False)
+	assert evt.pathsAffected is None
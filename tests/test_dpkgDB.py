@@ -0,0 +1,65 @@
+from pkgman_triggers.backends import dpkgDB
+from pkgman_triggers.backends.dpkgDB import StatusDB, indexStatus
+
+statusFile = b"""Package: libfoo
+Status: install ok installed
+Architecture: amd64
+Version: 1.0
+Description: foo
+ Package: not-a-package
+
+Original-Package: not-a-package-either
+Package: libfoo
+Architecture: i386
+Version: 1.1
+
+Status: install ok installed
+
+Package: bar
+Architecture: all
+Version: 2.0"""
+
+
+def testIndexStatus():
+	offsets = indexStatus(statusFile)
+	assert set(offsets) == {"libfoo", "bar"}
+	assert [statusFile[start:end].split(b"\n")[-1] for start, end in offsets["libfoo"]] == [b" Package: not-a-package", b"Version: 1.1"]
+	assert statusFile[slice(*offsets["bar"][0])].endswith(b"Version: 2.0")
+	assert indexStatus(b"") == {}
+
+
+def testStatusDB(tmp_path):
+	statusPath = tmp_path / "status"
+	statusPath.write_bytes(statusFile)
+	with StatusDB(statusPath, None) as db:
+		assert "libfoo" in db and "not-a-package" not in db
+		assert db.getPackageInfo("libfoo").version == "1.0"
+		assert db.getPackageInfo("libfoo", "i386").version == "1.1"
+		assert db.getPackageInfo("libfoo", "arm64") is None
+		assert db.getPackageInfo("bar", "arm64").version == "2.0"
+		assert db.getStanza("libfoo")["Description"] == "foo\nPackage: not-a-package"
+
+	statusPath.write_bytes(b"")
+	with StatusDB(statusPath, None) as db:
+		assert db.getPackageInfo("libfoo") is None
+
+
+def testOffsetsAreCached(tmp_path, monkeypatch):
+	statusPath = tmp_path / "status"
+	cachePath = tmp_path / "offsets.json"
+	statusPath.write_bytes(statusFile)
+	with StatusDB(statusPath, cachePath):
+		pass
+	assert cachePath.is_file()
+
+	index = dpkgDB.indexStatus
+	monkeypatch.setattr(dpkgDB, "indexStatus", None)
+	with StatusDB(statusPath, cachePath) as db:
+		assert db.getPackageInfo("bar").version == "2.0"
+
+	statusPath.write_bytes(statusFile.replace(b"Version: 2.0", b"Version: 2.0.1"))
+	reindexed = []
+	monkeypatch.setattr(dpkgDB, "indexStatus", lambda buf: reindexed.append(buf) or index(buf))
+	with StatusDB(statusPath, cachePath) as db:
+		assert db.getPackageInfo("bar").version == "2.0.1"
+	assert len(reindexed) == 1
@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+from pkgman_triggers import TriggerManager
+from pkgman_triggers.AuthDB import AuthDB
+from pkgman_triggers.discovery import DiscoveredEntryPoint
+from pkgman_triggers.triggers import Trigger
+
+
+class Flaky:
+	"""Fails on the odd match results"""
+
+	__slots__ = ("calls",)
+
+	def __init__(self):
+		self.calls = []
+
+	def __call__(self, matchResults):
+		self.calls.append(matchResults)
+		if matchResults % 2:
+			raise ValueError(matchResults)
+
+
+def makeManager(tmp_path, func):
+	db = AuthDB(tmp_path / "db.sqlite").__enter__()
+	packageId = db.registerPackage("pkg", tmp_path)
+	t = Trigger(DiscoveredEntryPoint("t", "fake", ("trigger",), None, None), [], executor="inline")
+	t.id = db.registerTrigger(packageId, "t")
+	t.status = True
+	t.func = func
+
+	tm = TriggerManager()
+	tm.db = db
+	tm.registeredModules = {packageId: SimpleNamespace(status=True, registeredTriggers={t.id: t})}
+	return tm, t
+
+
+def testDrainMakesSinglePass(tmp_path):
+	func = Flaky()
+	tm, t = makeManager(tmp_path, func)
+	tm.db.enqueue((t.id, str(i)) for i in range(7))
+
+	for maxAttempts in (None, 2):
+		func.calls.clear()
+		report = tm.drain(batchSize=3, maxAttempts=maxAttempts)
+		assert func.calls == ([0, 1, 2, 3, 4, 5, 6] if maxAttempts is None else [1, 3, 5])
+		assert len(report.errors) == 3
+
+	func.calls.clear()
+	assert not tm.drain(batchSize=3, maxAttempts=2)
+	assert not func.calls
+	assert [r["attempts"] for r in tm.db.fetchQueued(10)] == [2, 2, 2]
+	tm.db.__exit__(None, None, None)
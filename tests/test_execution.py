@@ -0,0 +1,68 @@
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from pkgman_triggers.discovery import DiscoveredEntryPoint
+from pkgman_triggers.execution import Dispatcher
+from pkgman_triggers.triggers import Trigger
+
+repoRoot = Path(__file__).absolute().parent.parent
+
+hungTriggerScript = """
+import sys, time
+from pkgman_triggers.discovery import DiscoveredEntryPoint
+from pkgman_triggers.execution import Dispatcher
+from pkgman_triggers.triggers import Trigger
+
+t = Trigger(DiscoveredEntryPoint("hung", "time", ("sleep",), None, None), [], executor=sys.argv[1], timeout=0.2, ordered=sys.argv[2] == "1")
+t.func = time.sleep
+with Dispatcher() as d:
+	d.submit(t, 5)
+	report = d.finish()
+assert isinstance(report.errors[0].error, TimeoutError), report
+"""
+
+
+@pytest.mark.parametrize("executor", ("thread", "process"))
+@pytest.mark.parametrize("ordered", (False, True))
+def testTimedOutTriggerDoesNotDelayExit(executor, ordered):
+	started = time.monotonic()
+	subprocess.run([sys.executable, "-c", hungTriggerScript, executor, str(int(ordered))], cwd=str(repoRoot), check=True, timeout=30)
+	assert time.monotonic() - started < 4
+
+
+def makeTrigger(func, timeout, executor="thread"):
+	t = Trigger(DiscoveredEntryPoint(func.__name__, "fake", ("trigger",), None, None), [], executor=executor, timeout=timeout)
+	t.func = func
+	return t
+
+
+def testHungWorkerIsReplaced():
+	def hung(matchResults):
+		time.sleep(5)
+
+	def quick(matchResults):
+		return matchResults
+
+	with Dispatcher(maxWorkers=1) as d:
+		d.submit(makeTrigger(hung, 0.2), None)
+		d.submit(makeTrigger(quick, 2), 42)
+		report = d.finish()
+	assert isinstance(report[0].error, TimeoutError)
+	assert report[1].ok and report[1].result == 42
+	assert d.metrics.counters["abandonedThreads"] == 1
+
+
+def testProcessWorkersAreNotForked():
+	import wave  # pylint:disable=import-outside-toplevel,unused-import  # a marker a forked worker would inherit
+
+	t = Trigger(DiscoveredEntryPoint("inherits", "sys", ("modules", "__contains__"), None, None), [], executor="process")
+	with Dispatcher() as d:
+		d.getThreadPool().submit(time.sleep, 0)
+		d.submit(t, "wave")
+		report = d.finish()
+	assert report[0].ok, report
+	assert report[0].result is False